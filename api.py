@@ -117,6 +117,21 @@ class OrderItemResponse(BaseModel):
     product_name: Optional[str] = None
     description: Optional[str] = None
 
+class OrderTotalsRequest(BaseModel):
+    """批量查询订单总金额请求"""
+    order_ids: List[int] = Field(..., description="订单ID列表")
+    recompute: bool = Field(False, description="先按订单项重新汇总这些订单的总金额（修复历史漂移数据）")
+
+class OrderTotal(BaseModel):
+    """订单总金额"""
+    order_id: int
+    total_amount: float
+
+class OrderTotalsResponse(BaseModel):
+    """批量订单总金额，按请求顺序排列"""
+    totals: List[OrderTotal]
+    missing: List[int] = Field(..., description="不存在的订单ID")
+
 class ChangePasswordRequest(BaseModel):
     """修改密码请求"""
     new_password: str = Field(..., min_length=6, description="新密码")
@@ -124,11 +139,30 @@ class ChangePasswordRequest(BaseModel):
 class SearchRequest(BaseModel):
     """搜索请求"""
     keyword: str = Field(..., description="搜索关键词")
+    limit: int = Field(20, ge=1, le=code.MAX_PAGE_SIZE, description="每页数量")
+    offset: int = Field(0, ge=0, description="结果偏移量")
+
+class BulkRowError(BaseModel):
+    """批量导入中失败的行"""
+    index: int = Field(..., description="行号（从0开始，CSV 不含表头）")
+    error: str
+
+class BulkImportResponse(BaseModel):
+    """批量导入结果"""
+    total: int
+    inserted: int
+    failed: int
+    ids: List[Optional[int]] = Field(..., description="与输入行对齐的新主键，失败的行为 null")
+    errors: List[BulkRowError]
 
 class UpdateStockRequest(BaseModel):
     """更新库存请求"""
     stock_quantity: int = Field(..., ge=0, description="库存数量")
 
+class AdjustStockRequest(BaseModel):
+    """增减库存请求"""
+    delta: int = Field(..., description="库存变化量，负数为扣减")
+
 class UpdateOrderStatusRequest(BaseModel):
     """更新订单状态请求"""
     status: str = Field(..., description="订单状态")
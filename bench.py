@@ -0,0 +1,513 @@
+"""
+服务端负载基准
+回放请求日志，或按 OpenAPI 规范（openapi_spec.json）生成合成请求混合，在进程内（ASGI 直接调用 server.app）
+或经 HTTP 以给定并发压测，按路由输出吞吐与 p50/p95/p99 延迟；两次运行的结果可以对比，服务层的性能回退以数字体现。
+
+请求日志为 NDJSON，每行 {"method": "GET", "path": "/products?limit=20", "body": {...}}，body 可省略，
+缺少 method/path 的行（如其他用途的 jsonl）跳过并计数；--save-log 把本次的请求序列写成同样格式，之后可原样回放。
+进程内模式默认使用本地数据库替身（local_db.py），每次运行新建 SQLite 文件并写入确定性的合成数据；
+--db mysql 时按 server.py 的 DB_* 环境变量连接真实库。经 HTTP 压测时由被测服务自行连接数据库。
+
+    python bench.py run --openapi openapi_spec.json --requests 5000 --concurrency 32 --output base.json
+    python bench.py run --log recorded.ndjson --url http://localhost:8000 --output new.json
+    python bench.py compare base.json new.json --threshold 10
+"""
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import http.client
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+READ_METHODS = ("GET",)
+
+# 请求体中引用其他实体的字段及其所属资源（合成数据规模参数名）
+ID_FIELDS = {"user_id": "users", "product_id": "products", "category_id": "categories",
+             "parent_id": "categories", "order_id": "orders"}
+
+SEARCH_KEYWORDS = ["商品", "描述", "正品保障", "商品 1", "商品 42"]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩百分位数，sorted_values 须已升序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+# ============================================================================
+# 请求来源：日志回放与 OpenAPI 合成混合
+# ============================================================================
+
+def load_log(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """读取 NDJSON 请求日志，返回 (请求列表, 跳过的行数)"""
+    requests, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or not entry.get("method") or not str(entry.get("path", "")).startswith("/"):
+                skipped += 1
+                continue
+            requests.append({"method": entry["method"].upper(), "path": entry["path"], "body": entry.get("body")})
+    return requests, skipped
+
+
+def save_log(path: str, requests: Iterable[Dict[str, Any]]):
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            entry = {"method": request["method"], "path": request["path"]}
+            if request.get("body") is not None:
+                entry["body"] = request["body"]
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class RouteMatcher:
+    """把具体路径归到路由模板，按模板汇总延迟；模板取自 OpenAPI 规范，未知路径的数字段记为 {id}"""
+
+    def __init__(self, templates: Iterable[str] = ()):
+        # 参数少的模板优先，/categories/root 先于 /categories/{id}
+        ordered = sorted(set(templates), key=lambda t: (t.count("{"), t))
+        self._patterns = [
+            (re.compile("^" + re.sub(r"\\\{\w+\\\}", "[^/]+", re.escape(t)) + "$"), t) for t in ordered
+        ]
+
+    def route(self, method: str, path: str) -> str:
+        path = path.split("?", 1)[0]
+        for pattern, template in self._patterns:
+            if pattern.match(path):
+                return f"{method} {template}"
+        return f"{method} " + re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+class MixGenerator:
+    """按 OpenAPI 规范生成合成请求：读操作等权，写操作合计占 write_ratio，路径参数与请求体取自合成数据的取值范围"""
+
+    def __init__(self, spec: Dict[str, Any], sizes: Dict[str, int], write_ratio: float = 0.1,
+                 include_deletes: bool = False, seed: int = 42):
+        self.schemas = spec.get("components", {}).get("schemas", {})
+        self.sizes = sizes
+        self.rng = random.Random(seed)
+        self._nonce = uuid.uuid4().hex[:8]
+        self._counter = itertools.count(1)
+        reads, writes = [], []
+        for template, operations in spec.get("paths", {}).items():
+            for method, operation in operations.items():
+                method = method.upper()
+                if method == "DELETE" and not include_deletes:
+                    continue
+                body = operation.get("requestBody", {}).get("content", {}).get("application/json", {}).get("schema")
+                entry = (method, template, body.get("$ref") if body else None)
+                (reads if method in READ_METHODS else writes).append(entry)
+        self.operations = reads + writes
+        read_weight = (1 - write_ratio) / len(reads) if reads else 0.0
+        write_weight = write_ratio / len(writes) if writes else 0.0
+        self.weights = [read_weight] * len(reads) + [write_weight] * len(writes)
+
+    def _id(self, resource: str) -> int:
+        return self.rng.randint(1, max(1, self.sizes.get(resource, 1)))
+
+    def _path(self, template: str) -> str:
+        segments = template.strip("/").split("/")
+        resource = segments[0]
+        result = []
+        for i, segment in enumerate(segments):
+            if not segment.startswith("{"):
+                result.append(segment)
+                continue
+            previous = segments[i - 1] if i else ""
+            if previous == "username":
+                result.append(f"user{self._id('users')}")
+            elif previous == "email":
+                result.append(urllib.parse.quote(f"user{self._id('users')}@example.com"))
+            else:
+                # /orders/user/{id} 之类的参数属于前一段的资源
+                owner = previous + "s" if previous + "s" in self.sizes else resource
+                result.append(str(self._id(owner)))
+        return "/" + "/".join(result)
+
+    def _value(self, field: str, schema: Dict[str, Any]) -> Any:
+        rng = self.rng
+        if field == "username":
+            return f"bench_{self._nonce}_{next(self._counter)}"
+        if field == "email":
+            return f"bench_{self._nonce}_{next(self._counter)}@example.com"
+        if field in ("password", "new_password"):
+            return "bench-password"
+        if field in ID_FIELDS:
+            return self._id(ID_FIELDS[field])
+        if field == "items":
+            return [{"product_id": self._id("products"), "quantity": rng.randint(1, 3),
+                     "unit_price": round(rng.uniform(1, 999), 2)} for _ in range(rng.randint(1, 3))]
+        if field == "keyword":
+            return rng.choice(SEARCH_KEYWORDS)
+        if field == "status":
+            return rng.choice(["pending", "paid", "shipped"])
+        if field == "stock_quantity":
+            return rng.randint(100, 500)
+        if field == "quantity":
+            return rng.randint(1, 3)
+        if field == "delta":
+            return rng.randint(1, 5)
+        schema_type = schema.get("type")
+        if schema_type == "integer":
+            return rng.randint(1, 100)
+        if schema_type == "number":
+            return round(rng.uniform(1, 999), 2)
+        if schema_type == "array":
+            return []
+        return f"bench {field}"
+
+    def _body(self, ref: Optional[str]) -> Optional[Dict[str, Any]]:
+        if ref is None:
+            return None
+        schema = self.schemas.get(ref.rsplit("/", 1)[-1], {})
+        return {field: self._value(field, spec) for field, spec in schema.get("properties", {}).items()}
+
+    def generate(self, count: int) -> Iterator[Dict[str, Any]]:
+        for method, template, ref in self.rng.choices(self.operations, self.weights, k=count):
+            yield {"method": method, "path": self._path(template), "body": self._body(ref)}
+
+
+# ============================================================================
+# 压测目标：进程内 ASGI 与 HTTP
+# ============================================================================
+
+class ASGITarget:
+    """直接以 ASGI 协议调用应用（含 lifespan 启停事件），不经过网络与 HTTP 解析"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan = None
+
+    async def start(self):
+        self._to_app, self._from_app = asyncio.Queue(), asyncio.Queue()
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self._lifespan = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        await self._to_app.put({"type": "lifespan.startup"})
+        message = await self._from_app.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"应用启动失败: {message.get('message', message['type'])}")
+
+    async def close(self):
+        if self._lifespan is None:
+            return
+        await self._to_app.put({"type": "lifespan.shutdown"})
+        await self._from_app.get()
+        await self._lifespan
+
+    async def request(self, method: str, path: str, body: Any = None) -> int:
+        path, _, query = path.partition("?")
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else b""
+        headers = [(b"host", b"bench"), (b"content-length", str(len(payload)).encode())]
+        if body is not None:
+            headers.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": urllib.parse.unquote(path), "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "", "headers": headers,
+            "client": ("127.0.0.1", 0), "server": ("bench", 80), "state": {},
+        }
+        body_sent = False
+        status = 0
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            # 客户端不会断开；流式响应监听断开的任务在响应结束后被取消
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await self.app(scope, receive, send)
+        return status
+
+
+class HTTPTarget:
+    """经 HTTP/1.1 长连接压测：每个工作线程一个连接，读完响应体后复用"""
+
+    def __init__(self, url: str, concurrency: int, timeout: float = 30.0):
+        parts = urllib.parse.urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method: str, path: str, body: Any) -> int:
+        conn = self._connection()
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        try:
+            conn.request(method, self.base_path + path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    async def request(self, method: str, path: str, body: Any = None) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._request, method, path, body)
+
+
+def load_app(db: str, sizes: Dict[str, int], workdir: str):
+    """以包的形式导入 server（server.py 相对导入 api），db 为 local 时先建好本地数据库替身"""
+    if db == "local":
+        import local_db
+        path = os.path.join(workdir, "bench.sqlite3")
+        local_db.LocalDatabase(path).seed(**sizes)
+        os.environ["DB_BACKEND"] = "local"
+        os.environ["LOCAL_DB_PATH"] = path
+    os.environ.setdefault("SLOW_QUERY_DUMP", os.path.join(workdir, "slow_queries.ndjson"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    sys.path.append(os.path.dirname(here))
+    return importlib.import_module(f"{os.path.basename(here)}.server").app
+
+
+# ============================================================================
+# 执行与汇总
+# ============================================================================
+
+async def drive(target, requests: List[Dict[str, Any]], concurrency: int,
+                duration: Optional[float] = None) -> Tuple[Dict[str, List[Tuple[float, int]]], float]:
+    """concurrency 个工作协程依次取请求执行，返回 ({路由: [(毫秒, 状态码)]}, 总耗时秒)；状态码 0 表示请求异常"""
+    samples = defaultdict(list)
+    pending = iter(requests)
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    async def worker():
+        for request in pending:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            began = time.perf_counter()
+            try:
+                status = await target.request(request["method"], request["path"], request.get("body"))
+            except Exception:
+                status = 0
+            samples[request["route"]].append(((time.perf_counter() - began) * 1000, status))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def _stats(samples: List[Tuple[float, int]], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(ms for ms, _ in samples)
+    return {
+        "count": len(samples),
+        "errors": sum(1 for _, status in samples if status == 0 or status >= 500),
+        "client_errors": sum(1 for _, status in samples if 400 <= status < 500),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+def summarize(samples: Dict[str, List[Tuple[float, int]]], elapsed: float, meta: Dict[str, Any]) -> Dict[str, Any]:
+    everything = [sample for route_samples in samples.values() for sample in route_samples]
+    return {
+        "meta": dict(meta, elapsed_s=round(elapsed, 3)),
+        "total": _stats(everything, elapsed),
+        "routes": {route: _stats(route_samples, elapsed) for route, route_samples in sorted(samples.items())},
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    meta, total = result["meta"], result["total"]
+    print(f"目标: {meta['target']}  来源: {meta['source']}  并发: {meta['concurrency']}  "
+          f"请求: {total['count']}  耗时: {meta['elapsed_s']}s  吞吐: {total['rps']} req/s")
+    print(f"{'路由':<40}{'次数':>7}{'错误':>6}{'4xx':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for route, stats in list(result["routes"].items()) + [("总计", total)]:
+        print(f"{route:<40}{stats['count']:>7}{stats['errors']:>6}{stats['client_errors']:>6}{stats['rps']:>9.1f}"
+              f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}")
+
+
+def _change(base: float, new: float) -> Optional[float]:
+    return (new - base) / base * 100 if base else None
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float, min_count: int = 30) -> int:
+    """逐路由对比两次运行并打印，返回回退的路由数：p95 延迟升高或吞吐下降超过 threshold%
+
+    样本数少于 min_count 的路由百分位数不稳定，只列出不判定。
+    """
+    regressions = 0
+    print(f"{'路由':<40}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}{'req/s':>20}")
+    rows = [(route, base["routes"].get(route), new["routes"].get(route))
+            for route in sorted(set(base["routes"]) | set(new["routes"]))]
+    rows.append(("总计", base["total"], new["total"]))
+    for route, old, cur in rows:
+        if old is None or cur is None:
+            print(f"{route:<40}{'仅在' + ('新' if old is None else '基准') + '运行中出现':>20}")
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            delta = _change(old[key], cur[key])
+            cells.append(f"{old[key]:.2f}→{cur[key]:.2f}" + (f" {delta:+.0f}%" if delta is not None else ""))
+        p95_delta, rps_delta = _change(old["p95_ms"], cur["p95_ms"]), _change(old["rps"], cur["rps"])
+        regressed = min(old["count"], cur["count"]) >= min_count and (
+            (p95_delta is not None and p95_delta > threshold) or (rps_delta is not None and rps_delta < -threshold)
+        )
+        regressions += regressed and route != "总计"
+        print(f"{route:<40}" + "".join(f"{cell:>20}" for cell in cells) + ("  回退" if regressed else ""))
+    return regressions
+
+
+async def run(args) -> Dict[str, Any]:
+    sizes = {"users": args.users, "categories": args.categories, "products": args.products, "orders": args.orders}
+    spec = None
+    if args.openapi and os.path.exists(args.openapi):
+        with open(args.openapi, encoding="utf-8") as f:
+            spec = json.load(f)
+    elif not args.log:
+        raise SystemExit(f"找不到 OpenAPI 规范: {args.openapi}")
+    matcher = RouteMatcher(spec.get("paths", {}) if spec else ())
+    total = args.requests + args.warmup
+    if args.log:
+        requests, skipped = load_log(args.log)
+        if skipped:
+            print(f"跳过 {skipped} 行非请求记录")
+        if not requests:
+            raise SystemExit(f"{args.log} 中没有可回放的请求")
+        requests = list(itertools.islice(itertools.cycle(requests), total))
+        source = args.log
+    else:
+        generator = MixGenerator(spec, sizes, args.write_ratio, args.deletes, args.seed)
+        requests = list(generator.generate(total))
+        source = f"{args.openapi}（写比例 {args.write_ratio}）"
+    if args.save_log:
+        save_log(args.save_log, requests)
+    for request in requests:
+        request["route"] = matcher.route(request["method"], request["path"])
+
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        if args.url:
+            target = HTTPTarget(args.url, args.concurrency)
+            target_name = args.url
+        else:
+            target = ASGITarget(load_app(args.db, sizes, workdir))
+            # 服务层逐条记录的 INFO 日志会成为压测的主要开销
+            logging.disable(logging.INFO)
+            target_name = f"进程内（{args.db}）"
+        await target.start()
+        try:
+            if args.warmup:
+                await drive(target, requests[:args.warmup], args.concurrency)
+            samples, elapsed = await drive(target, requests[args.warmup:], args.concurrency, args.duration)
+        finally:
+            await target.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = {
+        "target": target_name,
+        "source": source,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "env": {key: value for key, value in os.environ.items()
+                if key.split("_")[0] in ("DB", "CACHE", "FAST", "LIST", "SEARCH", "INVENTORY", "ORDER")},
+    }
+    return summarize(samples, elapsed, meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务端负载基准")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="执行一次压测")
+    source = run_parser.add_mutually_exclusive_group()
+    source.add_argument("--log", help="NDJSON 请求日志")
+    source.add_argument("--openapi", default="openapi_spec.json", help="生成合成请求混合所用的 OpenAPI 规范")
+    run_parser.add_argument("--url", help="被测服务地址；不给出时在进程内调用 server.app")
+    run_parser.add_argument("--db", choices=["local", "mysql"], default="local", help="进程内模式的数据库")
+    run_parser.add_argument("--requests", type=int, default=2000)
+    run_parser.add_argument("--warmup", type=int, default=100, help="预热请求数，不计入结果")
+    run_parser.add_argument("--duration", type=float, help="最长运行秒数，先到为准")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--write-ratio", type=float, default=0.1, help="合成混合中写请求的比例")
+    run_parser.add_argument("--deletes", action="store_true", help="合成混合包含 DELETE 请求")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--users", type=int, default=1000)
+    run_parser.add_argument("--categories", type=int, default=50)
+    run_parser.add_argument("--products", type=int, default=5000)
+    run_parser.add_argument("--orders", type=int, default=5000)
+    run_parser.add_argument("--save-log", help="把本次请求序列写为 NDJSON 日志")
+    run_parser.add_argument("--output", help="结果写入 JSON 文件，供 compare 使用")
+
+    compare_parser = commands.add_parser("compare", help="对比两次运行的结果")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="判定回退的变化百分比")
+    compare_parser.add_argument("--min-count", type=int, default=30, help="参与判定的路由最少样本数")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_count)
+        print(f"\n{regressions} 个路由回退（阈值 {args.threshold}%）")
+        sys.exit(1 if regressions else 0)
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
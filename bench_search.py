@@ -0,0 +1,125 @@
+"""
+商品检索基准
+对比倒排索引（search.ProductSearchIndex）与 LIKE '%keyword%' 路径的建索引耗时、内存与查询延迟。
+
+默认生成 100 万条合成商品，LIKE 路径以等价的 Python 子串全表扫描模拟；
+给出 --host 等数据库参数时改为对真实库执行 ProductService.search_products，
+并以该库中的商品建索引（--products 参数此时忽略）。
+
+    python bench_search.py --products 1000000
+    python bench_search.py --host localhost --database test1 --user root --password ...
+"""
+
+import argparse
+import random
+import resource
+import statistics
+import time
+
+from search import ProductSearchIndex
+
+BRANDS = ["华为", "小米", "苹果", "联想", "索尼", "戴尔", "美的", "格力", "海尔", "三星",
+          "Apple", "Sony", "Dell", "Lenovo", "Xiaomi", "Nike", "Adidas", "Canon"]
+NOUNS = ["智能手机", "笔记本电脑", "平板电脑", "蓝牙耳机", "机械键盘", "无线鼠标", "显示器", "空调",
+         "冰箱", "洗衣机", "电饭煲", "运动鞋", "双肩包", "相机", "手表", "充电器", "路由器", "音箱"]
+ADJECTIVES = ["轻薄", "高性能", "旗舰", "入门", "便携", "静音", "节能", "防水", "降噪", "游戏",
+              "商务", "家用", "专业", "pro", "max", "mini", "ultra", "lite"]
+PHRASES = ["正品保障", "全国联保", "限时特惠", "官方旗舰店", "支持7天无理由退货", "赠送延保服务",
+           "高清大屏", "超长续航", "快速充电", "大容量", "低噪音运行", "一级能效", "wifi 6", "type-c 接口"]
+
+DEFAULT_QUERIES = ["智能手机", "蓝牙耳机", "降噪", "华为 笔记本电脑", "pro", "一级能效 空调", "相机"]
+
+
+def synthetic_products(count: int, seed: int = 42):
+    """按固定随机种子生成中英文混合的商品行"""
+    rng = random.Random(seed)
+    for product_id in range(1, count + 1):
+        name = f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)}{rng.choice(NOUNS)} {rng.randint(1, 999)}"
+        description = "，".join(rng.sample(PHRASES, 3))
+        yield {"product_id": product_id, "product_name": name, "description": description}
+
+
+def like_scan(products, keyword: str, limit: int):
+    """与 LIKE '%keyword%' ORDER BY product_name 等价的全表扫描"""
+    needle = keyword.lower()
+    hits = [p for p in products
+            if needle in p["product_name"].lower() or needle in (p["description"] or "").lower()]
+    hits.sort(key=lambda p: (p["product_name"], p["product_id"]))
+    return hits[:limit], len(hits)
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(fn, repeat: int):
+    """执行 repeat 次，返回 (最后一次结果, 各次耗时毫秒)"""
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, timings
+
+
+def report(label: str, timings):
+    print(f"  {label:<10} 中位 {statistics.median(timings):9.2f} ms   最大 {max(timings):9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="倒排索引与 LIKE 检索的基准对比")
+    parser.add_argument("--products", type=int, default=1_000_000, help="合成商品数量")
+    parser.add_argument("--queries", nargs="*", default=DEFAULT_QUERIES, help="检索词")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5, help="每个检索词重复次数")
+    parser.add_argument("--skip-like", action="store_true", help="不运行 LIKE 路径（大数据量时较慢）")
+    parser.add_argument("--host", help="给出时对真实数据库执行 LIKE 查询")
+    parser.add_argument("--database", default="test1")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+
+    db = None
+    if args.host:
+        from code import DatabaseManager, ProductService
+        db = DatabaseManager(host=args.host, database=args.database,
+                             user=args.user, password=args.password)
+        db.connect()
+        service = ProductService(db)
+        source = f"{args.host}/{args.database}"
+        products = None
+        rows = db.fetch_iter(ProductService.SEARCH_INDEX_QUERY)
+    else:
+        source = "合成数据"
+        products = list(synthetic_products(args.products))
+        rows = products
+
+    try:
+        rss_before = max_rss_mb()
+        index = ProductSearchIndex()
+        start = time.perf_counter()
+        index.load(rows)
+        build_seconds = time.perf_counter() - start
+        print(f"数据来源: {source}，商品数 {len(index)}")
+        print(f"建索引耗时 {build_seconds:.1f} s，峰值内存增长约 {max_rss_mb() - rss_before:.0f} MB")
+
+        for keyword in args.queries:
+            (hits, total), index_ms = timed(lambda: index.search(keyword, args.limit), args.repeat)
+            print(f"检索 '{keyword}'：索引命中 {total}")
+            report("索引", index_ms)
+            if args.skip_like:
+                continue
+            if db is not None:
+                like_rows, like_ms = timed(lambda: service.search_products(keyword), args.repeat)
+                like_total = len(like_rows)
+            else:
+                (_, like_total), like_ms = timed(lambda: like_scan(products, keyword, args.limit), args.repeat)
+            print(f"  LIKE 命中 {like_total}")
+            report("LIKE", like_ms)
+    finally:
+        if db is not None:
+            db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
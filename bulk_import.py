@@ -0,0 +1,264 @@
+"""
+批量导入
+增量解析 JSON 数组 / NDJSON / CSV 格式的用户与商品数据，按请求模型逐行校验后分批写入。
+server.py 的 /users/bulk、/products/bulk 端点与本文件的命令行离线导入共用这里的解析与汇总逻辑。
+
+    python bulk_import.py products catalog.csv --host localhost --database test1 --user root --password ...
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import codecs
+import csv
+import json
+import os
+import sys
+
+from pydantic import ValidationError
+
+FORMATS = ("json", "ndjson", "csv")
+
+CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+EXTENSIONS = {".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+
+# 每批交给服务层的行数；服务层再按 bulk_chunk_rows 切分为多个事务
+BATCH_ROWS = 5000
+
+
+def format_for_content_type(content_type: Optional[str]) -> Optional[str]:
+    """由 Content-Type 判断请求体格式，无法识别时返回 None"""
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+def format_for_path(path: str) -> Optional[str]:
+    """由文件扩展名判断格式"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+class RecordParser:
+    """增量解析器：feed() 传入字节片段，返回其中已完整的记录 [(行号, 记录, 错误信息)]
+
+    NDJSON 每行一条记录，单行格式错误只影响该行；CSV 首行为表头，引号内可含换行，
+    空字段视为未提供；JSON 数组需读完整个请求体才能解析，格式错误时 close() 抛出 ValueError。
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的导入格式: {fmt}")
+        self.fmt = fmt
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._pending = ""      # CSV 中尚未闭合引号的记录
+        self._header = None
+        self._index = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+        self._buffer += self._decoder.decode(data)
+        if self.fmt == "json":
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self) -> List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+        self._buffer += self._decoder.decode(b"", final=True)
+        text, self._buffer = self._buffer, ""
+        if self.fmt == "json":
+            return self._parse_array(text)
+        records = self._parse_lines([text] if text else [])
+        if self._pending:
+            records.append(self._error("CSV 引号未闭合"))
+            self._pending = ""
+        return records
+
+    def _parse_array(self, text: str):
+        if not text.strip():
+            return []
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"JSON 格式错误: {e}") from e
+        if not isinstance(items, list):
+            raise ValueError("JSON 请求体应为数组")
+        return [self._record(item) for item in items]
+
+    def _parse_lines(self, lines: List[str]):
+        records = []
+        for line in lines:
+            if self.fmt == "ndjson":
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(self._record(json.loads(line)))
+                except ValueError as e:
+                    records.append(self._error(f"JSON 格式错误: {e}"))
+                continue
+            # CSV：引号个数为奇数说明字段内含换行，与下一行拼接
+            self._pending += line + "\n"
+            if self._pending.count('"') % 2:
+                continue
+            text, self._pending = self._pending.rstrip("\r\n"), ""
+            if not text.strip():
+                continue
+            values = next(csv.reader([text]))
+            if self._header is None:
+                self._header = [name.strip() for name in values]
+            elif len(values) != len(self._header):
+                records.append(self._error(f"CSV 列数为 {len(values)}，表头为 {len(self._header)}"))
+            else:
+                records.append(self._record({k: v for k, v in zip(self._header, values) if v != ""}))
+        return records
+
+    def _record(self, item):
+        if not isinstance(item, dict):
+            return self._error("记录应为对象")
+        index, self._index = self._index, self._index + 1
+        return index, item, None
+
+    def _error(self, message: str):
+        index, self._index = self._index, self._index + 1
+        return index, None, message
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+class BulkImporter:
+    """解析 + 校验 + 汇总
+
+    feed()/close() 返回校验通过、已攒满的批次 [(行号, 字段)]，调用方写入后把写入函数的
+    (主键列表, [(批内行号, 错误)]) 交给 record()；result() 汇总为与输入行对齐的结果。
+    """
+
+    def __init__(self, fmt: str, model, batch_rows: int = BATCH_ROWS):
+        self.parser = RecordParser(fmt)
+        self.model = model
+        self.batch_rows = batch_rows
+        self._batch = []
+        self._ids = {}
+        self._errors = []
+        self.total = 0
+
+    def feed(self, data: bytes) -> List[List[Tuple[int, Dict[str, Any]]]]:
+        return self._collect(self.parser.feed(data), final=False)
+
+    def close(self) -> List[List[Tuple[int, Dict[str, Any]]]]:
+        return self._collect(self.parser.close(), final=True)
+
+    def _collect(self, records, final: bool):
+        batches = []
+        for index, record, error in records:
+            self.total += 1
+            if error is None:
+                try:
+                    self._batch.append((index, self.model(**record).dict()))
+                except ValidationError as e:
+                    error = _validation_message(e)
+            if error is not None:
+                self._errors.append((index, error))
+            if len(self._batch) >= self.batch_rows:
+                batches.append(self._batch)
+                self._batch = []
+        if final and self._batch:
+            batches.append(self._batch)
+            self._batch = []
+        return batches
+
+    def record(self, batch: List[Tuple[int, Dict[str, Any]]],
+               outcome: Tuple[List[Optional[int]], List[Tuple[int, str]]]):
+        ids, errors = outcome
+        for (index, _), new_id in zip(batch, ids):
+            if new_id is not None:
+                self._ids[index] = new_id
+        self._errors.extend((batch[position][0], message) for position, message in errors)
+
+    def result(self) -> Dict[str, Any]:
+        errors = sorted(self._errors)
+        return {
+            "total": self.total,
+            "inserted": len(self._ids),
+            "failed": len(errors),
+            "ids": [self._ids.get(index) for index in range(self.total)],
+            "errors": [{"index": index, "error": message} for index, message in errors],
+        }
+
+
+def main():
+    from api import ProductCreateRequest, UserCreateRequest
+    from code import BulkInsertError, DatabaseManager, ProductService, UserService
+    from versions import NULL_VERSIONS, SharedVersions
+
+    parser = argparse.ArgumentParser(description="离线批量导入用户或商品")
+    parser.add_argument("entity", choices=("users", "products"))
+    parser.add_argument("path", help="数据文件，- 表示标准输入")
+    parser.add_argument("--format", choices=FORMATS, help="默认按扩展名判断")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--database", default="test1")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--redis-url", default=os.environ.get("CACHE_REDIS_URL"),
+                        help="服务端的共享存储，导入后递增其中的版本计数器使条件 GET 的 ETag 失效")
+    args = parser.parse_args()
+
+    fmt = args.format or (format_for_path(args.path) if args.path != "-" else None)
+    if fmt is None:
+        parser.error("无法由文件名判断格式，请指定 --format")
+
+    if args.redis_url:
+        import redis
+        counters = SharedVersions(redis.Redis.from_url(args.redis_url))
+    else:
+        print("未指定 --redis-url，服务端的 ETag 不会因本次导入失效", file=sys.stderr)
+        counters = NULL_VERSIONS
+
+    db = DatabaseManager(host=args.host, database=args.database, user=args.user, password=args.password)
+    db.connect()
+    try:
+        if args.entity == "users":
+            model, write = UserCreateRequest, UserService(db, versions=counters).create_users
+        else:
+            model, write = ProductCreateRequest, ProductService(db, versions=counters).create_products
+        importer = BulkImporter(fmt, model, args.batch_rows)
+        stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+
+        def write_batch(batch):
+            try:
+                importer.record(batch, write([row for _, row in batch]))
+            except BulkInsertError as e:
+                importer.record(batch, (e.ids, e.errors))
+                raise
+
+        interrupted = None
+        try:
+            with stream:
+                for data in iter(lambda: stream.read(1 << 20), b""):
+                    for batch in importer.feed(data):
+                        write_batch(batch)
+                for batch in importer.close():
+                    write_batch(batch)
+        except BulkInsertError as e:
+            interrupted = e
+        result = importer.result()
+        for error in result["errors"]:
+            print(f"第 {error['index']} 行: {error['error']}", file=sys.stderr)
+        print(f"共 {result['total']} 行，成功 {result['inserted']} 行，失败 {result['failed']} 行")
+        if interrupted is not None:
+            print(f"导入中断，其余行未读取: {interrupted}", file=sys.stderr)
+        sys.exit(1 if result["failed"] or interrupted is not None else 0)
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+实体缓存
+为 code.py 中按ID读取的服务方法提供读穿透缓存，写操作提交后按键或标签精确失效
+
+读穿透在查库前取得填充令牌（fill_token），回填时把令牌交给 set：查库期间该键或其标签被失效过则放弃回填，
+避免失效落在查库与回填之间时旧值被写回缓存。
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+import pickle
+import sys
+import threading
+import time
+
+
+def _estimate_size(value: Any) -> int:
+    """粗略估算缓存值占用的内存（字节），只展开一层容器"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class CacheBackend:
+    """缓存后端接口"""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), token: Any = None) -> None:
+        """写入缓存项；给出 token（fill_token 的返回值）时，该键或任一标签在取得令牌后被失效过则不写入"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def invalidate_tag(self, tag: str) -> None:
+        """删除所有带该标签的缓存项"""
+        raise NotImplementedError
+
+    def fill_token(self) -> Any:
+        """读穿透查库前取得的填充令牌"""
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class NullCache(CacheBackend):
+    """不缓存任何内容，未配置缓存时使用"""
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), token: Any = None) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        pass
+
+    def invalidate_tag(self, tag: str) -> None:
+        pass
+
+
+NULL_CACHE = NullCache()
+
+
+class LRUCache(CacheBackend):
+    """进程内 LRU 缓存：条目数与估算内存双重上限，条目按 TTL 过期"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, expires_at, size, tags)
+        self._tags = {}                 # tag -> set(key)
+        self._bytes = 0
+        # 失效序号：每次 delete/invalidate_tag 递增，记录各键与标签最近一次失效的序号（条数上限同 max_entries），
+        # 被挤出的记录中最大的序号为下限，早于下限的令牌一律视为已失效
+        self._seq = 0
+        self._invalidated = OrderedDict()   # key 或 ("tag", tag) -> 序号
+        self._invalidated_floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key: str):
+        value, _, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _mark_invalidated(self, names):
+        self._seq += 1
+        for name in names:
+            self._invalidated[name] = self._seq
+            self._invalidated.move_to_end(name)
+        while len(self._invalidated) > self.max_entries:
+            _, seq = self._invalidated.popitem(last=False)
+            self._invalidated_floor = max(self._invalidated_floor, seq)
+
+    def _invalidated_since(self, key: str, tags, token: int) -> bool:
+        if token < self._invalidated_floor:
+            return True
+        names = [key] + [("tag", tag) for tag in tags]
+        return any(self._invalidated.get(name, 0) > token for name in names)
+
+    def fill_token(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), token: Any = None) -> None:
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            if token is not None and self._invalidated_since(key, tags, token):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size, tags)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            self._mark_invalidated(keys)
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_tag(self, tag: str) -> None:
+        with self._lock:
+            self._mark_invalidated([("tag", tag)])
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class LocalStore:
+    """共享存储的本地替身，实现 SharedStoreCache 与 SharedVersions 用到的 Redis 命令子集
+    （get/mget/set/delete/expire/sadd/smembers/incr）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}     # key -> (value, expires_at or None)
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def mget(self, keys):
+        with self._lock:
+            return [entry[0] if entry else None for entry in map(self._live, keys)]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return False
+            self._data[key] = (entry[0], time.monotonic() + seconds)
+            return True
+
+    def sadd(self, key, *members):
+        with self._lock:
+            entry = self._live(key)
+            members_set = entry[0] if entry else set()
+            before = len(members_set)
+            members_set.update(members)
+            self._data[key] = (members_set, entry[1] if entry else None)
+            return len(members_set) - before
+
+    def smembers(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return set(entry[0]) if entry else set()
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (value, None)
+            return value
+
+
+class SharedStoreCache(CacheBackend):
+    """跨进程共享的缓存，后端为 Redis 兼容客户端（或 LocalStore 本地替身），值以 pickle 序列化"""
+
+    def __init__(self, client, ttl: float = 300.0, prefix: str = "ecommerce:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def _mark_invalidated(self, names: Iterable[str]):
+        """失效前记录失效序号：全局序号递增，各键与标签的标记（保留一个 TTL）记下本次序号"""
+        seq = self.client.incr(self.prefix + "inv:seq")
+        for name in names:
+            self.client.set(self.prefix + "inv:" + name, seq, ex=int(self.ttl))
+
+    def _invalidated_since(self, key: str, tags, token: int) -> bool:
+        marks = self.client.mget([self.prefix + "inv:key:" + key] + [self.prefix + "inv:tag:" + tag for tag in tags])
+        return any(mark is not None and int(mark) > token for mark in marks)
+
+    def fill_token(self) -> int:
+        return int(self.client.get(self.prefix + "inv:seq") or 0)
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), token: Any = None) -> None:
+        full_key = self.prefix + key
+        tags = tuple(tags)
+        self.client.set(full_key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=int(self.ttl))
+        for tag in tags:
+            # 标签集合的过期时间随每次写入顺延到条目 TTL，成员条目都过期后集合随之过期，不会无限增长
+            tag_key = self.prefix + "tag:" + tag
+            self.client.sadd(tag_key, full_key)
+            self.client.expire(tag_key, int(self.ttl))
+        # 写入后再检查失效标记：失效先记标记再删除，检查之前落地的失效在这里发现，之后的失效会删掉刚写入的值
+        if token is not None and self._invalidated_since(key, tags, token):
+            self.client.delete(full_key)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self._mark_invalidated(["key:" + key for key in keys])
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def invalidate_tag(self, tag: str) -> None:
+        self._mark_invalidated(["tag:" + tag])
+        tag_key = self.prefix + "tag:" + tag
+        members = self.client.smembers(tag_key)
+        self.client.delete(tag_key, *members)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "shared",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,176 @@
+"""
+分类树索引
+在内存中维护分类的父子邻接表与欧拉序区间，支持整棵树、子树与面包屑查询
+"""
+
+from typing import Any, Dict, List, Optional
+import asyncio
+import threading
+import time
+
+
+class CategoryTreeIndex:
+    """分类树索引
+
+    邻接表随 create/update/delete 增量维护；欧拉序区间 [tin, tout] 在结构变化后惰性重算，
+    节点 d 属于 c 的子树当且仅当 tin[c] <= tin[d] <= tout[c]。
+    max_age 秒后视为过期，下次访问时整表重载，以同步其他进程的写入。
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        # 整表重载的单飞锁：并发请求发现索引过期时只由一个重载，其余等待后复用（同步与异步通路各一把）
+        self.reload_lock = threading.Lock()
+        self.async_reload_lock = asyncio.Lock()
+        self._nodes = {}        # category_id -> 分类行
+        self._children = {}     # parent_id（根为 None）-> [category_id]
+        self._order = []        # 欧拉序（先序）
+        self._tin = {}
+        self._tout = {}
+        self._dirty = True
+        self._loaded_at = None
+
+    @property
+    def loaded(self) -> bool:
+        """索引已加载且未过期"""
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age
+
+    def load(self, categories: List[Dict[str, Any]]):
+        """由全部分类行重建索引"""
+        with self._lock:
+            self._nodes = {row['category_id']: dict(row) for row in categories}
+            self._children = {}
+            for row in self._nodes.values():
+                self._children.setdefault(row.get('parent_id'), []).append(row['category_id'])
+            for parent_id in self._children:
+                self._sort_children(parent_id)
+            self._dirty = True
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """标记索引过期，下次访问时重载"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _sort_children(self, parent_id):
+        self._children[parent_id].sort(key=lambda cid: (self._nodes[cid]['category_name'], cid))
+
+    def _reindex(self):
+        """重算欧拉序区间"""
+        order, tin, tout = [], {}, {}
+        stack = [(cid, False) for cid in reversed(self._children.get(None, []))]
+        while stack:
+            cid, done = stack.pop()
+            if done:
+                tout[cid] = len(order) - 1
+                continue
+            tin[cid] = len(order)
+            order.append(cid)
+            stack.append((cid, True))
+            stack.extend((child, False) for child in reversed(self._children.get(cid, [])))
+        self._order, self._tin, self._tout = order, tin, tout
+        self._dirty = False
+
+    def _ensure_indexed(self):
+        if self._dirty:
+            self._reindex()
+
+    # ------------------------------------------------------------------
+    # 增量维护
+    # ------------------------------------------------------------------
+
+    def add(self, row: Dict[str, Any]):
+        """新增分类"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            cid = row['category_id']
+            self._nodes[cid] = dict(row)
+            self._children.setdefault(row.get('parent_id'), []).append(cid)
+            self._sort_children(row.get('parent_id'))
+            self._dirty = True
+
+    def update(self, category_id: int, **fields):
+        """更新分类字段；修改 parent_id 时整棵子树随之移动"""
+        with self._lock:
+            if self._loaded_at is None or category_id not in self._nodes:
+                return
+            node = self._nodes[category_id]
+            old_parent = node.get('parent_id')
+            node.update(fields)
+            new_parent = node.get('parent_id')
+            if new_parent != old_parent:
+                self._children[old_parent].remove(category_id)
+                if not self._children[old_parent]:
+                    del self._children[old_parent]
+                self._children.setdefault(new_parent, []).append(category_id)
+            self._sort_children(new_parent)
+            self._dirty = True
+
+    def remove(self, category_id: int):
+        """删除分类；其子分类挂到根下（与外键 ON DELETE SET NULL 一致）"""
+        with self._lock:
+            if self._loaded_at is None or category_id not in self._nodes:
+                return
+            node = self._nodes.pop(category_id)
+            parent_id = node.get('parent_id')
+            self._children[parent_id].remove(category_id)
+            if not self._children[parent_id]:
+                del self._children[parent_id]
+            for child in self._children.pop(category_id, []):
+                self._nodes[child]['parent_id'] = None
+                self._children.setdefault(None, []).append(child)
+            if None in self._children:
+                self._sort_children(None)
+            self._dirty = True
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def get(self, category_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            node = self._nodes.get(category_id)
+            return dict(node) if node else None
+
+    def is_descendant(self, category_id: int, ancestor_id: int) -> bool:
+        """category_id 是否位于 ancestor_id 的子树中（含自身）"""
+        with self._lock:
+            self._ensure_indexed()
+            if category_id not in self._tin or ancestor_id not in self._tin:
+                return False
+            return self._tin[ancestor_id] <= self._tin[category_id] <= self._tout[ancestor_id]
+
+    def descendant_ids(self, category_id: int, include_self: bool = True) -> List[int]:
+        """子树内所有分类ID（先序）"""
+        with self._lock:
+            self._ensure_indexed()
+            if category_id not in self._tin:
+                return []
+            start = self._tin[category_id] + (0 if include_self else 1)
+            return self._order[start:self._tout[category_id] + 1]
+
+    def ancestors(self, category_id: int) -> List[Dict[str, Any]]:
+        """面包屑：从根到该分类（含自身）的路径"""
+        with self._lock:
+            path, seen = [], set()
+            cid = category_id
+            while cid is not None and cid in self._nodes and cid not in seen:
+                seen.add(cid)
+                path.append(dict(self._nodes[cid]))
+                cid = self._nodes[cid].get('parent_id')
+            path.reverse()
+            return path
+
+    def tree(self, root_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """嵌套的分类树；root_id 为空时返回整棵树（所有一级分类）"""
+        with self._lock:
+            def build(cid):
+                node = dict(self._nodes[cid])
+                node['children'] = [build(child) for child in self._children.get(cid, [])]
+                return node
+
+            if root_id is None:
+                return [build(cid) for cid in self._children.get(None, [])]
+            return [build(root_id)] if root_id in self._nodes else []
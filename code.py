@@ -1,92 +1,1825 @@
 import mysql.connector
 from mysql.connector import Error
-from typing import List, Dict, Any, Optional
+from mysql.connector.errors import PoolError
+from typing import List, Dict, Any, Optional, Tuple, Iterator, AsyncIterator
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+import asyncio
+import base64
+import contextvars
+import copy
+import json
 import logging
+import random
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from cache import CacheBackend, NULL_CACHE
+from versions import VersionCounters, NULL_VERSIONS
+from category_tree import CategoryTreeIndex
+from search import ProductSearchIndex
+from inventory import InsufficientStockError, StockLedger
+from metrics import QueryMetrics
+from slow_query import SlowQueryLog
+from rows import build_rows, check_row_format, row_value
+
+try:
+    import aiomysql
+except ImportError:  # 异步数据通路为可选依赖
+    aiomysql = None
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class StatementCache:
+    """服务端预处理语句缓存
+
+    每个连接各自维护一个按 SQL 文本索引的 LRU，值为该连接上已预处理的游标；
+    超出 max_size 时关闭最久未用的语句（COM_STMT_CLOSE）。max_size 为 0 时不启用。
+    同一连接同一时刻只被一个线程持有，锁只保护连接映射与计数器。
+    """
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._by_conn = {}      # id(conn) -> OrderedDict(SQL -> 预处理游标)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def cursor(self, conn, query: str):
+        """取得 query 在该连接上的预处理游标，未命中时新建"""
+        with self._lock:
+            statements = self._by_conn.setdefault(id(conn), OrderedDict())
+            cursor = statements.get(query)
+            if cursor is not None:
+                statements.move_to_end(query)
+                self.hits += 1
+                return cursor
+            self.misses += 1
+        cursor = conn.cursor(prepared=True)
+        evicted = []
+        with self._lock:
+            statements[query] = cursor
+            while len(statements) > self.max_size:
+                evicted.append(statements.popitem(last=False)[1])
+                self.evictions += 1
+        for old in evicted:
+            self._close(old)
+        return cursor
+
+    def invalidate(self, conn, query: str):
+        """语句执行出错时丢弃，下次重新预处理"""
+        with self._lock:
+            cursor = self._by_conn.get(id(conn), {}).pop(query, None)
+        if cursor is not None:
+            self._close(cursor)
+
+    def discard(self, conn):
+        """连接关闭时丢弃其全部语句（服务端随连接释放）"""
+        with self._lock:
+            self._by_conn.pop(id(conn), None)
+
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor.close()
+        except Error:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "max_size": self.max_size,
+                "connections": len(self._by_conn),
+                "statements": sum(len(s) for s in self._by_conn.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+class ConnectionPool:
+    """MySQL连接池
+
+    常驻 pool_size 个连接，高峰期最多再临时创建 max_overflow 个溢出连接（归还时关闭）。
+    借出时等待超过 timeout 秒抛出 PoolError；借出前做健康检查，存活超过 recycle 秒的连接会被替换。
+    statements 为各连接的预处理语句缓存，随连接关闭而丢弃。
+    connector 为建立连接的函数，默认 mysql.connector.connect（本地替身见 local_db.py）。
+    """
+
+    def __init__(self, connect_args: Dict[str, Any], pool_size: int = 5, max_overflow: int = 10,
+                 timeout: float = 30.0, recycle: int = 3600, pre_ping: bool = True,
+                 statement_cache_size: int = 64, statements: StatementCache = None, connector=None):
+        self.connect_args = connect_args
+        self.connector = connector or mysql.connector.connect
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        # 主库与只读副本的连接池共用同一个 StatementCache（按连接区分）
+        self.statements = statements or StatementCache(statement_cache_size)
+
+        self._cond = threading.Condition()
+        self._idle = deque()          # 空闲连接，后进先出以保持热连接
+        self._born = {}               # id(conn) -> 创建时间
+        self._total = 0               # 已创建（含借出）的连接数
+        self._checked_out = 0
+
+        # 观测指标
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _create(self):
+        conn = self.connector(**self.connect_args)
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        # _cond 的锁可重入，release()/close() 持锁调用时同样适用
+        with self._cond:
+            self._born.pop(id(conn), None)
+        self.statements.discard(conn)
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _validate(self, conn):
+        """借出前检查连接：过期则回收重建，失活则重建；建连与 ping 在锁外进行，计数在锁内更新"""
+        with self._cond:
+            born = self._born.get(id(conn), 0.0)
+        if self.recycle and time.monotonic() - born > self.recycle:
+            self._discard(conn)
+            with self._cond:
+                self._recycled += 1
+            return self._create()
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Error:
+                logger.warning("连接池中的连接已失效，重新建立连接")
+                self._discard(conn)
+                with self._cond:
+                    self._ping_failures += 1
+                return self._create()
+        return conn
+
+    def acquire(self):
+        """从连接池借出一个连接"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._total < self.pool_size + self.max_overflow:
+                    self._total += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(f"等待数据库连接超时（{self.timeout}秒）")
+                self._cond.wait(remaining)
+            self._checked_out += 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        try:
+            return self._create() if conn is None else self._validate(conn)
+        except Error:
+            with self._cond:
+                self._total -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """归还连接；溢出连接直接关闭"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            # 连接已损坏，丢弃并让出名额
+            with self._cond:
+                self._discard(conn)
+                self._total -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._checked_out -= 1
+            if self._total > self.pool_size:
+                self._discard(conn)
+                self._total -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop())
+                self._total -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况：利用率与借出等待时间"""
+        with self._cond:
+            capacity = self.pool_size + self.max_overflow
+            return {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "total": self._total,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "overflow": max(0, self._total - self.pool_size),
+                "utilization": self._checked_out / capacity if capacity else 0.0,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+                "wait_time_total": self._wait_total,
+                "wait_time_max": self._wait_max,
+                "wait_time_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+            }
+
+class _Replica:
+    """一个只读副本：连接池、权重与健康状态"""
+
+    def __init__(self, name: str, pool, weight: int, config: Dict[str, Any]):
+        self.name = name
+        self.pool = pool
+        self.weight = weight
+        self.config = config
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        self.lag = None
+        self.reads = 0
+        self.failures = 0
+
+class ReplicaSet:
+    """只读副本集合：按权重随机选择健康的副本
+
+    借出连接或健康检查失败的副本下线 retry_after 秒后再试；max_lag 不为空时每 check_interval 秒
+    检查一次复制延迟，超过 max_lag 秒或复制已停止的副本同样下线。
+    """
+
+    def __init__(self, retry_after: float = 5.0, check_interval: float = 5.0, max_lag: float = None):
+        self.retry_after = retry_after
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        self._replicas = []
+
+    def __len__(self):
+        return len(self._replicas)
+
+    def add(self, name: str, pool, config: Dict[str, Any]) -> _Replica:
+        replica = _Replica(name, pool, config.get("weight", 1), config)
+        self._replicas.append(replica)
+        return replica
+
+    def pools(self) -> list:
+        return [replica.pool for replica in self._replicas]
+
+    def choose(self) -> Optional[_Replica]:
+        """按权重随机选择一个健康副本，全部不可用时返回 None（读请求退回主库）"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [r for r in self._replicas if r.down_until <= now and r.weight > 0]
+            if not healthy:
+                return None
+            replica = random.choices(healthy, weights=[r.weight for r in healthy])[0]
+            replica.reads += 1
+            return replica
+
+    def mark_down(self, replica: _Replica, reason):
+        with self._lock:
+            replica.down_until = time.monotonic() + self.retry_after
+            replica.failures += 1
+        logger.warning(f"只读副本 {replica.name} 暂时下线: {reason}")
+
+    def needs_check(self, replica: _Replica) -> bool:
+        return self.max_lag is not None and time.monotonic() - replica.checked_at >= self.check_interval
+
+    def record_lag(self, replica: _Replica, status: Optional[Dict[str, Any]]) -> bool:
+        """记录 SHOW REPLICA STATUS 的结果，返回副本是否健康；无结果（非复制实例）视为无延迟"""
+        replica.checked_at = time.monotonic()
+        if not status:
+            replica.lag = 0
+        else:
+            replica.lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        if replica.lag is None or replica.lag > self.max_lag:
+            self.mark_down(replica, f"复制延迟 {replica.lag}")
+            return False
+        return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": r.name,
+                    "weight": r.weight,
+                    "healthy": r.down_until <= now,
+                    "lag": r.lag,
+                    "reads": r.reads,
+                    "failures": r.failures,
+                }
+                for r in self._replicas
+            ]
+
+REPLICA_STATUS_QUERY = "SHOW REPLICA STATUS"
+
+_PRIMARY_READS = contextvars.ContextVar("primary_reads", default=False)
+
+@contextmanager
+def primary_reads():
+    """作用域内（当前线程或协程）的只读查询一律走主库，不使用只读副本；
+    用于结果会被共享的读取，如回填实体缓存：副本落后时回填的旧行会在 TTL 内发给所有人"""
+    token = _PRIMARY_READS.set(True)
+    try:
+        yield
+    finally:
+        _PRIMARY_READS.reset(token)
+
+def _chunk_rows(rows: List[tuple], max_bytes: int, max_rows: int):
+    """按估算的 SQL 文本大小切分多行 INSERT，使单条语句不超过 max_allowed_packet"""
+    chunk, size = [], 0
+    for row in rows:
+        # 每个值按其文本长度加引号、逗号计，每行另加括号开销
+        row_size = sum(len(str(v)) + 4 for v in row) + 4
+        if chunk and (size + row_size > max_bytes or len(chunk) >= max_rows):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+def _multi_row_insert(insert_prefix: str, width: int, count: int) -> str:
+    placeholder = "(" + ", ".join(["%s"] * width) + ")"
+    return f"{insert_prefix} " + ", ".join([placeholder] * count)
+
+def _in_batches(query: str, keys: List[Any], chunk_size: int, params: tuple = ()):
+    """将含 {keys} 占位的查询展开为若干条 IN (...) 语句，键先去重并保持原顺序"""
+    unique = list(dict.fromkeys(keys))
+    for start in range(0, len(unique), chunk_size):
+        chunk = unique[start:start + chunk_size]
+        yield query.format(keys=", ".join(["%s"] * len(chunk))), tuple(params) + tuple(chunk)
+
+def _inserted_rows(start: int, chunk_ids: List[Optional[int]]) -> List[Tuple[int, int]]:
+    """分块导入中写入成功的 (行号, 主键)"""
+    return [(index, new_id) for index, new_id in enumerate(chunk_ids, start) if new_id is not None]
+
+def group_rows(rows: List[Dict[str, Any]], key: str, keys: List[Any] = ()) -> Dict[Any, List[Dict[str, Any]]]:
+    """单次遍历按列分组；keys 中没有匹配行的键得到空列表"""
+    grouped = {k: [] for k in keys}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+# ============================================================================
+# 键集（游标）分页：按 (排序列, 主键) 定位下一页，避免 OFFSET 扫描
+# ============================================================================
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    return value
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+    return value
+
+def encode_cursor(values: tuple) -> str:
+    """将最后一行的排序键编码为不透明游标"""
+    raw = json.dumps([_encode_cursor_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """解析游标，格式非法时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+    if not isinstance(values, list):
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return [_decode_cursor_value(v) for v in values]
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    """页大小限制在 [1, MAX_PAGE_SIZE]"""
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def keyset_condition(columns: Tuple[str, ...], cursor: Optional[str],
+                     descending: bool) -> Tuple[str, tuple]:
+    """生成“位于游标之后”的 WHERE 条件
+
+    (a, b) < (x, y) 展开为 a < x OR (a = x AND b < y)，便于优化器走 (a, b) 索引的范围扫描。
+    """
+    if not cursor:
+        return "", ()
+    values = decode_cursor(cursor)
+    if len(values) != len(columns):
+        raise ValueError(f"无效的分页游标: {cursor}")
+    op = "<" if descending else ">"
+    clauses, params = [], []
+    for i, column in enumerate(columns):
+        parts = [f"{c} = %s" for c in columns[:i]] + [f"{column} {op} %s"]
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(values[:i] + [values[i]])
+    return "(" + " OR ".join(clauses) + ")", tuple(params)
+
+def keyset_page(rows: List[Dict[str, Any]], limit: int,
+                columns: Tuple[str, ...]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """截取一页（查询时多取一行用于判断是否还有下一页），返回 (行, 下一页游标)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(tuple(row_value(rows, last, c.split(".")[-1]) for c in columns))
+
+# 使整个事务失效的错误：死锁（InnoDB 回滚整个事务）、连接断开
+TRANSACTION_ABORT_ERRNOS = {1213, 2006, 2013}
+
+class TransactionAbortedError(Exception):
+    """事务已失效（回滚到保存点失败），只能整体回滚；__cause__ 为原来的异常"""
+
+def aborts_transaction(error: BaseException) -> bool:
+    """错误（或其 __cause__/__context__ 链上的错误）是否已使整个事务失效；
+    此时事务已回滚、保存点均不存在，不能只回滚到保存点继续"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TransactionAbortedError):
+            return True
+        errno = getattr(error, "errno", None)
+        if errno is None and error.args and isinstance(error.args[0], int):
+            errno = error.args[0]
+        if errno in TRANSACTION_ABORT_ERRNOS:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class BulkInsertError(Exception):
+    """分块导入中途失败；ids/errors 与 insert_chunked 的返回值同形，
+    已提交块的结果照常给出，其余行主键为 None 并计入 errors"""
+
+    def __init__(self, message: str, ids: List[Optional[int]], errors: List[Tuple[int, str]]):
+        super().__init__(message)
+        self.ids = ids
+        self.errors = errors
+
+def _partial_import(total: int, ids: List[Optional[int]], errors: List[Tuple[int, str]],
+                    error: Exception) -> BulkInsertError:
+    pending = range(len(ids), total)
+    return BulkInsertError(f"批量导入在第 {len(ids)} 行处中断: {error}",
+                           ids + [None] * len(pending),
+                           errors + [(index, f"未写入: {error}") for index in pending])
+
+class _Transaction:
+    """一次外层事务的状态：所用连接、已创建的保存点数与提交/回滚回调"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.savepoints = 0
+        self.after_commit = []
+        self.after_rollback = []
+        # 事务已失效（死锁、断开或回滚到保存点失败），最外层只能回滚
+        self.aborted = False
+
+    def mark(self) -> Tuple[int, int]:
+        """保存点开始时的回调位置"""
+        return len(self.after_commit), len(self.after_rollback)
+
+    def rolled_back(self, mark: Tuple[int, int] = (0, 0)):
+        """回滚到 mark：其后注册的提交后回调作废，回滚回调按注册的逆序返回以便执行"""
+        commit_mark, rollback_mark = mark
+        del self.after_commit[commit_mark:]
+        callbacks = self.after_rollback[rollback_mark:]
+        del self.after_rollback[rollback_mark:]
+        return list(reversed(callbacks))
+
+def _run_callbacks(callbacks):
+    """执行提交后回调；回调失败（如缓存失效出错）只记录日志，不影响已提交的写入"""
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"提交后回调执行失败: {e}")
+
 class DatabaseManager:
-    def __init__(self, host='localhost', database='test1', user='root', password=''):
+    """MySQL 数据库管理器
+
+    写入与事务走主库；给出 replicas（[{"host", "port", "weight"}]，可选 user/password/database）时，
+    事务外的只读查询按权重路由到健康的只读副本。写入后 read_your_writes 秒内，同一会话、同一线程
+    或同一客户端（client）的读取仍走主库，保证读到自己的写入。
+    """
+
+    def __init__(self, host='localhost', database='test1', user='root', password='',
+                 pool_size=5, max_overflow=10, pool_timeout=30.0, pool_recycle=3600,
+                 pre_ping=True, max_packet_bytes=4 * 1024 * 1024, bulk_chunk_rows=1000,
+                 statement_cache_size=64, port=3306, replicas=None, replica_retry=5.0,
+                 replica_check_interval=5.0, max_replica_lag=None, read_your_writes=2.0,
+                 query_metrics: QueryMetrics = None, slow_query_ms=None, slow_query_buffer=1000,
+                 explain_slow_queries=True, connector=None):
         self.host = host
+        self.port = port
         self.database = database
         self.user = user
         self.password = password
-        self.connection = None
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pre_ping = pre_ping
+        # 建立连接的函数，为空时使用 mysql.connector.connect（本地替身见 local_db.py）
+        self.connector = connector
+        # 多行 INSERT 单条语句的大小上限（留出余量，应小于服务端 max_allowed_packet）与行数上限
+        self.max_packet_bytes = max_packet_bytes
+        self.bulk_chunk_rows = bulk_chunk_rows
+        # 每个连接缓存的预处理语句数上限，0 表示 fetch_one/fetch_all 不使用预处理语句
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+        # 连接只在事务期间持有，事务外每条语句临时从连接池借出、执行完即归还。
+        # session() 返回的会话（_scoped）把事务状态直接挂在会话上，否则按线程隔离
+        self._is_session = False
+        self._scoped = False
+        self._local = threading.local()
+        self._tx = None
+        # 只读副本与读己之写：最近写入时间按会话记录（同一请求内），另按客户端标识跨请求记录；
+        # 不在会话中且没有客户端标识时不记录（线程池线程由不相关的请求轮流使用）
+        self.replica_configs = list(replicas or [])
+        self.replicas = ReplicaSet(replica_retry, replica_check_interval, max_replica_lag)
+        self.read_your_writes = read_your_writes
+        self._wrote_at = None
+        self._client = None
+        self._client_writes = OrderedDict()
+        self._client_writes_lock = threading.Lock()
+        # 按语句指纹统计的耗时、行数与错误数，会话副本共用
+        self.query_metrics = query_metrics or QueryMetrics()
+        # 慢查询日志：slow_query_ms 为空时关闭
+        self.slow_queries = (
+            SlowQueryLog(slow_query_ms, slow_query_buffer, explain_slow_queries)
+            if slow_query_ms is not None else None
+        )
+        # 慢查询的 EXPLAIN 在单个后台线程中执行：不阻塞请求线程，同一时刻最多占用一个连接
+        self._explain_executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+            if self.slow_queries is not None else None
+        )
+        
+    def _connect_args(self, config: Dict[str, Any] = None) -> Dict[str, Any]:
+        config = config or {}
+        return {
+            "host": config.get("host", self.host),
+            "port": config.get("port", self.port),
+            "database": config.get("database", self.database),
+            "user": config.get("user", self.user),
+            "password": config.get("password", self.password),
+        }
         
     def connect(self):
-        """建立数据库连接"""
+        """建立数据库连接池（主库与各只读副本）"""
+        if self.pool is not None:
+            return
         try:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
+            pool = ConnectionPool(
+                self._connect_args(),
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                timeout=self.pool_timeout,
+                recycle=self.pool_recycle,
+                pre_ping=self.pre_ping,
+                statement_cache_size=self.statement_cache_size,
+                connector=self.connector,
             )
-            if self.connection.is_connected():
-                logger.info("成功连接到MySQL数据库")
+            # 预先借还一次，尽早暴露连接配置错误
+            pool.release(pool.acquire())
+            self.pool = pool
+            logger.info("成功连接到MySQL数据库")
         except Error as e:
             logger.error(f"数据库连接失败: {e}")
             raise
+        for config in self.replica_configs:
+            args = self._connect_args(config)
+            replica = self.replicas.add(
+                f"{args['host']}:{args['port']}",
+                ConnectionPool(args, pool_size=self.pool_size, max_overflow=self.max_overflow,
+                               timeout=self.pool_timeout, recycle=self.pool_recycle, pre_ping=self.pre_ping,
+                               statements=self.pool.statements, connector=self.connector),
+                config,
+            )
+            # 副本不可用不影响启动，读请求退回主库
+            try:
+                replica.pool.release(replica.pool.acquire())
+            except Error as e:
+                self.replicas.mark_down(replica, e)
     
     def disconnect(self):
-        """关闭数据库连接"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+        """关闭数据库连接池"""
+        if self._is_session:
+            return
+        if self.pool:
+            self.pool.close()
+            for replica_pool in self.replicas.pools():
+                replica_pool.close()
+            self.pool = None
+            self.replicas = ReplicaSet(self.replicas.retry_after, self.replicas.check_interval,
+                                       self.replicas.max_lag)
             logger.info("数据库连接已关闭")
-    
-    def execute_query(self, query: str, params: tuple = None) -> Optional[int]:
-        """执行查询并返回受影响的行数"""
-        cursor = None
+
+    @contextmanager
+    def session(self, client: str = None):
+        """返回一个请求范围的 DatabaseManager：事务状态与最近写入时间挂在会话上（请求处理可跨线程池线程），
+        不预先占用连接，只在执行语句或事务期间借出，只读端点不会因等待连接而受连接池大小限制
+
+        client 为客户端标识，用于跨请求的读己之写：该客户端写入后的读取在窗口内走主库。
+        """
+        if self._scoped:
+            yield self
+            return
+        if self.pool is None:
+            self.connect()
+        scoped = copy.copy(self)
+        scoped._is_session = True
+        scoped._scoped = True
+        scoped._tx = None
+        scoped._wrote_at = None
+        scoped._client = client
+        yield scoped
+
+    def for_client(self, client: Optional[str]) -> "DatabaseManager":
+        """返回按客户端标识记录读己之写的未绑定管理器"""
+        if client is None or client == self._client:
+            return self
+        other = copy.copy(self)
+        other._client = client
+        return other
+
+    def record_write(self, client: str = None):
+        """记录一次已提交的写入，开始读己之写窗口：会话内的后续读取与该客户端标识的后续请求走主库"""
+        now = time.monotonic()
+        if self._scoped:
+            self._wrote_at = now
+        client = client or self._client
+        if client is not None:
+            with self._client_writes_lock:
+                self._client_writes[client] = now
+                self._client_writes.move_to_end(client)
+                while len(self._client_writes) > 100000:
+                    self._client_writes.popitem(last=False)
+
+    def _pinned_to_primary(self) -> bool:
+        """是否处于读己之写窗口内"""
+        if not self.read_your_writes:
+            return False
+        horizon = time.monotonic() - self.read_your_writes
+        wrote_at = self._wrote_at if self._scoped else None
+        if wrote_at is not None and wrote_at > horizon:
+            return True
+        if self._client is not None:
+            with self._client_writes_lock:
+                client_wrote_at = self._client_writes.get(self._client)
+            return client_wrote_at is not None and client_wrote_at > horizon
+        return False
+
+    def _current_tx(self) -> Optional[_Transaction]:
+        if self._scoped:
+            return self._tx
+        return getattr(self._local, "tx", None)
+
+    def _set_tx(self, tx: Optional[_Transaction]):
+        if self._scoped:
+            self._tx = tx
+        else:
+            self._local.tx = tx
+
+    @property
+    def in_transaction(self) -> bool:
+        """当前是否处于 transaction() 作用域内"""
+        return self._current_tx() is not None
+
+    @contextmanager
+    def transaction(self):
+        """事务作用域（工作单元）
+
+        最外层作用域开始事务并在退出时统一提交，异常时回滚；嵌套作用域使用保存点，
+        只回滚自身的修改。作用域内通过本管理器执行的语句都加入同一事务，不再逐条提交。
+        """
+        tx = self._current_tx()
+        if tx is not None:
+            tx.savepoints += 1
+            name = f"sp_{tx.savepoints}"
+            mark = tx.mark()
+            cursor = tx.connection.cursor()
+            try:
+                cursor.execute(f"SAVEPOINT {name}")
+                try:
+                    yield self
+                except BaseException as e:
+                    # 死锁、连接断开时服务端已回滚整个事务，保存点随之消失，不再回滚到保存点；
+                    # 回滚到保存点失败时同样视为事务失效，原来的异常作为 __cause__ 保留
+                    if tx.aborted or aborts_transaction(e):
+                        tx.aborted = True
+                    else:
+                        try:
+                            cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                        except Exception as rollback_error:
+                            logger.error(f"回滚到保存点 {name} 失败: {rollback_error}")
+                            tx.aborted = True
+                    _run_callbacks(tx.rolled_back(mark))
+                    if tx.aborted and not aborts_transaction(e):
+                        raise TransactionAbortedError(f"事务已失效: {e}") from e
+                    raise
+                cursor.execute(f"RELEASE SAVEPOINT {name}")
+            finally:
+                cursor.close()
+            return
+
+        if self.pool is None:
+            self.connect()
+        conn = self.pool.acquire()
+        tx = _Transaction(conn)
+        self._set_tx(tx)
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params or ())
-            self.connection.commit()
-            logger.info(f"查询执行成功: {query}")
-            return cursor.rowcount
-        except Error as e:
-            logger.error(f"查询执行失败: {e}")
-            if self.connection:
-                self.connection.rollback()
-            raise
+            conn.start_transaction()
+            try:
+                yield self
+                if tx.aborted:
+                    # 作用域内吞掉了使事务失效的异常，不能提交
+                    raise TransactionAbortedError("事务已失效，不能提交")
+                conn.commit()
+            except BaseException:
+                # 作用域内出错或提交失败都执行回滚回调；回滚本身失败（如连接已断开）时
+                # 服务端已丢弃该事务，回调照常执行，向上抛出原来的异常
+                try:
+                    conn.rollback()
+                except Exception as e:
+                    logger.error(f"事务回滚失败: {e}")
+                _run_callbacks(tx.rolled_back())
+                raise
         finally:
-            if cursor:
-                cursor.close()
+            self._set_tx(None)
+            self.pool.release(conn)
+        self.record_write()
+        _run_callbacks(tx.after_commit)
+
+    def after_commit(self, callback):
+        """注册提交后回调：事务中延迟到最外层提交成功后执行（回滚则丢弃），否则立即执行"""
+        tx = self._current_tx()
+        if tx is None:
+            _run_callbacks([callback])
+        else:
+            tx.after_commit.append(callback)
+
+    def after_rollback(self, callback):
+        """注册回滚回调，用于撤销事务外的内存状态：所在保存点或事务回滚时执行，提交则丢弃；不在事务中时忽略"""
+        tx = self._current_tx()
+        if tx is not None:
+            tx.after_rollback.append(callback)
+
+    def detached(self) -> "DatabaseManager":
+        """返回不加入当前会话与事务的管理器：每条语句单独借出连接并立即提交（自治事务）"""
+        other = copy.copy(self)
+        other._is_session = True
+        other._scoped = False
+        other._local = threading.local()
+        other._tx = None
+        other._wrote_at = None
+        other._client = None
+        return other
+
+    @contextmanager
+    def _borrow(self):
+        """取得执行语句的连接：事务中复用事务连接，否则临时从连接池借出"""
+        tx = self._current_tx()
+        if tx is not None:
+            yield tx.connection
+            return
+        if self.pool is None:
+            self.connect()
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    @contextmanager
+    def _borrow_read(self):
+        """取得只读查询的连接：事务外且不在读己之写窗口内时使用只读副本，否则同 _borrow"""
+        replica, conn = self._acquire_replica()
+        if conn is None:
+            with self._borrow() as connection:
+                yield connection
+            return
+        try:
+            yield conn
+        finally:
+            replica.pool.release(conn)
+
+    def _acquire_replica(self):
+        if self.pool is None:
+            self.connect()
+        if (not len(self.replicas) or self._current_tx() is not None or _PRIMARY_READS.get()
+                or self._pinned_to_primary()):
+            return None, None
+        replica = self.replicas.choose()
+        if replica is None:
+            return None, None
+        try:
+            conn = replica.pool.acquire()
+        except Error as e:
+            self.replicas.mark_down(replica, e)
+            return None, None
+        if self.replicas.needs_check(replica):
+            try:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    cursor.execute(REPLICA_STATUS_QUERY)
+                    healthy = self.replicas.record_lag(replica, cursor.fetchone())
+                finally:
+                    cursor.close()
+            except Error as e:
+                self.replicas.mark_down(replica, e)
+                healthy = False
+            if not healthy:
+                replica.pool.release(conn)
+                return None, None
+        return replica, conn
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """连接池统计信息"""
+        return self.pool.stats() if self.pool else {}
+
+    def replica_stats(self) -> Dict[str, Any]:
+        """只读副本健康状态与路由计数"""
+        return {"read_your_writes": self.read_your_writes, "replicas": self.replicas.stats()}
+
+    def _observe(self, query: str, params, start: float, rows: int = 0, failed: bool = False):
+        """记录一条语句的耗时（自 start 起）、行数与是否失败；超过慢查询阈值时写入慢查询日志"""
+        elapsed = time.perf_counter() - start
+        self.query_metrics.observe(query, elapsed, rows, failed)
+        if self.slow_queries is not None and self.slow_queries.is_slow(elapsed):
+            if self.slow_queries.record(query, params, elapsed, rows, failed):
+                self._explain_executor.submit(self._explain, query, params)
+
+    def _explain(self, query: str, params):
+        """在后台线程中借出独立连接执行 EXPLAIN 并记入慢查询日志，失败不影响原语句
+
+        语句变慢往往正是连接池紧张的时候，请求线程已持有一个连接，不能再同步等待第二个。
+        """
+        explainer = self.detached()
+        explainer.slow_queries = None
+        try:
+            plan = explainer.fetch_all(f"EXPLAIN {query}", params)
+        except Exception as e:
+            plan = f"EXPLAIN 失败: {e}"
+        self.slow_queries.set_plan(query, plan)
+
+    def slow_query_stats(self) -> Dict[str, Any]:
+        """慢查询日志状态"""
+        return self.slow_queries.stats() if self.slow_queries is not None else {"enabled": False}
+
+    def statement_cache_stats(self) -> Dict[str, Any]:
+        """预处理语句缓存统计信息：命中率与缓存语句数"""
+        return self.pool.statements.stats() if self.pool else {}
     
-    def fetch_all(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
-        """执行查询并返回所有结果"""
-        cursor = None
+    def execute_query(self, query: str, params: tuple = None, on_commit=None) -> Optional[int]:
+        """执行查询并返回受影响的行数；事务作用域内由外层统一提交
+
+        on_commit 在本语句所在事务提交后调用，用于缓存失效等写后动作。
+        """
+        in_tx = self.in_transaction
+        with self._borrow() as connection:
+            cursor = None
+            start = time.perf_counter()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, params or ())
+                if not in_tx:
+                    connection.commit()
+                    self.record_write()
+                self._observe(query, params, start, cursor.rowcount)
+                logger.debug("查询执行成功: %s", query)
+                if on_commit:
+                    self.after_commit(on_commit)
+                return cursor.rowcount
+            except Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"查询执行失败: {e}")
+                if not in_tx:
+                    connection.rollback()
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
+    
+    def execute_insert(self, query: str, params: tuple = None, on_commit=None) -> int:
+        """执行 INSERT 并返回自增主键；on_commit(新主键) 在所在事务提交后调用"""
+        in_tx = self.in_transaction
+        with self._borrow() as connection:
+            cursor = None
+            start = time.perf_counter()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, params or ())
+                if not in_tx:
+                    connection.commit()
+                    self.record_write()
+                self._observe(query, params, start, cursor.rowcount)
+                logger.debug("查询执行成功: %s", query)
+                if on_commit:
+                    new_id = cursor.lastrowid
+                    self.after_commit(lambda: on_commit(new_id))
+                return cursor.lastrowid
+            except Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"查询执行失败: {e}")
+                if not in_tx:
+                    connection.rollback()
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
+
+    def insert_many(self, insert_prefix: str, rows: List[tuple]) -> List[int]:
+        """多行 INSERT 批量写入，返回按行顺序排列的自增主键
+
+        insert_prefix 形如 "INSERT INTO t (a, b) VALUES"。按 max_packet_bytes/bulk_chunk_rows
+        分块，每块一条语句；不在事务中时整体包进一个事务，全部成功或全部回滚。
+        单条多行 INSERT 的自增值是连续分配的（auto_increment_increment 为 1 时）。
+        """
+        if not rows:
+            return []
+        ids = []
+        # 已在事务中时直接加入，不额外创建保存点
+        with nullcontext() if self.in_transaction else self.transaction():
+            with self._borrow() as connection:
+                cursor = connection.cursor()
+                try:
+                    for chunk in _chunk_rows(rows, self.max_packet_bytes, self.bulk_chunk_rows):
+                        query = _multi_row_insert(insert_prefix, len(chunk[0]), len(chunk))
+                        values = tuple(v for row in chunk for v in row)
+                        start = time.perf_counter()
+                        cursor.execute(query, values)
+                        self._observe(query, values, start, len(chunk))
+                        ids.extend(range(cursor.lastrowid, cursor.lastrowid + len(chunk)))
+                    logger.debug("批量写入成功: %s (%d 行)", insert_prefix, len(rows))
+                except Error as e:
+                    self._observe(query, values, start, failed=True)
+                    logger.error(f"批量写入失败: {e}")
+                    raise
+                finally:
+                    cursor.close()
+        return ids
+
+    def insert_chunked(self, insert_prefix: str, rows: List[tuple],
+                       on_commit=None) -> Tuple[List[Optional[int]], List[Tuple[int, str]]]:
+        """大批量导入：每 bulk_chunk_rows 行一个事务，逐行报告失败
+
+        每块先整体多行 INSERT；失败则回滚该块，改为逐行写入（每行一个保存点），
+        跳过出错的行。返回 (与 rows 对齐的主键列表，失败行为 None, [(行号, 错误信息)])。
+        on_commit([(行号, 主键)]) 在每块提交后调用。
+        死锁、连接断开等使整个事务失效的错误不再逐行重试；此类错误或其他异常中断导入时
+        抛出 BulkInsertError，带上已提交块的主键与错误。
+        """
+        ids, errors = [], []
+        try:
+            for start in range(0, len(rows), self.bulk_chunk_rows):
+                chunk = rows[start:start + self.bulk_chunk_rows]
+                chunk_errors = []
+                try:
+                    with self.transaction():
+                        chunk_ids = self.insert_many(insert_prefix, chunk)
+                        self._after_chunk(on_commit, start, chunk_ids)
+                except Error as e:
+                    if aborts_transaction(e):
+                        raise
+                    logger.warning(f"批量写入第 {start} 行起的块失败，改为逐行写入")
+                    single = _multi_row_insert(insert_prefix, len(chunk[0]), 1)
+                    chunk_ids = []
+                    with self.transaction():
+                        for index, row in enumerate(chunk, start):
+                            try:
+                                with self.transaction():
+                                    chunk_ids.append(self.execute_insert(single, row))
+                            except Error as e:
+                                if aborts_transaction(e):
+                                    raise
+                                chunk_ids.append(None)
+                                chunk_errors.append((index, str(e)))
+                        self._after_chunk(on_commit, start, chunk_ids)
+                ids.extend(chunk_ids)
+                errors.extend(chunk_errors)
+        except Exception as e:
+            logger.error(f"批量导入中断，已提交 {len(ids)} 行: {e}")
+            raise _partial_import(len(rows), ids, errors, e) from e
+        return ids, errors
+
+    def _after_chunk(self, on_commit, start: int, chunk_ids: List[Optional[int]]):
+        if on_commit:
+            inserted = _inserted_rows(start, chunk_ids)
+            self.after_commit(lambda: on_commit(inserted))
+    
+    def _fetch_prepared(self, connection, query: str, params: tuple = None, row_format: str = "dict"):
+        """以缓存的预处理语句执行查询，结果按 row_format 组装；结果集总是读完，连接可继续执行其他语句"""
+        statements = self.pool.statements
+        cursor = statements.cursor(connection, query)
+        start = time.perf_counter()
         try:
-            cursor = self.connection.cursor(dictionary=True)
             cursor.execute(query, params or ())
-            result = cursor.fetchall()
-            return result
+            rows = build_rows(row_format, cursor.column_names, cursor.fetchall())
+            self._observe(query, params, start, len(rows))
+            return rows
         except Error as e:
+            self._observe(query, params, start, failed=True)
             logger.error(f"数据获取失败: {e}")
+            statements.invalidate(connection, query)
             raise
-        finally:
-            if cursor:
-                cursor.close()
+
+    def fetch_all(self, query: str, params: tuple = None, row_format: str = "dict"):
+        """执行查询并返回所有结果
+
+        row_format 为 dict（默认，字典列表）| tuple | slots | columns，紧凑格式见 rows.py。
+        """
+        check_row_format(row_format)
+        with self._borrow_read() as connection:
+            if self.pool.statements.enabled:
+                return self._fetch_prepared(connection, query, params, row_format)
+            cursor = None
+            start = time.perf_counter()
+            try:
+                cursor = connection.cursor(dictionary=row_format == "dict")
+                cursor.execute(query, params or ())
+                result = cursor.fetchall()
+                if row_format != "dict":
+                    result = build_rows(row_format, cursor.column_names, result)
+                self._observe(query, params, start, len(result))
+                return result
+            except Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
     
     def fetch_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
         """执行查询并返回单条结果"""
-        cursor = None
+        with self._borrow_read() as connection:
+            if self.pool.statements.enabled:
+                rows = self._fetch_prepared(connection, query, params)
+                return rows[0] if rows else None
+            cursor = None
+            start = time.perf_counter()
+            try:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(query, params or ())
+                result = cursor.fetchone()
+                self._observe(query, params, start, 1 if result else 0)
+                return result
+            except Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
+
+    def fetch_iter(self, query: str, params: tuple = None,
+                   chunk_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """流式读取：非缓冲（服务端）游标按 chunk_size 分块 fetchmany，内存占用与结果集大小无关
+
+        生成器在迭代期间一直占用一个连接（事务中则为事务连接），迭代结束后归还。
+        """
+        with self._borrow_read() as connection:
+            cursor = None
+            start, count = time.perf_counter(), 0
+            try:
+                cursor = connection.cursor(dictionary=True, buffered=False)
+                cursor.execute(query, params or ())
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield from rows
+                # 流式读取的耗时包含调用方逐块消费的时间
+                self._observe(query, params, start, count)
+            except Error as e:
+                self._observe(query, params, start, count, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+            finally:
+                # 提前终止（如客户端断开）时读掉剩余结果，连接才能归还复用
+                if connection.unread_result:
+                    connection.consume_results()
+                if cursor:
+                    cursor.close()
+
+    def fetch_in(self, query: str, keys: List[Any], params: tuple = ()) -> List[Dict[str, Any]]:
+        """批量加载：query 中的 {keys} 展开为 IN (...)，键去重后按 bulk_chunk_rows 分块查询"""
+        result = []
+        for sql, sql_params in _in_batches(query, keys, self.bulk_chunk_rows, params):
+            result.extend(self.fetch_all(sql, sql_params))
+        return result
+
+    def fetch_grouped(self, query: str, key: str, keys: List[Any],
+                      params: tuple = ()) -> Dict[Any, List[Dict[str, Any]]]:
+        """批量加载一对多关系：返回 {键: 行列表}，每个请求的键都有对应项"""
+        return group_rows(self.fetch_in(query, keys, params), key, keys)
+
+    def fetch_keyed(self, query: str, key: str, keys: List[Any],
+                    params: tuple = ()) -> Dict[Any, Dict[str, Any]]:
+        """批量加载一对一关系：返回 {键: 行}，不存在的键不出现在结果中"""
+        return {row[key]: row for row in self.fetch_in(query, keys, params)}
+
+class AsyncDatabaseManager:
+    """基于 aiomysql 的异步数据库管理器，execute_query/fetch_one/fetch_all 与 DatabaseManager 约定一致"""
+
+    def __init__(self, host='localhost', database='test1', user='root', password='',
+                 pool_size=5, max_overflow=10, pool_timeout=30.0, pool_recycle=3600,
+                 pre_ping=True, max_packet_bytes=4 * 1024 * 1024, bulk_chunk_rows=1000,
+                 statement_cache_size=64, port=3306, replicas=None, replica_retry=5.0,
+                 replica_check_interval=5.0, max_replica_lag=None, read_your_writes=2.0,
+                 query_metrics: QueryMetrics = None, slow_query_ms=None, slow_query_buffer=1000,
+                 explain_slow_queries=True):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.password = password
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pre_ping = pre_ping
+        # 多行 INSERT 单条语句的大小上限（留出余量，应小于服务端 max_allowed_packet）与行数上限
+        self.max_packet_bytes = max_packet_bytes
+        self.bulk_chunk_rows = bulk_chunk_rows
+        # aiomysql 不支持服务端预处理语句，仅为与 DatabaseManager 参数一致而接受
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+        self._is_session = False
+        self._scoped = False
+        # 会话的事务状态直接挂在会话上，否则按协程上下文隔离
+        self._tx_var = contextvars.ContextVar(f"async_tx_{id(self)}", default=None)
+        self._tx = None
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # 只读副本与读己之写，语义同 DatabaseManager
+        self.replica_configs = list(replicas or [])
+        self.replicas = ReplicaSet(replica_retry, replica_check_interval, max_replica_lag)
+        self.read_your_writes = read_your_writes
+        self._wrote_at = None
+        self._client = None
+        self._client_writes = OrderedDict()
+        self._client_writes_lock = threading.Lock()
+        self._explain_tasks = set()
+        # 按语句指纹统计的耗时、行数与错误数，会话副本共用
+        self.query_metrics = query_metrics or QueryMetrics()
+        # 慢查询日志：slow_query_ms 为空时关闭
+        self.slow_queries = (
+            SlowQueryLog(slow_query_ms, slow_query_buffer, explain_slow_queries)
+            if slow_query_ms is not None else None
+        )
+
+    async def _create_pool(self, config: Dict[str, Any] = None):
+        config = config or {}
+        return await aiomysql.create_pool(
+            host=config.get("host", self.host),
+            port=config.get("port", self.port),
+            db=config.get("database", self.database),
+            user=config.get("user", self.user),
+            password=config.get("password", self.password),
+            minsize=self.pool_size,
+            maxsize=self.pool_size + self.max_overflow,
+            pool_recycle=self.pool_recycle,
+            autocommit=False,
+        )
+
+    async def connect(self):
+        """建立异步连接池（主库与各只读副本）"""
+        if self.pool is not None:
+            return
+        if aiomysql is None:
+            raise RuntimeError("异步数据通路需要安装 aiomysql")
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            cursor.execute(query, params or ())
-            result = cursor.fetchone()
-            return result
-        except Error as e:
-            logger.error(f"数据获取失败: {e}")
+            self.pool = await self._create_pool()
+            logger.info("成功连接到MySQL数据库（异步）")
+        except aiomysql.Error as e:
+            logger.error(f"数据库连接失败: {e}")
             raise
+        for config in self.replica_configs:
+            name = f"{config.get('host', self.host)}:{config.get('port', self.port)}"
+            # 副本不可用不影响启动：登记一个空副本并下线，重试时再建连接池
+            try:
+                pool = await self._create_pool(config)
+            except aiomysql.Error as e:
+                pool = None
+                logger.warning(f"只读副本 {name} 连接失败: {e}")
+            replica = self.replicas.add(name, pool, config)
+            if pool is None:
+                self.replicas.mark_down(replica, "连接池未建立")
+
+    async def disconnect(self):
+        """关闭异步连接池"""
+        if self._is_session:
+            return
+        if self.pool:
+            self.pool.close()
+            await self.pool.wait_closed()
+            for replica_pool in self.replicas.pools():
+                if replica_pool is not None:
+                    replica_pool.close()
+                    await replica_pool.wait_closed()
+            self.pool = None
+            self.replicas = ReplicaSet(self.replicas.retry_after, self.replicas.check_interval,
+                                       self.replicas.max_lag)
+            logger.info("数据库连接已关闭")
+
+    async def _acquire(self):
+        if self.pool is None:
+            await self.connect()
+        start = time.monotonic()
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), self.pool_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolError(f"等待数据库连接超时（{self.pool_timeout}秒）")
+        waited = time.monotonic() - start
+        self._checkouts += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        if self.pre_ping:
+            try:
+                await conn.ping(reconnect=True)
+            except aiomysql.Error:
+                self.pool.release(conn)
+                raise
+        return conn
+
+    @asynccontextmanager
+    async def session(self, client: str = None):
+        """返回一个请求范围的 AsyncDatabaseManager，不预先占用连接，语义同 DatabaseManager.session"""
+        if self._scoped:
+            yield self
+            return
+        if self.pool is None:
+            await self.connect()
+        scoped = copy.copy(self)
+        scoped._is_session = True
+        scoped._scoped = True
+        scoped._tx = None
+        scoped._wrote_at = None
+        scoped._client = client
+        yield scoped
+
+    def for_client(self, client: Optional[str]) -> "AsyncDatabaseManager":
+        """返回按客户端标识记录读己之写的未绑定管理器"""
+        if client is None or client == self._client:
+            return self
+        other = copy.copy(self)
+        other._client = client
+        return other
+
+    def record_write(self, client: str = None):
+        """记录一次已提交的写入，语义同 DatabaseManager.record_write"""
+        now = time.monotonic()
+        if self._scoped:
+            self._wrote_at = now
+        client = client or self._client
+        if client is not None:
+            with self._client_writes_lock:
+                self._client_writes[client] = now
+                self._client_writes.move_to_end(client)
+                while len(self._client_writes) > 100000:
+                    self._client_writes.popitem(last=False)
+
+    def _pinned_to_primary(self) -> bool:
+        if not self.read_your_writes:
+            return False
+        horizon = time.monotonic() - self.read_your_writes
+        wrote_at = self._wrote_at if self._scoped else None
+        if wrote_at is not None and wrote_at > horizon:
+            return True
+        if self._client is not None:
+            with self._client_writes_lock:
+                client_wrote_at = self._client_writes.get(self._client)
+            return client_wrote_at is not None and client_wrote_at > horizon
+        return False
+
+    def _current_tx(self) -> Optional[_Transaction]:
+        if self._scoped:
+            return self._tx
+        return self._tx_var.get()
+
+    def _set_tx(self, tx: Optional[_Transaction]):
+        if self._scoped:
+            self._tx = tx
+        else:
+            self._tx_var.set(tx)
+
+    @property
+    def in_transaction(self) -> bool:
+        """当前是否处于 transaction() 作用域内"""
+        return self._current_tx() is not None
+
+    @asynccontextmanager
+    async def transaction(self):
+        """事务作用域（工作单元），语义同 DatabaseManager.transaction"""
+        tx = self._current_tx()
+        if tx is not None:
+            tx.savepoints += 1
+            name = f"sp_{tx.savepoints}"
+            mark = tx.mark()
+            async with tx.connection.cursor() as cursor:
+                await cursor.execute(f"SAVEPOINT {name}")
+                try:
+                    yield self
+                except BaseException as e:
+                    if tx.aborted or aborts_transaction(e):
+                        tx.aborted = True
+                    else:
+                        try:
+                            await cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                        except Exception as rollback_error:
+                            logger.error(f"回滚到保存点 {name} 失败: {rollback_error}")
+                            tx.aborted = True
+                    _run_callbacks(tx.rolled_back(mark))
+                    if tx.aborted and not aborts_transaction(e):
+                        raise TransactionAbortedError(f"事务已失效: {e}") from e
+                    raise
+                await cursor.execute(f"RELEASE SAVEPOINT {name}")
+            return
+
+        conn = await self._acquire()
+        tx = _Transaction(conn)
+        self._set_tx(tx)
+        try:
+            await conn.begin()
+            try:
+                yield self
+                if tx.aborted:
+                    raise TransactionAbortedError("事务已失效，不能提交")
+                await conn.commit()
+            except BaseException:
+                try:
+                    await conn.rollback()
+                except Exception as e:
+                    logger.error(f"事务回滚失败: {e}")
+                _run_callbacks(tx.rolled_back())
+                raise
         finally:
-            if cursor:
-                cursor.close()
+            self._set_tx(None)
+            self.pool.release(conn)
+        self.record_write()
+        _run_callbacks(tx.after_commit)
+
+    def after_commit(self, callback):
+        """注册提交后回调，语义同 DatabaseManager.after_commit"""
+        tx = self._current_tx()
+        if tx is None:
+            _run_callbacks([callback])
+        else:
+            tx.after_commit.append(callback)
+
+    def after_rollback(self, callback):
+        """注册回滚回调，语义同 DatabaseManager.after_rollback"""
+        tx = self._current_tx()
+        if tx is not None:
+            tx.after_rollback.append(callback)
+
+    def detached(self) -> "AsyncDatabaseManager":
+        """返回不加入当前会话与事务的管理器，语义同 DatabaseManager.detached"""
+        other = copy.copy(self)
+        other._is_session = True
+        other._scoped = False
+        other._tx_var = contextvars.ContextVar(f"async_tx_{id(other)}", default=None)
+        other._tx = None
+        other._wrote_at = None
+        other._client = None
+        return other
+
+    @asynccontextmanager
+    async def _borrow(self):
+        """取得执行语句的连接：事务中复用事务连接，否则临时从连接池借出"""
+        tx = self._current_tx()
+        if tx is not None:
+            yield tx.connection
+            return
+        conn = await self._acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    @asynccontextmanager
+    async def _borrow_read(self):
+        """取得只读查询的连接，语义同 DatabaseManager._borrow_read"""
+        replica, conn = await self._acquire_replica()
+        if conn is None:
+            async with self._borrow() as connection:
+                yield connection
+            return
+        try:
+            yield conn
+        finally:
+            replica.pool.release(conn)
+
+    async def _acquire_replica(self):
+        if self.pool is None:
+            await self.connect()
+        if (not len(self.replicas) or self._current_tx() is not None or _PRIMARY_READS.get()
+                or self._pinned_to_primary()):
+            return None, None
+        replica = self.replicas.choose()
+        if replica is None:
+            return None, None
+        try:
+            if replica.pool is None:
+                replica.pool = await self._create_pool(replica.config)
+            conn = await asyncio.wait_for(replica.pool.acquire(), self.pool_timeout)
+        except (aiomysql.Error, asyncio.TimeoutError) as e:
+            self.replicas.mark_down(replica, repr(e))
+            return None, None
+        try:
+            if self.pre_ping:
+                await conn.ping(reconnect=True)
+            if self.replicas.needs_check(replica):
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(REPLICA_STATUS_QUERY)
+                    healthy = self.replicas.record_lag(replica, await cursor.fetchone())
+                if not healthy:
+                    replica.pool.release(conn)
+                    return None, None
+        except aiomysql.Error as e:
+            self.replicas.mark_down(replica, e)
+            replica.pool.release(conn)
+            return None, None
+        return replica, conn
+
+    def replica_stats(self) -> Dict[str, Any]:
+        """只读副本健康状态与路由计数"""
+        return {"read_your_writes": self.read_your_writes, "replicas": self.replicas.stats()}
+
+    def _observe(self, query: str, params, start: float, rows: int = 0, failed: bool = False):
+        """记录一条语句的耗时、行数与是否失败，语义同 DatabaseManager._observe；EXPLAIN 在后台任务中执行"""
+        elapsed = time.perf_counter() - start
+        self.query_metrics.observe(query, elapsed, rows, failed)
+        if self.slow_queries is not None and self.slow_queries.is_slow(elapsed):
+            if self.slow_queries.record(query, params, elapsed, rows, failed):
+                task = asyncio.get_running_loop().create_task(self._explain(query, params))
+                self._explain_tasks.add(task)
+                task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, query: str, params):
+        explainer = self.detached()
+        explainer.slow_queries = None
+        try:
+            plan = await explainer.fetch_all(f"EXPLAIN {query}", params)
+        except aiomysql.Error as e:
+            plan = f"EXPLAIN 失败: {e}"
+        self.slow_queries.set_plan(query, plan)
+
+    def slow_query_stats(self) -> Dict[str, Any]:
+        """慢查询日志状态"""
+        return self.slow_queries.stats() if self.slow_queries is not None else {"enabled": False}
+
+    def statement_cache_stats(self) -> Dict[str, Any]:
+        """异步通路不使用预处理语句缓存"""
+        return {"enabled": False}
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """连接池统计信息"""
+        if not self.pool:
+            return {}
+        capacity = self.pool.maxsize
+        checked_out = self.pool.size - self.pool.freesize
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "total": self.pool.size,
+            "idle": self.pool.freesize,
+            "checked_out": checked_out,
+            "overflow": max(0, self.pool.size - self.pool_size),
+            "utilization": checked_out / capacity if capacity else 0.0,
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "wait_time_total": self._wait_total,
+            "wait_time_max": self._wait_max,
+            "wait_time_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+        }
+
+    async def execute_query(self, query: str, params: tuple = None, on_commit=None) -> Optional[int]:
+        """执行查询并返回受影响的行数；事务作用域内由外层统一提交，on_commit 同 DatabaseManager"""
+        in_tx = self.in_transaction
+        async with self._borrow() as connection:
+            start = time.perf_counter()
+            try:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(query, params or ())
+                    if not in_tx:
+                        await connection.commit()
+                        self.record_write()
+                    self._observe(query, params, start, cursor.rowcount)
+                    logger.debug("查询执行成功: %s", query)
+                    if on_commit:
+                        self.after_commit(on_commit)
+                    return cursor.rowcount
+            except aiomysql.Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"查询执行失败: {e}")
+                if not in_tx:
+                    await connection.rollback()
+                raise
+
+    async def execute_insert(self, query: str, params: tuple = None, on_commit=None) -> int:
+        """执行 INSERT 并返回自增主键；on_commit(新主键) 在所在事务提交后调用"""
+        in_tx = self.in_transaction
+        async with self._borrow() as connection:
+            start = time.perf_counter()
+            try:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(query, params or ())
+                    if not in_tx:
+                        await connection.commit()
+                        self.record_write()
+                    self._observe(query, params, start, cursor.rowcount)
+                    logger.debug("查询执行成功: %s", query)
+                    if on_commit:
+                        new_id = cursor.lastrowid
+                        self.after_commit(lambda: on_commit(new_id))
+                    return cursor.lastrowid
+            except aiomysql.Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"查询执行失败: {e}")
+                if not in_tx:
+                    await connection.rollback()
+                raise
+
+    async def insert_many(self, insert_prefix: str, rows: List[tuple]) -> List[int]:
+        """多行 INSERT 批量写入，语义同 DatabaseManager.insert_many"""
+        if not rows:
+            return []
+        ids = []
+        async with nullcontext() if self.in_transaction else self.transaction():
+            async with self._borrow() as connection:
+                try:
+                    async with connection.cursor() as cursor:
+                        for chunk in _chunk_rows(rows, self.max_packet_bytes, self.bulk_chunk_rows):
+                            query = _multi_row_insert(insert_prefix, len(chunk[0]), len(chunk))
+                            values = tuple(v for row in chunk for v in row)
+                            start = time.perf_counter()
+                            await cursor.execute(query, values)
+                            self._observe(query, values, start, len(chunk))
+                            ids.extend(range(cursor.lastrowid, cursor.lastrowid + len(chunk)))
+                    logger.debug("批量写入成功: %s (%d 行)", insert_prefix, len(rows))
+                except aiomysql.Error as e:
+                    self._observe(query, values, start, failed=True)
+                    logger.error(f"批量写入失败: {e}")
+                    raise
+        return ids
+
+    async def insert_chunked(self, insert_prefix: str, rows: List[tuple],
+                             on_commit=None) -> Tuple[List[Optional[int]], List[Tuple[int, str]]]:
+        """大批量导入，语义同 DatabaseManager.insert_chunked"""
+        ids, errors = [], []
+        try:
+            for start in range(0, len(rows), self.bulk_chunk_rows):
+                chunk = rows[start:start + self.bulk_chunk_rows]
+                chunk_errors = []
+                try:
+                    async with self.transaction():
+                        chunk_ids = await self.insert_many(insert_prefix, chunk)
+                        self._after_chunk(on_commit, start, chunk_ids)
+                except aiomysql.Error as e:
+                    if aborts_transaction(e):
+                        raise
+                    logger.warning(f"批量写入第 {start} 行起的块失败，改为逐行写入")
+                    single = _multi_row_insert(insert_prefix, len(chunk[0]), 1)
+                    chunk_ids = []
+                    async with self.transaction():
+                        for index, row in enumerate(chunk, start):
+                            try:
+                                async with self.transaction():
+                                    chunk_ids.append(await self.execute_insert(single, row))
+                            except aiomysql.Error as e:
+                                if aborts_transaction(e):
+                                    raise
+                                chunk_ids.append(None)
+                                chunk_errors.append((index, str(e)))
+                        self._after_chunk(on_commit, start, chunk_ids)
+                ids.extend(chunk_ids)
+                errors.extend(chunk_errors)
+        except Exception as e:
+            logger.error(f"批量导入中断，已提交 {len(ids)} 行: {e}")
+            raise _partial_import(len(rows), ids, errors, e) from e
+        return ids, errors
+
+    def _after_chunk(self, on_commit, start: int, chunk_ids: List[Optional[int]]):
+        if on_commit:
+            inserted = _inserted_rows(start, chunk_ids)
+            self.after_commit(lambda: on_commit(inserted))
+
+    async def fetch_all(self, query: str, params: tuple = None, row_format: str = "dict"):
+        """执行查询并返回所有结果，row_format 同 DatabaseManager.fetch_all"""
+        check_row_format(row_format)
+        async with self._borrow_read() as connection:
+            start = time.perf_counter()
+            try:
+                cursor_class = aiomysql.DictCursor if row_format == "dict" else aiomysql.Cursor
+                async with connection.cursor(cursor_class) as cursor:
+                    await cursor.execute(query, params or ())
+                    result = list(await cursor.fetchall())
+                    if row_format != "dict":
+                        columns = [column[0] for column in cursor.description or ()]
+                        result = build_rows(row_format, columns, result)
+                    self._observe(query, params, start, len(result))
+                    return result
+            except aiomysql.Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+
+    async def fetch_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
+        """执行查询并返回单条结果"""
+        async with self._borrow_read() as connection:
+            start = time.perf_counter()
+            try:
+                async with connection.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(query, params or ())
+                    result = await cursor.fetchone()
+                    self._observe(query, params, start, 1 if result else 0)
+                    return result
+            except aiomysql.Error as e:
+                self._observe(query, params, start, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+
+    async def fetch_iter(self, query: str, params: tuple = None,
+                         chunk_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """流式读取，语义同 DatabaseManager.fetch_iter"""
+        async with self._borrow_read() as connection:
+            start, count = time.perf_counter(), 0
+            try:
+                async with connection.cursor(aiomysql.SSDictCursor) as cursor:
+                    await cursor.execute(query, params or ())
+                    while True:
+                        rows = await cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        count += len(rows)
+                        for row in rows:
+                            yield row
+                self._observe(query, params, start, count)
+            except aiomysql.Error as e:
+                self._observe(query, params, start, count, failed=True)
+                logger.error(f"数据获取失败: {e}")
+                raise
+
+    async def fetch_in(self, query: str, keys: List[Any], params: tuple = ()) -> List[Dict[str, Any]]:
+        """批量加载，语义同 DatabaseManager.fetch_in"""
+        result = []
+        for sql, sql_params in _in_batches(query, keys, self.bulk_chunk_rows, params):
+            result.extend(await self.fetch_all(sql, sql_params))
+        return result
+
+    async def fetch_grouped(self, query: str, key: str, keys: List[Any],
+                            params: tuple = ()) -> Dict[Any, List[Dict[str, Any]]]:
+        """批量加载一对多关系，语义同 DatabaseManager.fetch_grouped"""
+        return group_rows(await self.fetch_in(query, keys, params), key, keys)
+
+    async def fetch_keyed(self, query: str, key: str, keys: List[Any],
+                          params: tuple = ()) -> Dict[Any, Dict[str, Any]]:
+        """批量加载一对一关系，语义同 DatabaseManager.fetch_keyed"""
+        return {row[key]: row for row in await self.fetch_in(query, keys, params)}
+
+def read_through(cache: CacheBackend, key: str, load, tags=None):
+    """读穿透：命中返回缓存副本，否则调用 load() 查库并回填；tags(row) 给出失效标签
+
+    回填的行从主库读取（见 primary_reads），副本上写入前的旧行不会进入共享缓存；
+    查库期间该键或其标签被失效时放弃回填（见 CacheBackend.fill_token）。
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return dict(cached)
+    token = cache.fill_token()
+    with primary_reads():
+        row = load()
+    if row is not None:
+        cache.set(key, dict(row), tags(row) if tags else (), token)
+    return row
+
+async def read_through_async(cache: CacheBackend, key: str, load, tags=None):
+    """异步读穿透，load() 返回可等待对象"""
+    cached = cache.get(key)
+    if cached is not None:
+        return dict(cached)
+    token = cache.fill_token()
+    with primary_reads():
+        row = await load()
+    if row is not None:
+        cache.set(key, dict(row), tags(row) if tags else (), token)
+    return row
+
+def read_through_many(cache: CacheBackend, prefix: str, ids: List[Any], load, tags=None) -> Dict[Any, Dict[str, Any]]:
+    """批量读穿透：ID 去重后逐个查缓存，未命中的一次调用 load(ids) -> {ID: 行} 查库并回填
+
+    返回按请求顺序排列的 {ID: 行}，不存在的 ID 不出现在结果中；回填的行同 read_through 从主库读取。
+    """
+    unique = list(dict.fromkeys(ids))
+    found, missing = {}, []
+    for key in unique:
+        cached = cache.get(f"{prefix}:{key}")
+        if cached is not None:
+            found[key] = dict(cached)
+        else:
+            missing.append(key)
+    if missing:
+        token = cache.fill_token()
+        with primary_reads():
+            loaded = load(missing)
+        for key, row in loaded.items():
+            cache.set(f"{prefix}:{key}", dict(row), tags(row) if tags else (), token)
+            found[key] = row
+    return {key: found[key] for key in unique if key in found}
+
+async def read_through_many_async(cache: CacheBackend, prefix: str, ids: List[Any], load,
+                                  tags=None) -> Dict[Any, Dict[str, Any]]:
+    """异步批量读穿透，load(ids) 返回可等待对象"""
+    unique = list(dict.fromkeys(ids))
+    found, missing = {}, []
+    for key in unique:
+        cached = cache.get(f"{prefix}:{key}")
+        if cached is not None:
+            found[key] = dict(cached)
+        else:
+            missing.append(key)
+    if missing:
+        token = cache.fill_token()
+        with primary_reads():
+            loaded = await load(missing)
+        for key, row in loaded.items():
+            cache.set(f"{prefix}:{key}", dict(row), tags(row) if tags else (), token)
+            found[key] = row
+    return {key: found[key] for key in unique if key in found}
 
 class UserService:
-    def __init__(self, db_manager: DatabaseManager):
+    # 订单行中带有的用户列，变更时递增 users 版本
+    ORDER_VISIBLE_FIELDS = ('username', 'full_name')
+    
+    def __init__(self, db_manager: DatabaseManager, cache: CacheBackend = None,
+                 versions: VersionCounters = None):
         self.db = db_manager
+        self.cache = cache or NULL_CACHE
+        self.versions = versions or NULL_VERSIONS
+    
+    def _invalidate(self, user_id: int, order_visible: bool = False):
+        self.cache.delete(f"user:{user_id}")
+        if order_visible:
+            self.versions.bump("users")
     
     def create_user(self, username: str, email: str, password: str, 
                    full_name: str = None, phone: str = None) -> int:
@@ -96,14 +1829,34 @@ class UserService:
         VALUES (%s, %s, %s, %s, %s)
         """
         params = (username, email, password, full_name, phone)
-        result = self.db.execute_query(query, params)
-        return result
+        return self.db.execute_insert(query, params)
+    
+    USER_BULK_INSERT = "INSERT INTO users (username, email, password, full_name, phone) VALUES"
+    
+    def create_users(self, users: List[Dict[str, Any]]) -> Tuple[List[Optional[int]], List[Tuple[int, str]]]:
+        """批量创建用户，返回 (与输入对齐的用户ID，失败为 None, [(行号, 错误信息)])"""
+        rows = [(u['username'], u['email'], u['password'], u.get('full_name'), u.get('phone'))
+                for u in users]
+        return self.db.insert_chunked(self.USER_BULK_INSERT, rows)
+    
+    # 按ID读取（进入缓存）的用户列，不含密码：凭据不进入进程内或共享缓存
+    USER_CACHE_COLUMNS = "user_id, username, email, full_name, phone, created_at, updated_at"
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """根据ID获取用户"""
-        query = "SELECT * FROM users WHERE user_id = %s"
+        """根据ID获取用户（读穿透缓存，不含密码）"""
+        return read_through(self.cache, f"user:{user_id}", lambda: self._fetch_user_by_id(user_id))
+    
+    def _fetch_user_by_id(self, user_id: int):
+        query = f"SELECT {self.USER_CACHE_COLUMNS} FROM users WHERE user_id = %s"
         return self.db.fetch_one(query, (user_id,))
     
+    USERS_BY_IDS_QUERY = f"SELECT {USER_CACHE_COLUMNS} FROM users WHERE user_id IN ({{keys}})"
+    
+    def get_users_by_ids(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取用户（不含密码）：缓存未命中的ID合并为 IN 查询，返回 {用户ID: 用户}"""
+        return read_through_many(self.cache, "user", user_ids,
+                                 lambda ids: self.db.fetch_keyed(self.USERS_BY_IDS_QUERY, 'user_id', ids))
+    
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """根据用户名获取用户"""
         query = "SELECT * FROM users WHERE username = %s"
@@ -114,10 +1867,34 @@ class UserService:
         query = "SELECT * FROM users WHERE email = %s"
         return self.db.fetch_one(query, (email,))
     
-    def get_all_users(self) -> List[Dict[str, Any]]:
+    def get_all_users(self, row_format: str = "dict") -> List[Dict[str, Any]]:
         """获取所有用户"""
         query = "SELECT * FROM users ORDER BY created_at DESC"
-        return self.db.fetch_all(query)
+        return self.db.fetch_all(query, row_format=row_format)
+    
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        """流式遍历所有用户"""
+        query = "SELECT * FROM users ORDER BY created_at DESC"
+        return self.db.fetch_iter(query)
+    
+    USER_PAGE_KEYS = ("created_at", "user_id")
+    
+    def _users_page_query(self, limit: int, cursor: Optional[str]) -> Tuple[str, tuple]:
+        condition, params = keyset_condition(self.USER_PAGE_KEYS, cursor, descending=True)
+        query = f"""
+        SELECT * FROM users 
+        {"WHERE " + condition if condition else ""} 
+        ORDER BY created_at DESC, user_id DESC 
+        LIMIT %s
+        """
+        return query, params + (limit + 1,)
+    
+    def get_users_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                       cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取用户，返回 (用户列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = self.db.fetch_all(*self._users_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.USER_PAGE_KEYS)
     
     def update_user(self, user_id: int, **kwargs) -> int:
         """更新用户信息"""
@@ -127,22 +1904,39 @@ class UserService:
         set_clause = ", ".join([f"{key} = %s" for key in kwargs.keys()])
         query = f"UPDATE users SET {set_clause} WHERE user_id = %s"
         params = tuple(kwargs.values()) + (user_id,)
+        order_visible = any(key in kwargs for key in self.ORDER_VISIBLE_FIELDS)
         
-        return self.db.execute_query(query, params)
+        return self.db.execute_query(query, params, on_commit=lambda: self._invalidate(user_id, order_visible))
     
     def delete_user(self, user_id: int) -> int:
         """删除用户"""
         query = "DELETE FROM users WHERE user_id = %s"
-        return self.db.execute_query(query, (user_id,))
+        return self.db.execute_query(query, (user_id,), on_commit=lambda: self._invalidate(user_id, True))
+    
+    def iter_user_signups(self, after_user_id: int = 0) -> Iterator[Dict[str, Any]]:
+        """流式读取 user_id 大于 after_user_id 的用户注册时间（报表按注册月份划分用户群，增量加载新用户）"""
+        query = "SELECT user_id, created_at FROM users WHERE user_id > %s ORDER BY user_id"
+        return self.db.fetch_iter(query, (after_user_id,))
     
     def change_password(self, user_id: int, new_password: str) -> int:
         """修改用户密码"""
         query = "UPDATE users SET password = %s WHERE user_id = %s"
-        return self.db.execute_query(query, (new_password, user_id))
+        return self.db.execute_query(query, (new_password, user_id),
+                                     on_commit=lambda: self._invalidate(user_id))
 
 class CategoryService:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, cache: CacheBackend = None,
+                 tree: CategoryTreeIndex = None, versions: VersionCounters = None):
         self.db = db_manager
+        self.cache = cache or NULL_CACHE
+        self.tree = tree if tree is not None else CategoryTreeIndex()
+        self.versions = versions or NULL_VERSIONS
+    
+    def _invalidate(self, category_id: int):
+        # 商品缓存行中带有 category_name，按分类标签一并失效
+        self.cache.delete(f"category:{category_id}")
+        self.cache.invalidate_tag(f"category:{category_id}")
+        self.versions.bump("categories")
     
     def create_category(self, category_name: str, parent_id: int = None, 
                        description: str = None) -> int:
@@ -152,17 +1946,31 @@ class CategoryService:
         VALUES (%s, %s, %s)
         """
         params = (category_name, parent_id, description)
-        return self.db.execute_query(query, params)
+        
+        def on_commit(category_id):
+            self.versions.bump("categories")
+            self.tree.add({
+                'category_id': category_id,
+                'category_name': category_name,
+                'parent_id': parent_id,
+                'description': description,
+            })
+        
+        return self.db.execute_insert(query, params, on_commit=on_commit)
     
     def get_category_by_id(self, category_id: int) -> Optional[Dict[str, Any]]:
-        """根据ID获取分类"""
+        """根据ID获取分类（读穿透缓存）"""
+        return read_through(self.cache, f"category:{category_id}",
+                            lambda: self._fetch_category_by_id(category_id))
+    
+    def _fetch_category_by_id(self, category_id: int):
         query = "SELECT * FROM categories WHERE category_id = %s"
         return self.db.fetch_one(query, (category_id,))
     
-    def get_all_categories(self) -> List[Dict[str, Any]]:
+    def get_all_categories(self, row_format: str = "dict") -> List[Dict[str, Any]]:
         """获取所有分类"""
         query = "SELECT * FROM categories ORDER BY category_name"
-        return self.db.fetch_all(query)
+        return self.db.fetch_all(query, row_format=row_format)
     
     def get_subcategories(self, parent_id: int) -> List[Dict[str, Any]]:
         """获取指定父分类的子分类"""
@@ -174,25 +1982,85 @@ class CategoryService:
         query = "SELECT * FROM categories WHERE parent_id IS NULL ORDER BY category_name"
         return self.db.fetch_all(query)
     
+    def _check_parent(self, category_id: int, parent_id: Optional[int]):
+        """拒绝把分类移动到自身或其子分类下"""
+        if parent_id is not None and self.tree.is_descendant(parent_id, category_id):
+            raise ValueError("不能将分类移动到自身或其子分类下")
+    
     def update_category(self, category_id: int, **kwargs) -> int:
         """更新分类信息"""
         if not kwargs:
             return 0
-        
+        if 'parent_id' in kwargs:
+            self._ensure_tree()
+            self._check_parent(category_id, kwargs['parent_id'])
+        return self._update_category(category_id, **kwargs)
+    
+    def _update_category(self, category_id: int, **kwargs):
         set_clause = ", ".join([f"{key} = %s" for key in kwargs.keys()])
         query = f"UPDATE categories SET {set_clause} WHERE category_id = %s"
         params = tuple(kwargs.values()) + (category_id,)
         
-        return self.db.execute_query(query, params)
+        def on_commit():
+            self._invalidate(category_id)
+            self.tree.update(category_id, **kwargs)
+        
+        return self.db.execute_query(query, params, on_commit=on_commit)
     
     def delete_category(self, category_id: int) -> int:
         """删除分类"""
         query = "DELETE FROM categories WHERE category_id = %s"
-        return self.db.execute_query(query, (category_id,))
+        
+        def on_commit():
+            self._invalidate(category_id)
+            self.tree.remove(category_id)
+        
+        return self.db.execute_query(query, (category_id,), on_commit=on_commit)
+    
+    def _ensure_tree(self) -> CategoryTreeIndex:
+        """分类树索引未加载或已过期时整表重载；并发的请求只由一个重载，其余等待后复用"""
+        if not self.tree.loaded:
+            with self.tree.reload_lock:
+                if not self.tree.loaded:
+                    self.tree.load(self.get_all_categories())
+        return self.tree
+    
+    def get_category_tree(self, root_id: int = None) -> List[Dict[str, Any]]:
+        """获取嵌套分类树（root_id 为空时为整棵树）"""
+        return self._ensure_tree().tree(root_id)
+    
+    def get_category_breadcrumbs(self, category_id: int) -> List[Dict[str, Any]]:
+        """获取从一级分类到该分类的路径"""
+        return self._ensure_tree().ancestors(category_id)
+    
+    def get_descendant_ids(self, category_id: int, include_self: bool = True) -> List[int]:
+        """获取分类子树内的所有分类ID"""
+        return self._ensure_tree().descendant_ids(category_id, include_self)
 
 class ProductService:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, cache: CacheBackend = None,
+                 search_index: ProductSearchIndex = None, versions: VersionCounters = None):
         self.db = db_manager
+        self.cache = cache or NULL_CACHE
+        # 未配置倒排索引时检索退回 LIKE 全表扫描
+        self.search_index = search_index
+        self.versions = versions or NULL_VERSIONS
+    
+    def _invalidate(self, product_id: int):
+        self.cache.delete(f"product:{product_id}")
+        self.versions.bump("products")
+    
+    def _index_update(self, product_id: int, **fields):
+        if self.search_index is not None:
+            self.search_index.update(product_id, **fields)
+    
+    def _index_remove(self, product_id: int):
+        if self.search_index is not None:
+            self.search_index.remove(product_id)
+    
+    @staticmethod
+    def _cache_tags(product: Dict[str, Any]):
+        return (f"category:{product['category_id']}",)
     
     def create_product(self, product_name: str, price: float, category_id: int,
                       description: str = None, stock_quantity: int = 0) -> int:
@@ -202,10 +2070,37 @@ class ProductService:
         VALUES (%s, %s, %s, %s, %s)
         """
         params = (product_name, description, price, stock_quantity, category_id)
-        return self.db.execute_query(query, params)
+        
+        def on_commit(product_id):
+            self.versions.bump("products")
+            if self.search_index is not None:
+                self.search_index.add(product_id, product_name, description)
+        
+        return self.db.execute_insert(query, params, on_commit=on_commit)
+    
+    PRODUCT_BULK_INSERT = ("INSERT INTO products (product_name, description, price, stock_quantity, category_id) "
+                           "VALUES")
+    
+    def create_products(self, products: List[Dict[str, Any]]) -> Tuple[List[Optional[int]], List[Tuple[int, str]]]:
+        """批量创建商品，返回 (与输入对齐的商品ID，失败为 None, [(行号, 错误信息)])；每块提交后加入检索索引"""
+        rows = [(p['product_name'], p.get('description'), p['price'], p.get('stock_quantity', 0), p['category_id'])
+                for p in products]
+        
+        def on_commit(inserted):
+            self.versions.bump("products")
+            if self.search_index is not None:
+                for index, product_id in inserted:
+                    self.search_index.add(product_id, products[index]['product_name'],
+                                          products[index].get('description'))
+        
+        return self.db.insert_chunked(self.PRODUCT_BULK_INSERT, rows, on_commit=on_commit)
     
     def get_product_by_id(self, product_id: int) -> Optional[Dict[str, Any]]:
-        """根据ID获取商品"""
+        """根据ID获取商品（读穿透缓存）"""
+        return read_through(self.cache, f"product:{product_id}",
+                            lambda: self._fetch_product_by_id(product_id), self._cache_tags)
+    
+    def _fetch_product_by_id(self, product_id: int):
         query = """
         SELECT p.*, c.category_name 
         FROM products p 
@@ -214,7 +2109,13 @@ class ProductService:
         """
         return self.db.fetch_one(query, (product_id,))
     
-    def get_all_products(self) -> List[Dict[str, Any]]:
+    def get_products_by_ids(self, product_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取商品：缓存未命中的ID合并为 IN 查询，返回 {商品ID: 商品}"""
+        return read_through_many(self.cache, "product", product_ids,
+                                 lambda ids: self.db.fetch_keyed(self.PRODUCTS_BY_IDS_QUERY, 'product_id', ids),
+                                 self._cache_tags)
+    
+    def get_all_products(self, row_format: str = "dict") -> List[Dict[str, Any]]:
         """获取所有商品"""
         query = """
         SELECT p.*, c.category_name 
@@ -222,7 +2123,39 @@ class ProductService:
         LEFT JOIN categories c ON p.category_id = c.category_id 
         ORDER BY p.created_at DESC
         """
-        return self.db.fetch_all(query)
+        return self.db.fetch_all(query, row_format=row_format)
+    
+    def iter_products(self) -> Iterator[Dict[str, Any]]:
+        """流式遍历所有商品"""
+        query = """
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        ORDER BY p.created_at DESC
+        """
+        return self.db.fetch_iter(query)
+    
+    PRODUCT_PAGE_KEYS = ("p.created_at", "p.product_id")
+    CATEGORY_PRODUCT_PAGE_KEYS = ("p.product_name", "p.product_id")
+    
+    def _products_page_query(self, limit: int, cursor: Optional[str]) -> Tuple[str, tuple]:
+        condition, params = keyset_condition(self.PRODUCT_PAGE_KEYS, cursor, descending=True)
+        query = f"""
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        {"WHERE " + condition if condition else ""} 
+        ORDER BY p.created_at DESC, p.product_id DESC 
+        LIMIT %s
+        """
+        return query, params + (limit + 1,)
+    
+    def get_products_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                          cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取商品，返回 (商品列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = self.db.fetch_all(*self._products_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.PRODUCT_PAGE_KEYS)
     
     def get_products_by_category(self, category_id: int) -> List[Dict[str, Any]]:
         """根据分类获取商品"""
@@ -235,6 +2168,49 @@ class ProductService:
         """
         return self.db.fetch_all(query, (category_id,))
     
+    def _products_by_category_page_query(self, category_id: int, limit: int,
+                                         cursor: Optional[str]) -> Tuple[str, tuple]:
+        condition, params = keyset_condition(self.CATEGORY_PRODUCT_PAGE_KEYS, cursor, descending=False)
+        query = f"""
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        WHERE p.category_id = %s {"AND " + condition if condition else ""} 
+        ORDER BY p.product_name, p.product_id 
+        LIMIT %s
+        """
+        return query, (category_id,) + params + (limit + 1,)
+    
+    def get_products_by_category_page(self, category_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                      cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取分类下的商品，返回 (商品列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = self.db.fetch_all(*self._products_by_category_page_query(category_id, limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.CATEGORY_PRODUCT_PAGE_KEYS)
+    
+    def _products_by_categories_page_query(self, category_ids: List[int], limit: int,
+                                           cursor: Optional[str]) -> Tuple[str, tuple]:
+        condition, params = keyset_condition(self.CATEGORY_PRODUCT_PAGE_KEYS, cursor, descending=False)
+        placeholders = ", ".join(["%s"] * len(category_ids))
+        query = f"""
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        WHERE p.category_id IN ({placeholders}) {"AND " + condition if condition else ""} 
+        ORDER BY p.product_name, p.product_id 
+        LIMIT %s
+        """
+        return query, tuple(category_ids) + params + (limit + 1,)
+    
+    def get_products_by_categories_page(self, category_ids: List[int], limit: int = DEFAULT_PAGE_SIZE,
+                                        cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取多个分类下的商品（一条 IN 查询），返回 (商品列表, 下一页游标)"""
+        if not category_ids:
+            return [], None
+        limit = clamp_page_size(limit)
+        rows = self.db.fetch_all(*self._products_by_categories_page_query(category_ids, limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.CATEGORY_PRODUCT_PAGE_KEYS)
+    
     def search_products(self, keyword: str) -> List[Dict[str, Any]]:
         """搜索商品"""
         query = """
@@ -247,6 +2223,53 @@ class ProductService:
         search_term = f"%{keyword}%"
         return self.db.fetch_all(query, (search_term, search_term))
     
+    SEARCH_INDEX_QUERY = "SELECT product_id, product_name, description FROM products"
+    PRODUCTS_BY_IDS_QUERY = """
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        WHERE p.product_id IN ({keys})
+        """
+    
+    def _ensure_search_index(self) -> ProductSearchIndex:
+        """倒排索引未加载或已过期时流式读取全部商品重建；并发的请求只由一个重建，其余等待后复用"""
+        if not self.search_index.loaded:
+            with self.search_index.reload_lock:
+                if not self.search_index.loaded:
+                    self.search_index.load(self.db.fetch_iter(self.SEARCH_INDEX_QUERY))
+        return self.search_index
+    
+    def _like_search_page_query(self, keyword: str, limit: int, offset: int) -> Tuple[str, tuple]:
+        query = """
+        SELECT p.*, c.category_name 
+        FROM products p 
+        LEFT JOIN categories c ON p.category_id = c.category_id 
+        WHERE p.product_name LIKE %s OR p.description LIKE %s 
+        ORDER BY p.product_name, p.product_id 
+        LIMIT %s OFFSET %s
+        """
+        search_term = f"%{keyword}%"
+        return query, (search_term, search_term, limit, offset)
+    
+    @staticmethod
+    def _ranked_rows(hits: List[Tuple[int, float]], rows_by_id: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # 按相关度顺序输出；索引中已被其他进程删除的商品跳过
+        return [rows_by_id[product_id] for product_id, _ in hits if product_id in rows_by_id]
+    
+    def search_products_ranked(self, keyword: str, limit: int = 20,
+                               offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """按 BM25 相关度分页检索商品，返回 (商品列表, 命中总数)
+
+        未配置倒排索引时退回 LIKE 查询，命中总数为 None。
+        """
+        limit = clamp_page_size(limit)
+        if self.search_index is None:
+            return self.db.fetch_all(*self._like_search_page_query(keyword, limit, offset)), None
+        hits, total = self._ensure_search_index().search(keyword, limit, offset)
+        rows_by_id = self.db.fetch_keyed(self.PRODUCTS_BY_IDS_QUERY, 'product_id',
+                                         [product_id for product_id, _ in hits])
+        return self._ranked_rows(hits, rows_by_id), total
+    
     def update_product(self, product_id: int, **kwargs) -> int:
         """更新商品信息"""
         if not kwargs:
@@ -256,21 +2279,41 @@ class ProductService:
         query = f"UPDATE products SET {set_clause} WHERE product_id = %s"
         params = tuple(kwargs.values()) + (product_id,)
         
-        return self.db.execute_query(query, params)
+        def on_commit():
+            self._invalidate(product_id)
+            self._index_update(product_id, **kwargs)
+        
+        return self.db.execute_query(query, params, on_commit=on_commit)
     
     def update_stock(self, product_id: int, new_quantity: int) -> int:
         """更新商品库存"""
         query = "UPDATE products SET stock_quantity = %s WHERE product_id = %s"
-        return self.db.execute_query(query, (new_quantity, product_id))
+        return self.db.execute_query(query, (new_quantity, product_id),
+                                     on_commit=lambda: self._invalidate(product_id))
+    
+    def adjust_stock(self, product_id: int, delta: int) -> int:
+        """原子地增减库存（库存不会减到负数），返回受影响行数；0 表示商品不存在或库存不足"""
+        query = """
+        UPDATE products SET stock_quantity = stock_quantity + %s 
+        WHERE product_id = %s AND stock_quantity + %s >= 0
+        """
+        return self.db.execute_query(query, (delta, product_id, delta),
+                                     on_commit=lambda: self._invalidate(product_id))
     
     def delete_product(self, product_id: int) -> int:
         """删除商品"""
         query = "DELETE FROM products WHERE product_id = %s"
-        return self.db.execute_query(query, (product_id,))
+        
+        def on_commit():
+            self._invalidate(product_id)
+            self._index_remove(product_id)
+        
+        return self.db.execute_query(query, (product_id,), on_commit=on_commit)
 
 class OrderService:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, versions: VersionCounters = None):
         self.db = db_manager
+        self.versions = versions or NULL_VERSIONS
     
     def create_order(self, user_id: int, total_amount: float, 
                     shipping_address: str, status: str = 'pending') -> int:
@@ -280,7 +2323,7 @@ class OrderService:
         VALUES (%s, %s, %s, %s)
         """
         params = (user_id, total_amount, status, shipping_address)
-        return self.db.execute_query(query, params)
+        return self.db.execute_insert(query, params)
     
     def get_order_by_id(self, order_id: int) -> Optional[Dict[str, Any]]:
         """根据ID获取订单"""
@@ -292,7 +2335,18 @@ class OrderService:
         """
         return self.db.fetch_one(query, (order_id,))
     
-    def get_orders_by_user(self, user_id: int) -> List[Dict[str, Any]]:
+    ORDERS_BY_IDS_QUERY = """
+        SELECT o.*, u.username, u.full_name 
+        FROM orders o 
+        LEFT JOIN users u ON o.user_id = u.user_id 
+        WHERE o.order_id IN ({keys})
+        """
+    
+    def get_orders_by_ids(self, order_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取订单（一条 IN 查询，ID 过多时分块），返回 {订单ID: 订单}"""
+        return self.db.fetch_keyed(self.ORDERS_BY_IDS_QUERY, 'order_id', order_ids)
+    
+    def get_orders_by_user(self, user_id: int, row_format: str = "dict") -> List[Dict[str, Any]]:
         """获取用户的订单"""
         query = """
         SELECT o.*, u.username, u.full_name 
@@ -301,9 +2355,9 @@ class OrderService:
         WHERE o.user_id = %s 
         ORDER BY o.order_date DESC
         """
-        return self.db.fetch_all(query, (user_id,))
+        return self.db.fetch_all(query, (user_id,), row_format=row_format)
     
-    def get_all_orders(self) -> List[Dict[str, Any]]:
+    def get_all_orders(self, row_format: str = "dict") -> List[Dict[str, Any]]:
         """获取所有订单"""
         query = """
         SELECT o.*, u.username, u.full_name 
@@ -311,31 +2365,126 @@ class OrderService:
         LEFT JOIN users u ON o.user_id = u.user_id 
         ORDER BY o.order_date DESC
         """
-        return self.db.fetch_all(query)
+        return self.db.fetch_all(query, row_format=row_format)
+    
+    def iter_orders(self) -> Iterator[Dict[str, Any]]:
+        """流式遍历所有订单"""
+        query = """
+        SELECT o.*, u.username, u.full_name 
+        FROM orders o 
+        LEFT JOIN users u ON o.user_id = u.user_id 
+        ORDER BY o.order_date DESC
+        """
+        return self.db.fetch_iter(query)
+    
+    def iter_orders_between(self, start: datetime, end: datetime) -> Iterator[Dict[str, Any]]:
+        """流式读取下单时间在 [start, end) 内的订单（报表用的列）"""
+        query = """
+        SELECT order_id, user_id, status, order_date 
+        FROM orders 
+        WHERE order_date >= %s AND order_date < %s
+        """
+        return self.db.fetch_iter(query, (start, end))
+    
+    def get_daily_fingerprints(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """按天汇总 [start, end) 内订单的行数、总金额与各行 (订单ID, 用户, 状态, 金额) 的校验和，
+        报表据此判断缓存的日分区是否过期（状态变更、金额调整都会改变校验和）"""
+        query = """
+        SELECT DATE(order_date) AS day, COUNT(*) AS orders, SUM(total_amount) AS total, 
+               BIT_XOR(CRC32(CONCAT_WS('|', order_id, user_id, status, total_amount))) AS checksum 
+        FROM orders 
+        WHERE order_date >= %s AND order_date < %s 
+        GROUP BY DATE(order_date)
+        """
+        return self.db.fetch_all(query, (start, end))
+    
+    ORDER_PAGE_KEYS = ("o.order_date", "o.order_id")
+    
+    def _orders_page_query(self, limit: int, cursor: Optional[str]) -> Tuple[str, tuple]:
+        condition, params = keyset_condition(self.ORDER_PAGE_KEYS, cursor, descending=True)
+        query = f"""
+        SELECT o.*, u.username, u.full_name 
+        FROM orders o 
+        LEFT JOIN users u ON o.user_id = u.user_id 
+        {"WHERE " + condition if condition else ""} 
+        ORDER BY o.order_date DESC, o.order_id DESC 
+        LIMIT %s
+        """
+        return query, params + (limit + 1,)
+    
+    def get_orders_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取订单，返回 (订单列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = self.db.fetch_all(*self._orders_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.ORDER_PAGE_KEYS)
+    
+    def lock_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        """在当前事务中锁定订单行（SELECT ... FOR UPDATE），返回订单状态"""
+        query = "SELECT order_id, status FROM orders WHERE order_id = %s FOR UPDATE"
+        return self.db.fetch_one(query, (order_id,))
     
     def update_order_status(self, order_id: int, new_status: str) -> int:
         """更新订单状态"""
         query = "UPDATE orders SET status = %s WHERE order_id = %s"
-        return self.db.execute_query(query, (new_status, order_id))
+        return self.db.execute_query(query, (new_status, order_id),
+                                     on_commit=lambda: self.versions.bump(f"order:{order_id}"))
     
     def delete_order(self, order_id: int) -> int:
         """删除订单"""
         query = "DELETE FROM orders WHERE order_id = %s"
-        return self.db.execute_query(query, (order_id,))
+        return self.db.execute_query(query, (order_id,), on_commit=lambda: self.versions.bump(f"order:{order_id}"))
 
 class OrderItemService:
-    def __init__(self, db_manager: DatabaseManager):
+    """订单项
+
+    orders.total_amount 由订单项的每次增删改在同一事务中按差额维护，读取总金额只需按主键取一列。
+    """
+    
+    ADJUST_TOTAL_QUERY = "UPDATE orders SET total_amount = total_amount + %s WHERE order_id = %s"
+    LOCK_ITEM_QUERY = """
+    SELECT order_id, quantity, unit_price, subtotal FROM order_items 
+    WHERE order_item_id = %s FOR UPDATE
+    """
+    ORDER_TOTALS_QUERY = "SELECT order_id, total_amount FROM orders WHERE order_id IN ({keys})"
+    
+    def __init__(self, db_manager: DatabaseManager, versions: VersionCounters = None):
         self.db = db_manager
+        self.versions = versions or NULL_VERSIONS
+    
+    def _adjust_total(self, order_id: int, delta) -> int:
+        """在当前事务中按差额调整订单总金额，提交后订单的 ETag 随之变化"""
+        return self.db.execute_query(self.ADJUST_TOTAL_QUERY, (delta, order_id),
+                                     on_commit=lambda: self.versions.bump(f"order:{order_id}"))
     
     def add_order_item(self, order_id: int, product_id: int, 
                       quantity: int, unit_price: float) -> int:
-        """添加订单项"""
+        """添加订单项，同一事务中累加订单总金额"""
         query = """
         INSERT INTO order_items (order_id, product_id, quantity, unit_price)
         VALUES (%s, %s, %s, %s)
         """
         params = (order_id, product_id, quantity, unit_price)
-        return self.db.execute_query(query, params)
+        with self.db.transaction():
+            order_item_id = self.db.execute_insert(query, params)
+            self._adjust_total(order_id, quantity * unit_price)
+        return order_item_id
+    
+    ORDER_ITEM_BULK_INSERT = "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES"
+    
+    def add_order_items(self, order_id: int, items: List[Dict], adjust_total: bool = True) -> List[int]:
+        """批量添加订单项（多行 INSERT），返回按输入顺序排列的订单项ID；
+        adjust_total=False 用于订单头创建时已按这些订单项写入总金额的情形（下单）"""
+        rows = [
+            (order_id, item['product_id'], item['quantity'], item['unit_price'])
+            for item in items
+        ]
+        if not adjust_total:
+            return self.db.insert_many(self.ORDER_ITEM_BULK_INSERT, rows)
+        with self.db.transaction():
+            order_item_ids = self.db.insert_many(self.ORDER_ITEM_BULK_INSERT, rows)
+            self._adjust_total(order_id, sum(item['quantity'] * item['unit_price'] for item in items))
+        return order_item_ids
     
     def get_order_items(self, order_id: int) -> List[Dict[str, Any]]:
         """获取订单的所有商品项"""
@@ -347,71 +2496,760 @@ class OrderItemService:
         """
         return self.db.fetch_all(query, (order_id,))
     
+    def iter_items_between(self, start: datetime, end: datetime) -> Iterator[Dict[str, Any]]:
+        """流式读取下单时间在 [start, end) 内的订单的订单项（报表用的列）"""
+        query = """
+        SELECT oi.order_id, oi.product_id, oi.quantity, oi.subtotal 
+        FROM order_items oi 
+        JOIN orders o ON oi.order_id = o.order_id 
+        WHERE o.order_date >= %s AND o.order_date < %s
+        """
+        return self.db.fetch_iter(query, (start, end))
+    
+    def get_order_items_for_orders(self, order_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """批量获取多个订单的商品项，返回 {订单ID: 商品项列表}"""
+        query = """
+        SELECT oi.*, p.product_name, p.description 
+        FROM order_items oi 
+        LEFT JOIN products p ON oi.product_id = p.product_id 
+        WHERE oi.order_id IN ({keys})
+        """
+        return self.db.fetch_grouped(query, 'order_id', order_ids)
+    
     def update_order_item_quantity(self, order_item_id: int, new_quantity: int) -> int:
-        """更新订单项数量"""
+        """更新订单项数量，同一事务中按数量差额调整订单总金额"""
         query = "UPDATE order_items SET quantity = %s WHERE order_item_id = %s"
-        return self.db.execute_query(query, (new_quantity, order_item_id))
+        with self.db.transaction():
+            item = self.db.fetch_one(self.LOCK_ITEM_QUERY, (order_item_id,))
+            if item is None:
+                return 0
+            updated = self.db.execute_query(query, (new_quantity, order_item_id))
+            self._adjust_total(item['order_id'], (new_quantity - item['quantity']) * item['unit_price'])
+        return updated
     
     def delete_order_item(self, order_item_id: int) -> int:
-        """删除订单项"""
+        """删除订单项，同一事务中从订单总金额扣除其小计"""
         query = "DELETE FROM order_items WHERE order_item_id = %s"
-        return self.db.execute_query(query, (order_item_id,))
+        with self.db.transaction():
+            item = self.db.fetch_one(self.LOCK_ITEM_QUERY, (order_item_id,))
+            if item is None:
+                return 0
+            deleted = self.db.execute_query(query, (order_item_id,))
+            self._adjust_total(item['order_id'], -item['subtotal'])
+        return deleted
     
     def get_order_total_amount(self, order_id: int) -> float:
-        """计算订单总金额"""
-        query = "SELECT SUM(subtotal) as total FROM order_items WHERE order_id = %s"
+        """获取订单总金额（订单头上增量维护的列）"""
+        query = "SELECT total_amount FROM orders WHERE order_id = %s"
         result = self.db.fetch_one(query, (order_id,))
-        return result['total'] if result and result['total'] else 0.0
+        return result['total_amount'] if result and result['total_amount'] else 0.0
+    
+    def get_order_totals(self, order_ids: List[int]) -> Dict[int, Any]:
+        """批量获取订单总金额（一条 IN 查询，ID 过多时分块），返回 {订单ID: 总金额}，不存在的订单不出现在结果中"""
+        return {row['order_id']: row['total_amount'] for row in self.db.fetch_in(self.ORDER_TOTALS_QUERY, order_ids)}
+    
+    RECOMPUTE_TOTALS_QUERY = """
+    UPDATE orders SET total_amount = (
+        SELECT COALESCE(SUM(subtotal), 0) FROM order_items WHERE order_items.order_id = orders.order_id
+    ) WHERE order_id IN ({keys})
+    """
+    
+    def recompute_order_totals(self, order_ids: List[int]) -> int:
+        """按订单项重新汇总订单总金额（修复增量维护之前已经漂移的数据），返回更新的订单数"""
+        updated = 0
+        with self.db.transaction():
+            for sql, params in _in_batches(self.RECOMPUTE_TOTALS_QUERY, order_ids, self.db.bulk_chunk_rows):
+                updated += self.db.execute_query(
+                    sql, params, on_commit=lambda chunk=params: self.versions.bump(*[f"order:{i}" for i in chunk]))
+        return updated
+
+class InventoryService:
+    """库存预留
+
+    下单时在订单事务中扣减库存：同一订单的各商品合并为一条带条件的 UPDATE（库存不足的行不更新），
+    按商品ID顺序加锁，受影响行数不等于商品数即库存不足。配置了 StockLedger 时，热点商品改为从
+    进程内租约扣减，订单回滚时预留退回租约；租约不足时在订单事务中续租（不另借连接，续租随订单
+    提交或回滚），闲置租约在事务外归还。本进程未用完的件数同步记录在 stock_leases 表中（随续租、
+    扣减、归还在同一事务中增减），sweep_leases() 定期续期并回收失联进程遗留的记录，进程崩溃不丢库存。
+
+    续租与归还只是在数据库与租约之间移动件数，可售总量不变，不失效商品缓存与版本号；
+    热点商品缓存中的库存因此是近似值（租约内的扣减本来也不失效），冷门商品的扣减与归还仍在提交后失效。
+    """
+    
+    STOCK_QUERY = "SELECT product_id, stock_quantity FROM products WHERE product_id IN ({keys})"
+    LEASE_QUERY = """
+    UPDATE products SET stock_quantity = stock_quantity - %s 
+    WHERE product_id = %s AND stock_quantity >= %s
+    """
+    LEASE_TABLE = """
+    CREATE TABLE IF NOT EXISTS stock_leases (
+        owner VARCHAR(64) NOT NULL,
+        product_id INT NOT NULL,
+        units INT NOT NULL,
+        renewed_at BIGINT NOT NULL,
+        PRIMARY KEY (owner, product_id)
+    )
+    """
+    LEASE_ROW_UPDATE = """
+    UPDATE stock_leases SET units = units + %s, renewed_at = %s 
+    WHERE owner = %s AND product_id = %s
+    """
+    LEASE_ROW_INSERT = "INSERT INTO stock_leases (owner, product_id, units, renewed_at) VALUES (%s, %s, %s, %s)"
+    LEASE_RENEW = "UPDATE stock_leases SET renewed_at = %s WHERE owner = %s"
+    LEASE_PRUNE = "DELETE FROM stock_leases WHERE owner = %s AND units = 0"
+    STALE_LEASES_QUERY = """
+    SELECT owner, product_id, units FROM stock_leases 
+    WHERE renewed_at < %s AND owner <> %s 
+    ORDER BY owner, product_id 
+    FOR UPDATE
+    """
+    STALE_LEASES_DELETE = "DELETE FROM stock_leases WHERE renewed_at < %s AND owner <> %s"
+    
+    def __init__(self, db_manager: DatabaseManager, cache: CacheBackend = None, ledger: StockLedger = None,
+                 versions: VersionCounters = None):
+        self.db = db_manager
+        self.cache = cache or NULL_CACHE
+        self.ledger = ledger
+        self.versions = versions or NULL_VERSIONS
+    
+    def _invalidate(self, product_ids):
+        self.cache.delete(*[f"product:{pid}" for pid in product_ids])
+        self.versions.bump("products")
+    
+    @staticmethod
+    def merge_quantities(items: List[Dict]) -> Dict[int, int]:
+        """按商品合并订单行数量，按商品ID排序（固定加锁顺序，避免并发下单互相死锁）"""
+        totals = {}
+        for item in items:
+            if item['quantity'] <= 0:
+                raise ValueError(f"商品 {item['product_id']} 的数量必须大于0")
+            totals[item['product_id']] = totals.get(item['product_id'], 0) + item['quantity']
+        return dict(sorted(totals.items()))
+    
+    @staticmethod
+    def _adjust_query(quantities: Dict[int, int], decrement: bool) -> Tuple[str, tuple]:
+        """一条 UPDATE 调整多个商品的库存；扣减时要求库存充足"""
+        case = "CASE product_id " + " ".join(["WHEN %s THEN %s"] * len(quantities)) + " END"
+        case_params = tuple(v for pair in quantities.items() for v in pair)
+        keys = ", ".join(["%s"] * len(quantities))
+        if decrement:
+            query = f"""
+            UPDATE products SET stock_quantity = stock_quantity - {case} 
+            WHERE product_id IN ({keys}) AND stock_quantity >= {case} 
+            ORDER BY product_id
+            """
+            return query, case_params + tuple(quantities) + case_params
+        query = f"""
+        UPDATE products SET stock_quantity = stock_quantity + {case} 
+        WHERE product_id IN ({keys}) 
+        ORDER BY product_id
+        """
+        return query, case_params + tuple(quantities)
+    
+    @staticmethod
+    def _shortages(quantities: Dict[int, int], rows: List[Dict[str, Any]]) -> Dict[int, tuple]:
+        stock = {row['product_id']: row['stock_quantity'] for row in rows}
+        return {pid: (qty, stock.get(pid, 0)) for pid, qty in quantities.items() if stock.get(pid, 0) < qty}
+    
+    def _split(self, quantities: Dict[int, int]) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """分为 (热点商品, 其他商品)"""
+        if self.ledger is None:
+            return {}, quantities
+        hot = {pid: qty for pid, qty in quantities.items() if self.ledger.is_hot(pid)}
+        return hot, {pid: qty for pid, qty in quantities.items() if pid not in hot}
+    
+    def reserve(self, items: List[Dict]):
+        """在当前事务中预留订单各行的库存，不足时抛出 InsufficientStockError（由外层事务回滚）"""
+        hot, cold = self._split(self.merge_quantities(items))
+        if cold:
+            query, params = self._adjust_query(cold, decrement=True)
+            updated = self.db.execute_query(query, params, on_commit=lambda: self._invalidate(cold))
+            if updated != len(cold):
+                raise InsufficientStockError(self._shortages(cold, self.db.fetch_in(self.STOCK_QUERY, list(cold))))
+        for product_id, quantity in hot.items():
+            self._reserve_leased(product_id, quantity)
+    
+    def _reserve_leased(self, product_id: int, quantity: int):
+        """先从租约扣减，不足的件数在当前事务中续租：本单用掉其中所需的件数，余下的在提交后记入租约；
+        本进程的租约记录在同一事务中按净变化增减"""
+        taken = self.ledger.take(product_id, quantity)
+        if taken:
+            self.db.after_rollback(lambda: self.ledger.give_back(product_id, taken))
+        need = quantity - taken
+        units = 0
+        if need:
+            # 先租整块，库存不足整块时只租所需件数
+            for units in dict.fromkeys((max(self.ledger.lease_size, need), need)):
+                if self._lease(product_id, units):
+                    break
+            else:
+                row = self.db.fetch_one(self.STOCK_QUERY.format(keys="%s"), (product_id,))
+                available = taken + self.ledger.available(product_id) + (row['stock_quantity'] if row else 0)
+                raise InsufficientStockError({product_id: (quantity, available)})
+            self.db.after_commit(lambda: self.ledger.grant(product_id, units, used=need))
+        self._record_lease(product_id, units - need - taken)
+    
+    def _lease(self, product_id: int, units: int) -> bool:
+        return self.db.execute_query(self.LEASE_QUERY, (units, product_id, units)) == 1
+    
+    def _record_lease(self, product_id: int, delta: int):
+        """在当前事务中把本进程该商品的租约记录增减 delta 件（不存在时新建）"""
+        if not delta:
+            return
+        now = int(time.time())
+        if self.db.execute_query(self.LEASE_ROW_UPDATE, (delta, now, self.ledger.owner, product_id)):
+            return
+        if delta > 0:
+            self.db.execute_query(self.LEASE_ROW_INSERT, (self.ledger.owner, product_id, delta, now))
+        else:
+            logger.error(f"商品 {product_id} 的租约记录已被当作失联回收，租约中的 {-delta} 件可能重复计入库存")
+    
+    def release(self, items: List[Dict]) -> int:
+        """在当前事务中归还订单各行的库存（订单取消）"""
+        quantities = self.merge_quantities(items)
+        if not quantities:
+            return 0
+        query, params = self._adjust_query(quantities, decrement=False)
+        return self.db.execute_query(query, params, on_commit=lambda: self._invalidate(quantities))
+    
+    def return_leases(self, idle_only: bool = True) -> int:
+        """将闲置（或全部）租约归还数据库，返回归还件数；归还失败的件数留在账本中稍后重试
+
+        事务中不归还：归还应立即提交，不随调用方的事务回滚，留给事务外的下一次调用。
+        """
+        if self.ledger is None or self.db.in_transaction:
+            return 0
+        drained = self.ledger.drain_idle() if idle_only else self.ledger.drain_all()
+        if not drained:
+            return 0
+        try:
+            query, params = self._adjust_query(drained, decrement=False)
+            with self.db.transaction():
+                self.db.execute_query(query, params)
+                for product_id, units in drained.items():
+                    self._record_lease(product_id, -units)
+                self.db.execute_query(self.LEASE_PRUNE, (self.ledger.owner,))
+        except Error as e:
+            logger.error(f"归还库存租约失败: {e}")
+            for product_id, units in drained.items():
+                self.ledger.give_back(product_id, units)
+            return 0
+        return sum(drained.values())
+    
+    @staticmethod
+    def _stale_units(rows: List[Dict[str, Any]]) -> Dict[int, int]:
+        units = {}
+        for row in rows:
+            if row['units'] > 0:
+                units[row['product_id']] = units.get(row['product_id'], 0) + row['units']
+        return dict(sorted(units.items()))
+    
+    def reclaim_stale_leases(self) -> int:
+        """回收失联进程（超过 stale_after 秒未续期）的租约记录，件数加回商品库存，返回回收件数"""
+        if self.ledger is None:
+            return 0
+        params = (int(time.time() - self.ledger.stale_after), self.ledger.owner)
+        with self.db.transaction():
+            units = self._stale_units(self.db.fetch_all(self.STALE_LEASES_QUERY, params))
+            if units:
+                query, adjust_params = self._adjust_query(units, decrement=False)
+                self.db.execute_query(query, adjust_params, on_commit=lambda: self._invalidate(units))
+            self.db.execute_query(self.STALE_LEASES_DELETE, params)
+        if units:
+            logger.warning(f"回收失联进程的库存租约: {len(units)} 个商品, 共 {sum(units.values())} 件")
+        return sum(units.values())
+    
+    def reconcile_leases(self) -> int:
+        """启动时调用：确保 stock_leases 表存在并回收失联进程遗留的租约，返回回收件数"""
+        if self.ledger is None:
+            return 0
+        self.db.execute_query(self.LEASE_TABLE)
+        return self.reclaim_stale_leases()
+    
+    def sweep_leases(self) -> int:
+        """定期调用：续期本进程的租约记录、归还闲置租约、回收失联进程的租约；出错只记录日志，返回归还与回收的件数"""
+        if self.ledger is None:
+            return 0
+        try:
+            self.db.execute_query(self.LEASE_RENEW, (int(time.time()), self.ledger.owner))
+            return self.return_leases() + self.reclaim_stale_leases()
+        except Error as e:
+            logger.error(f"清扫库存租约失败: {e}")
+            return 0
 
 class ECommerceService:
     """综合电商服务类，提供完整的业务流程"""
     
-    def __init__(self, db_manager: DatabaseManager):
+    CANCELLED_STATUS = 'cancelled'
+    
+    def __init__(self, db_manager: DatabaseManager, cache: CacheBackend = None,
+                 category_tree: CategoryTreeIndex = None, search_index: ProductSearchIndex = None,
+                 stock_ledger: StockLedger = None, versions: VersionCounters = None):
         self.db = db_manager
-        self.user_service = UserService(db_manager)
-        self.category_service = CategoryService(db_manager)
-        self.product_service = ProductService(db_manager)
-        self.order_service = OrderService(db_manager)
-        self.order_item_service = OrderItemService(db_manager)
+        self.user_service = UserService(db_manager, cache, versions)
+        self.category_service = CategoryService(db_manager, cache, category_tree, versions)
+        self.product_service = ProductService(db_manager, cache, search_index, versions)
+        self.order_service = OrderService(db_manager, versions)
+        self.order_item_service = OrderItemService(db_manager, versions)
+        self.inventory_service = InventoryService(db_manager, cache, stock_ledger, versions)
     
     def place_order(self, user_id: int, items: List[Dict], shipping_address: str) -> int:
-        """下订单完整流程"""
+        """下订单完整流程：预留库存、创建订单与订单项在同一事务中"""
         try:
-            # 开始事务
-            self.db.connection.start_transaction()
-            
-            # 计算总金额
-            total_amount = sum(item['quantity'] * item['unit_price'] for item in items)
+            self.inventory_service.return_leases()
+            # 订单头与订单项在同一事务中，仅在最外层提交一次
+            with self.db.transaction():
+                # 计算总金额
+                total_amount = sum(item['quantity'] * item['unit_price'] for item in items)
+                
+                # 预留库存，不足时整单回滚
+                self.inventory_service.reserve(items)
+                
+                # 创建订单
+                order_id = self.order_service.create_order(user_id, total_amount, shipping_address)
+                
+                # 批量添加订单项
+                self.order_item_service.add_order_items(order_id, items, adjust_total=False)
             
-            # 创建订单
-            order_id = self.order_service.create_order(user_id, total_amount, shipping_address)
-            
-            # 添加订单项
-            for item in items:
-                self.order_item_service.add_order_item(
-                    order_id, item['product_id'], item['quantity'], item['unit_price']
-                )
-            
-            # 提交事务
-            self.db.connection.commit()
             logger.info(f"订单创建成功: 订单ID {order_id}, 总金额 {total_amount}")
             return order_id
             
         except Exception as e:
-            # 回滚事务
-            self.db.connection.rollback()
             logger.error(f"下单失败: {e}")
             raise
     
+    def update_order_status(self, order_id: int, new_status: str) -> int:
+        """更新订单状态；取消订单时在同一事务中释放其库存，撤销取消时重新预留"""
+        with self.db.transaction():
+            order = self.order_service.lock_order(order_id)
+            if order is None:
+                return 0
+            updated = self.order_service.update_order_status(order_id, new_status)
+            was_cancelled = order['status'] == self.CANCELLED_STATUS
+            if (new_status == self.CANCELLED_STATUS) != was_cancelled:
+                items = self.order_item_service.get_order_items(order_id)
+                if was_cancelled:
+                    self.inventory_service.reserve(items)
+                else:
+                    self.inventory_service.release(items)
+        return updated
+    
+    def get_products_in_category_tree(self, category_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                      cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取分类及其所有子分类下的商品"""
+        category_ids = self.category_service.get_descendant_ids(category_id)
+        return self.product_service.get_products_by_categories_page(category_ids, limit, cursor, row_format)
+    
     def get_user_order_history(self, user_id: int) -> List[Dict[str, Any]]:
         """获取用户的完整订单历史"""
         orders = self.order_service.get_orders_by_user(user_id)
         
+        # 一次 IN 查询取回全部订单项，避免每个订单一条查询
+        items_by_order = self.order_item_service.get_order_items_for_orders(
+            [order['order_id'] for order in orders]
+        )
         for order in orders:
-            order['items'] = self.order_item_service.get_order_items(order['order_id'])
+            order['items'] = items_by_order[order['order_id']]
         
         return orders
 
+# ============================================================================
+# 异步服务：SQL 与同步服务共用，直接返回数据库调用的方法在 AsyncDatabaseManager 下
+# 自然返回可等待对象；含分支或多步处理的方法在此改写为协程
+# ============================================================================
+
+class AsyncUserService(UserService):
+    def __init__(self, db_manager: AsyncDatabaseManager, cache: CacheBackend = None,
+                 versions: VersionCounters = None):
+        super().__init__(db_manager, cache, versions)
+
+    async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """根据ID获取用户（读穿透缓存，不含密码）"""
+        return await read_through_async(self.cache, f"user:{user_id}",
+                                        lambda: self._fetch_user_by_id(user_id))
+
+    async def get_users_by_ids(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取用户，返回 {用户ID: 用户}"""
+        return await read_through_many_async(self.cache, "user", user_ids,
+                                             lambda ids: self.db.fetch_keyed(self.USERS_BY_IDS_QUERY, 'user_id', ids))
+
+    async def update_user(self, user_id: int, **kwargs) -> int:
+        """更新用户信息"""
+        if not kwargs:
+            return 0
+        return await super().update_user(user_id, **kwargs)
+
+    async def get_users_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                             cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取用户，返回 (用户列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = await self.db.fetch_all(*self._users_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.USER_PAGE_KEYS)
+
+class AsyncCategoryService(CategoryService):
+    def __init__(self, db_manager: AsyncDatabaseManager, cache: CacheBackend = None,
+                 tree: CategoryTreeIndex = None, versions: VersionCounters = None):
+        super().__init__(db_manager, cache, tree, versions)
+
+    async def get_category_by_id(self, category_id: int) -> Optional[Dict[str, Any]]:
+        """根据ID获取分类（读穿透缓存）"""
+        return await read_through_async(self.cache, f"category:{category_id}",
+                                        lambda: self._fetch_category_by_id(category_id))
+
+    async def update_category(self, category_id: int, **kwargs) -> int:
+        """更新分类信息"""
+        if not kwargs:
+            return 0
+        if 'parent_id' in kwargs:
+            await self._ensure_tree()
+            self._check_parent(category_id, kwargs['parent_id'])
+        return await self._update_category(category_id, **kwargs)
+
+    async def _ensure_tree(self) -> CategoryTreeIndex:
+        """分类树索引未加载或已过期时整表重载，同 CategoryService._ensure_tree"""
+        if not self.tree.loaded:
+            async with self.tree.async_reload_lock:
+                if not self.tree.loaded:
+                    self.tree.load(await self.get_all_categories())
+        return self.tree
+
+    async def get_category_tree(self, root_id: int = None) -> List[Dict[str, Any]]:
+        """获取嵌套分类树（root_id 为空时为整棵树）"""
+        return (await self._ensure_tree()).tree(root_id)
+
+    async def get_category_breadcrumbs(self, category_id: int) -> List[Dict[str, Any]]:
+        """获取从一级分类到该分类的路径"""
+        return (await self._ensure_tree()).ancestors(category_id)
+
+    async def get_descendant_ids(self, category_id: int, include_self: bool = True) -> List[int]:
+        """获取分类子树内的所有分类ID"""
+        return (await self._ensure_tree()).descendant_ids(category_id, include_self)
+
+class AsyncProductService(ProductService):
+    def __init__(self, db_manager: AsyncDatabaseManager, cache: CacheBackend = None,
+                 search_index: ProductSearchIndex = None, versions: VersionCounters = None):
+        super().__init__(db_manager, cache, search_index, versions)
+
+    async def _ensure_search_index(self) -> ProductSearchIndex:
+        """倒排索引未加载或已过期时流式读取全部商品重建，同 ProductService._ensure_search_index"""
+        if not self.search_index.loaded:
+            async with self.search_index.async_reload_lock:
+                if not self.search_index.loaded:
+                    self.search_index.load([row async for row in self.db.fetch_iter(self.SEARCH_INDEX_QUERY)])
+        return self.search_index
+
+    async def search_products_ranked(self, keyword: str, limit: int = 20,
+                                     offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """按 BM25 相关度分页检索商品，返回 (商品列表, 命中总数)"""
+        limit = clamp_page_size(limit)
+        if self.search_index is None:
+            return await self.db.fetch_all(*self._like_search_page_query(keyword, limit, offset)), None
+        hits, total = (await self._ensure_search_index()).search(keyword, limit, offset)
+        rows_by_id = await self.db.fetch_keyed(self.PRODUCTS_BY_IDS_QUERY, 'product_id',
+                                               [product_id for product_id, _ in hits])
+        return self._ranked_rows(hits, rows_by_id), total
+
+    async def get_product_by_id(self, product_id: int) -> Optional[Dict[str, Any]]:
+        """根据ID获取商品（读穿透缓存）"""
+        return await read_through_async(self.cache, f"product:{product_id}",
+                                        lambda: self._fetch_product_by_id(product_id), self._cache_tags)
+
+    async def get_products_by_ids(self, product_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取商品，返回 {商品ID: 商品}"""
+        return await read_through_many_async(
+            self.cache, "product", product_ids,
+            lambda ids: self.db.fetch_keyed(self.PRODUCTS_BY_IDS_QUERY, 'product_id', ids), self._cache_tags)
+
+    async def update_product(self, product_id: int, **kwargs) -> int:
+        """更新商品信息"""
+        if not kwargs:
+            return 0
+        return await super().update_product(product_id, **kwargs)
+
+    async def get_products_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                                cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取商品，返回 (商品列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = await self.db.fetch_all(*self._products_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.PRODUCT_PAGE_KEYS)
+
+    async def get_products_by_category_page(self, category_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                            cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取分类下的商品，返回 (商品列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = await self.db.fetch_all(*self._products_by_category_page_query(category_id, limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.CATEGORY_PRODUCT_PAGE_KEYS)
+
+    async def get_products_by_categories_page(self, category_ids: List[int], limit: int = DEFAULT_PAGE_SIZE,
+                                              cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取多个分类下的商品（一条 IN 查询），返回 (商品列表, 下一页游标)"""
+        if not category_ids:
+            return [], None
+        limit = clamp_page_size(limit)
+        rows = await self.db.fetch_all(*self._products_by_categories_page_query(category_ids, limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.CATEGORY_PRODUCT_PAGE_KEYS)
+
+class AsyncOrderService(OrderService):
+    def __init__(self, db_manager: AsyncDatabaseManager, versions: VersionCounters = None):
+        super().__init__(db_manager, versions)
+
+    async def get_orders_page(self, limit: int = DEFAULT_PAGE_SIZE,
+                              cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取订单，返回 (订单列表, 下一页游标)"""
+        limit = clamp_page_size(limit)
+        rows = await self.db.fetch_all(*self._orders_page_query(limit, cursor), row_format=row_format)
+        return keyset_page(rows, limit, self.ORDER_PAGE_KEYS)
+
+class AsyncOrderItemService(OrderItemService):
+    def __init__(self, db_manager: AsyncDatabaseManager, versions: VersionCounters = None):
+        super().__init__(db_manager, versions)
+
+    async def add_order_item(self, order_id: int, product_id: int,
+                             quantity: int, unit_price: float) -> int:
+        """添加订单项，同一事务中累加订单总金额"""
+        query = """
+        INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+        VALUES (%s, %s, %s, %s)
+        """
+        async with self.db.transaction():
+            order_item_id = await self.db.execute_insert(query, (order_id, product_id, quantity, unit_price))
+            await self._adjust_total(order_id, quantity * unit_price)
+        return order_item_id
+
+    async def add_order_items(self, order_id: int, items: List[Dict], adjust_total: bool = True) -> List[int]:
+        """批量添加订单项，语义同 OrderItemService.add_order_items"""
+        rows = [
+            (order_id, item['product_id'], item['quantity'], item['unit_price'])
+            for item in items
+        ]
+        if not adjust_total:
+            return await self.db.insert_many(self.ORDER_ITEM_BULK_INSERT, rows)
+        async with self.db.transaction():
+            order_item_ids = await self.db.insert_many(self.ORDER_ITEM_BULK_INSERT, rows)
+            await self._adjust_total(order_id, sum(item['quantity'] * item['unit_price'] for item in items))
+        return order_item_ids
+
+    async def update_order_item_quantity(self, order_item_id: int, new_quantity: int) -> int:
+        """更新订单项数量，同一事务中按数量差额调整订单总金额"""
+        query = "UPDATE order_items SET quantity = %s WHERE order_item_id = %s"
+        async with self.db.transaction():
+            item = await self.db.fetch_one(self.LOCK_ITEM_QUERY, (order_item_id,))
+            if item is None:
+                return 0
+            updated = await self.db.execute_query(query, (new_quantity, order_item_id))
+            await self._adjust_total(item['order_id'], (new_quantity - item['quantity']) * item['unit_price'])
+        return updated
+
+    async def delete_order_item(self, order_item_id: int) -> int:
+        """删除订单项，同一事务中从订单总金额扣除其小计"""
+        query = "DELETE FROM order_items WHERE order_item_id = %s"
+        async with self.db.transaction():
+            item = await self.db.fetch_one(self.LOCK_ITEM_QUERY, (order_item_id,))
+            if item is None:
+                return 0
+            deleted = await self.db.execute_query(query, (order_item_id,))
+            await self._adjust_total(item['order_id'], -item['subtotal'])
+        return deleted
+
+    async def get_order_total_amount(self, order_id: int) -> float:
+        """获取订单总金额（订单头上增量维护的列）"""
+        query = "SELECT total_amount FROM orders WHERE order_id = %s"
+        result = await self.db.fetch_one(query, (order_id,))
+        return result['total_amount'] if result and result['total_amount'] else 0.0
+
+    async def get_order_totals(self, order_ids: List[int]) -> Dict[int, Any]:
+        """批量获取订单总金额，返回 {订单ID: 总金额}"""
+        rows = await self.db.fetch_in(self.ORDER_TOTALS_QUERY, order_ids)
+        return {row['order_id']: row['total_amount'] for row in rows}
+
+    async def recompute_order_totals(self, order_ids: List[int]) -> int:
+        """按订单项重新汇总订单总金额，返回更新的订单数"""
+        updated = 0
+        async with self.db.transaction():
+            for sql, params in _in_batches(self.RECOMPUTE_TOTALS_QUERY, order_ids, self.db.bulk_chunk_rows):
+                updated += await self.db.execute_query(
+                    sql, params, on_commit=lambda chunk=params: self.versions.bump(*[f"order:{i}" for i in chunk]))
+        return updated
+
+class AsyncInventoryService(InventoryService):
+    async def reserve(self, items: List[Dict]):
+        """在当前事务中预留订单各行的库存，不足时抛出 InsufficientStockError"""
+        hot, cold = self._split(self.merge_quantities(items))
+        if cold:
+            query, params = self._adjust_query(cold, decrement=True)
+            updated = await self.db.execute_query(query, params, on_commit=lambda: self._invalidate(cold))
+            if updated != len(cold):
+                rows = await self.db.fetch_in(self.STOCK_QUERY, list(cold))
+                raise InsufficientStockError(self._shortages(cold, rows))
+        for product_id, quantity in hot.items():
+            await self._reserve_leased(product_id, quantity)
+
+    async def _reserve_leased(self, product_id: int, quantity: int):
+        taken = self.ledger.take(product_id, quantity)
+        if taken:
+            self.db.after_rollback(lambda: self.ledger.give_back(product_id, taken))
+        need = quantity - taken
+        units = 0
+        if need:
+            for units in dict.fromkeys((max(self.ledger.lease_size, need), need)):
+                if await self._lease(product_id, units):
+                    break
+            else:
+                row = await self.db.fetch_one(self.STOCK_QUERY.format(keys="%s"), (product_id,))
+                available = taken + self.ledger.available(product_id) + (row['stock_quantity'] if row else 0)
+                raise InsufficientStockError({product_id: (quantity, available)})
+            self.db.after_commit(lambda: self.ledger.grant(product_id, units, used=need))
+        await self._record_lease(product_id, units - need - taken)
+
+    async def _lease(self, product_id: int, units: int) -> bool:
+        return await self.db.execute_query(self.LEASE_QUERY, (units, product_id, units)) == 1
+
+    async def _record_lease(self, product_id: int, delta: int):
+        if not delta:
+            return
+        now = int(time.time())
+        if await self.db.execute_query(self.LEASE_ROW_UPDATE, (delta, now, self.ledger.owner, product_id)):
+            return
+        if delta > 0:
+            await self.db.execute_query(self.LEASE_ROW_INSERT, (self.ledger.owner, product_id, delta, now))
+        else:
+            logger.error(f"商品 {product_id} 的租约记录已被当作失联回收，租约中的 {-delta} 件可能重复计入库存")
+
+    async def release(self, items: List[Dict]) -> int:
+        """在当前事务中归还订单各行的库存（订单取消）"""
+        quantities = self.merge_quantities(items)
+        if not quantities:
+            return 0
+        query, params = self._adjust_query(quantities, decrement=False)
+        return await self.db.execute_query(query, params, on_commit=lambda: self._invalidate(quantities))
+
+    async def return_leases(self, idle_only: bool = True) -> int:
+        """将闲置（或全部）租约归还数据库，返回归还件数；事务中不归还，同 InventoryService.return_leases"""
+        if self.ledger is None or self.db.in_transaction:
+            return 0
+        drained = self.ledger.drain_idle() if idle_only else self.ledger.drain_all()
+        if not drained:
+            return 0
+        try:
+            query, params = self._adjust_query(drained, decrement=False)
+            async with self.db.transaction():
+                await self.db.execute_query(query, params)
+                for product_id, units in drained.items():
+                    await self._record_lease(product_id, -units)
+                await self.db.execute_query(self.LEASE_PRUNE, (self.ledger.owner,))
+        except aiomysql.Error as e:
+            logger.error(f"归还库存租约失败: {e}")
+            for product_id, units in drained.items():
+                self.ledger.give_back(product_id, units)
+            return 0
+        return sum(drained.values())
+
+    async def reclaim_stale_leases(self) -> int:
+        """回收失联进程的租约记录，同 InventoryService.reclaim_stale_leases"""
+        if self.ledger is None:
+            return 0
+        params = (int(time.time() - self.ledger.stale_after), self.ledger.owner)
+        async with self.db.transaction():
+            units = self._stale_units(await self.db.fetch_all(self.STALE_LEASES_QUERY, params))
+            if units:
+                query, adjust_params = self._adjust_query(units, decrement=False)
+                await self.db.execute_query(query, adjust_params, on_commit=lambda: self._invalidate(units))
+            await self.db.execute_query(self.STALE_LEASES_DELETE, params)
+        if units:
+            logger.warning(f"回收失联进程的库存租约: {len(units)} 个商品, 共 {sum(units.values())} 件")
+        return sum(units.values())
+
+    async def reconcile_leases(self) -> int:
+        """启动时调用，同 InventoryService.reconcile_leases"""
+        if self.ledger is None:
+            return 0
+        await self.db.execute_query(self.LEASE_TABLE)
+        return await self.reclaim_stale_leases()
+
+    async def sweep_leases(self) -> int:
+        """定期调用，同 InventoryService.sweep_leases"""
+        if self.ledger is None:
+            return 0
+        try:
+            await self.db.execute_query(self.LEASE_RENEW, (int(time.time()), self.ledger.owner))
+            return await self.return_leases() + await self.reclaim_stale_leases()
+        except aiomysql.Error as e:
+            logger.error(f"清扫库存租约失败: {e}")
+            return 0
+
+class AsyncECommerceService(ECommerceService):
+    """异步综合电商服务类"""
+
+    def __init__(self, db_manager: AsyncDatabaseManager, cache: CacheBackend = None,
+                 category_tree: CategoryTreeIndex = None, search_index: ProductSearchIndex = None,
+                 stock_ledger: StockLedger = None, versions: VersionCounters = None):
+        self.db = db_manager
+        self.user_service = AsyncUserService(db_manager, cache, versions)
+        self.category_service = AsyncCategoryService(db_manager, cache, category_tree, versions)
+        self.product_service = AsyncProductService(db_manager, cache, search_index, versions)
+        self.order_service = AsyncOrderService(db_manager, versions)
+        self.order_item_service = AsyncOrderItemService(db_manager, versions)
+        self.inventory_service = AsyncInventoryService(db_manager, cache, stock_ledger, versions)
+
+    async def place_order(self, user_id: int, items: List[Dict], shipping_address: str) -> int:
+        """下订单完整流程：预留库存、创建订单与订单项在同一事务中"""
+        try:
+            await self.inventory_service.return_leases()
+            # 订单头与订单项在同一事务中，仅在最外层提交一次
+            async with self.db.transaction():
+                # 计算总金额
+                total_amount = sum(item['quantity'] * item['unit_price'] for item in items)
+
+                # 预留库存，不足时整单回滚
+                await self.inventory_service.reserve(items)
+
+                # 创建订单
+                order_id = await self.order_service.create_order(user_id, total_amount, shipping_address)
+
+                # 批量添加订单项
+                await self.order_item_service.add_order_items(order_id, items, adjust_total=False)
+
+            logger.info(f"订单创建成功: 订单ID {order_id}, 总金额 {total_amount}")
+            return order_id
+
+        except Exception as e:
+            logger.error(f"下单失败: {e}")
+            raise
+
+    async def update_order_status(self, order_id: int, new_status: str) -> int:
+        """更新订单状态；取消订单时在同一事务中释放其库存，撤销取消时重新预留"""
+        async with self.db.transaction():
+            order = await self.order_service.lock_order(order_id)
+            if order is None:
+                return 0
+            updated = await self.order_service.update_order_status(order_id, new_status)
+            was_cancelled = order['status'] == self.CANCELLED_STATUS
+            if (new_status == self.CANCELLED_STATUS) != was_cancelled:
+                items = await self.order_item_service.get_order_items(order_id)
+                if was_cancelled:
+                    await self.inventory_service.reserve(items)
+                else:
+                    await self.inventory_service.release(items)
+        return updated
+
+    async def get_products_in_category_tree(self, category_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                            cursor: str = None, row_format: str = "dict") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """分页获取分类及其所有子分类下的商品"""
+        category_ids = await self.category_service.get_descendant_ids(category_id)
+        return await self.product_service.get_products_by_categories_page(category_ids, limit, cursor, row_format)
+
+    async def get_user_order_history(self, user_id: int) -> List[Dict[str, Any]]:
+        """获取用户的完整订单历史"""
+        orders = await self.order_service.get_orders_by_user(user_id)
+
+        items_by_order = await self.order_item_service.get_order_items_for_orders(
+            [order['order_id'] for order in orders]
+        )
+        for order in orders:
+            order['items'] = items_by_order[order['order_id']]
+
+        return orders
+
 # 使用示例
 def main():
     # 初始化数据库管理器
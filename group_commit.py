@@ -0,0 +1,265 @@
+"""
+订单组提交
+有界队列位于 ECommerceService.place_order 之前：工作者最多等待 max_wait_ms 毫秒或攒满 max_batch 单，
+在一个事务中依次下单（每单一个保存点）并统一提交，摊薄逐单提交的延迟
+"""
+
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from code import TransactionAbortedError, aborts_transaction
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """组提交队列已满，调用方应稍后重试"""
+
+
+class CommitUnknownError(Exception):
+    """批事务的 COMMIT 本身失败（如提交时连接断开），服务端可能已经提交；
+    批内订单不再重试以免重复下单与重复扣减库存，__cause__ 为原来的异常"""
+
+
+class _GroupCommitStats:
+    def __init__(self, max_batch: int, max_wait_ms: float, max_queue: int):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.batches = 0
+        self.orders = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    def _record(self, size: int):
+        self.batches += 1
+        self.orders += size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "orders": self.orders,
+            "avg_batch_size": self.orders / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+        }
+
+
+class GroupCommitQueue(_GroupCommitStats):
+    """同步组提交队列：后台线程批量写入，submit() 返回 concurrent.futures.Future
+
+    service 为绑定未借出连接的 DatabaseManager 的 ECommerceService，事务连接由工作线程自行借出。
+    place_order 自身的事务作用域嵌套在批事务中即成为保存点，单个订单失败只回滚该订单。
+    发出 COMMIT 之前批事务整体失败（死锁、连接断开）时逐单重试，各自独立提交；
+    COMMIT 本身失败时结果未知，批内订单均以 CommitUnknownError 失败。
+    """
+
+    def __init__(self, service, max_batch: int = 50, max_wait_ms: float = 5.0, max_queue: int = 1000):
+        super().__init__(max_batch, max_wait_ms, max_queue)
+        self.service = service
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="order-group-commit", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """处理完已入队的订单后停止工作线程"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, **order) -> Future:
+        """提交一单（place_order 的关键字参数），队列已满时抛出 QueueFullError"""
+        future = Future()
+        try:
+            self._queue.put_nowait((order, future))
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFullError("订单队列已满，请稍后重试")
+        return future
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stopping = [first], False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stopping:
+                return
+
+    def _process(self, batch: List[Tuple[dict, Future]]):
+        batch = [(order, future) for order, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self._record(len(batch))
+        try:
+            outcomes = self._commit_batch([order for order, _ in batch])
+        except CommitUnknownError as e:
+            logger.error(f"订单组提交的 COMMIT 失败，结果未知，不重试: {e.__cause__}")
+            outcomes = [(None, e)] * len(batch)
+        except Exception as e:
+            logger.warning(f"订单组提交失败，逐单重试: {e}")
+            self.fallbacks += 1
+            outcomes = [self._place_one(order) for order, _ in batch]
+        for (_, future), (order_id, error) in zip(batch, outcomes):
+            if error is None:
+                future.set_result(order_id)
+            else:
+                future.set_exception(error)
+
+    def _commit_batch(self, orders: List[dict]) -> List[Tuple[Any, Exception]]:
+        outcomes = []
+        # 批事务内的 place_order 不归还租约（归还应立即提交，不随批事务回滚），在批事务开始前归还
+        self.service.inventory_service.return_leases()
+        committing = False
+        try:
+            with self.service.db.transaction():
+                for order in orders:
+                    try:
+                        outcomes.append((self.service.place_order(**order), None))
+                    except Exception as e:
+                        if aborts_transaction(e):
+                            raise
+                        outcomes.append((None, e))
+                # 此后的异常来自 COMMIT（事务已失效而拒绝提交的除外）
+                committing = True
+        except Exception as e:
+            if committing and not isinstance(e, TransactionAbortedError):
+                raise CommitUnknownError(f"订单组提交结果未知: {e}") from e
+            raise
+        return outcomes
+
+    def _place_one(self, order: dict) -> Tuple[Any, Exception]:
+        try:
+            return self.service.place_order(**order), None
+        except Exception as e:
+            return None, e
+
+
+class AsyncGroupCommitQueue(_GroupCommitStats):
+    """异步组提交队列：事件循环中的后台任务批量写入，submit() 返回 asyncio.Future，语义同 GroupCommitQueue"""
+
+    def __init__(self, service, max_batch: int = 50, max_wait_ms: float = 5.0, max_queue: int = 1000):
+        super().__init__(max_batch, max_wait_ms, max_queue)
+        self.service = service
+        self._queue = asyncio.Queue(max_queue)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            await self._queue.put(_STOP)
+            await self._task
+            self._task = None
+
+    def submit(self, **order) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((order, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError("订单队列已满，请稍后重试")
+        return future
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch, stopping = [first], False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._process(batch)
+            if stopping:
+                return
+
+    async def _process(self, batch: List[Tuple[dict, asyncio.Future]]):
+        batch = [(order, future) for order, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        self._record(len(batch))
+        try:
+            outcomes = await self._commit_batch([order for order, _ in batch])
+        except CommitUnknownError as e:
+            logger.error(f"订单组提交的 COMMIT 失败，结果未知，不重试: {e.__cause__}")
+            outcomes = [(None, e)] * len(batch)
+        except Exception as e:
+            logger.warning(f"订单组提交失败，逐单重试: {e}")
+            self.fallbacks += 1
+            outcomes = [await self._place_one(order) for order, _ in batch]
+        for (_, future), (order_id, error) in zip(batch, outcomes):
+            if future.cancelled():
+                continue
+            if error is None:
+                future.set_result(order_id)
+            else:
+                future.set_exception(error)
+
+    async def _commit_batch(self, orders: List[dict]) -> List[Tuple[Any, Exception]]:
+        outcomes = []
+        await self.service.inventory_service.return_leases()
+        committing = False
+        try:
+            async with self.service.db.transaction():
+                for order in orders:
+                    try:
+                        outcomes.append((await self.service.place_order(**order), None))
+                    except Exception as e:
+                        if aborts_transaction(e):
+                            raise
+                        outcomes.append((None, e))
+                committing = True
+        except Exception as e:
+            if committing and not isinstance(e, TransactionAbortedError):
+                raise CommitUnknownError(f"订单组提交结果未知: {e}") from e
+            raise
+        return outcomes
+
+    async def _place_one(self, order: dict) -> Tuple[Any, Exception]:
+        try:
+            return await self.service.place_order(**order), None
+        except Exception as e:
+            return None, e
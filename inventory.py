@@ -0,0 +1,134 @@
+"""
+库存预留
+热点商品的进程内库存租约账本，以及库存不足异常。冷门商品的扣减与租约的数据库读写在 code.py 的 InventoryService 中
+"""
+
+from typing import Any, Dict, Iterable
+import os
+import socket
+import threading
+import time
+
+
+class InsufficientStockError(Exception):
+    """库存不足；shortages 为 {商品ID: (需要数量, 可用数量)}"""
+
+    def __init__(self, shortages: Dict[int, tuple]):
+        self.shortages = shortages
+        detail = ", ".join(f"商品 {pid} 需要 {need} 可用 {available}"
+                           for pid, (need, available) in sorted(shortages.items()))
+        super().__init__(f"库存不足: {detail}")
+
+
+class StockLedger:
+    """热点商品库存租约账本
+
+    热点商品的下单不再逐单更新同一行：先以一条条件 UPDATE 从 products.stock_quantity 中整块
+    租出 lease_size 件，之后的预留在内存中从租约扣减，租约用尽再续租。续租在用尽租约的那一单的事务中
+    执行，随该单提交或回滚，该单用剩的件数在提交后才记入账本。数据库中的库存始终不含
+    已租出的件数，因此多进程各自持有租约也不会超卖。租约闲置 idle_release 秒后归还数据库。
+
+    各进程以 owner 为标识在 stock_leases 表中记录未用完的件数（与续租、扣减、归还在同一事务中增减），
+    并定期续期；进程异常退出后，超过 stale_after 秒未续期的记录由其他进程或重启后的进程回收，件数加回库存。
+    stale_after 应远大于清扫间隔，各主机的时钟偏差也应远小于它。
+
+    热点判定：hot_products 中配置的商品，或最近一秒内预留次数达到 hot_threshold 的商品（0 表示不自动判定）。
+    账本只维护内存状态，数据库读写由调用方完成。
+    """
+
+    def __init__(self, lease_size: int = 50, hot_threshold: int = 20, idle_release: float = 5.0,
+                 hot_products: Iterable[int] = (), stale_after: float = 300.0, owner: str = None):
+        self.lease_size = lease_size
+        self.hot_threshold = hot_threshold
+        self.idle_release = idle_release
+        self.hot_products = set(hot_products)
+        self.stale_after = stale_after
+        # 每次启动使用新的标识，重启前的进程遗留的记录按失联回收
+        self.owner = owner or f"{socket.gethostname()[:40]}:{os.getpid()}:{os.urandom(4).hex()}"
+        self._lock = threading.Lock()
+        self._leased = {}       # 商品ID -> 租约中剩余件数
+        self._last_used = {}    # 商品ID -> 最近一次预留时间
+        self._window = {}       # 商品ID -> (窗口起始秒, 窗口内预留次数)
+
+        self.reservations = 0
+        self.leases = 0
+        self.units_leased = 0
+        self.units_returned = 0
+
+    def is_hot(self, product_id: int) -> bool:
+        """记录一次预留请求并判断该商品是否走租约"""
+        with self._lock:
+            if product_id in self.hot_products or product_id in self._leased:
+                return True
+            if not self.hot_threshold:
+                return False
+            second = int(time.monotonic())
+            start, count = self._window.get(product_id, (second, 0))
+            count = count + 1 if start == second else 1
+            self._window[product_id] = (second, count)
+            if len(self._window) > 10000:
+                self._window = {pid: w for pid, w in self._window.items() if w[0] == second}
+            return count >= self.hot_threshold
+
+    def take(self, product_id: int, quantity: int) -> int:
+        """从租约中扣减至多 quantity 件，返回实际扣减的件数（租约不足时为租约中的全部剩余）"""
+        with self._lock:
+            taken = min(self._leased.get(product_id, 0), quantity)
+            if taken:
+                self._leased[product_id] -= taken
+                self._last_used[product_id] = time.monotonic()
+            self.reservations += 1
+            return taken
+
+    def available(self, product_id: int) -> int:
+        with self._lock:
+            return self._leased.get(product_id, 0)
+
+    def grant(self, product_id: int, units: int, used: int = 0):
+        """数据库租出 units 件（其中 used 件已由续租的那一单用掉）后，把余下的件数记入租约"""
+        with self._lock:
+            self._leased[product_id] = self._leased.get(product_id, 0) + units - used
+            self._last_used[product_id] = time.monotonic()
+            self.leases += 1
+            self.units_leased += units
+
+    def give_back(self, product_id: int, quantity: int):
+        """预留作废（如下单事务回滚），件数回到租约"""
+        with self._lock:
+            self._leased[product_id] = self._leased.get(product_id, 0) + quantity
+            self._last_used[product_id] = time.monotonic()
+
+    def drain_idle(self) -> Dict[int, int]:
+        """取出闲置超过 idle_release 秒的租约，返回 {商品ID: 应归还数据库的件数}"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [pid for pid, used in self._last_used.items() if now - used >= self.idle_release]
+            return self._drain(idle)
+
+    def drain_all(self) -> Dict[int, int]:
+        """取出全部租约（停机时归还数据库）"""
+        with self._lock:
+            return self._drain(list(self._leased))
+
+    def _drain(self, product_ids) -> Dict[int, int]:
+        drained = {}
+        for pid in product_ids:
+            units = self._leased.pop(pid, 0)
+            self._last_used.pop(pid, None)
+            if units:
+                drained[pid] = units
+        self.units_returned += sum(drained.values())
+        return drained
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "owner": self.owner,
+                "hot_products": sorted(self.hot_products | set(self._leased)),
+                "leased_units": sum(self._leased.values()),
+                "lease_size": self.lease_size,
+                "reservations": self.reservations,
+                "leases": self.leases,
+                "units_leased": self.units_leased,
+                "units_returned": self.units_returned,
+            }
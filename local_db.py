@@ -0,0 +1,316 @@
+"""
+本地数据库替身
+以 SQLite 文件模拟 MySQL，提供服务层用到的 mysql.connector 连接与游标接口子集，
+在没有 MySQL 的环境中运行完整的服务层（基准测试 bench.py、本地开发）。
+
+语句执行前做最小改写：%s 占位符改为 ?，去掉 FOR UPDATE 与 UPDATE ... ORDER BY，EXPLAIN 改为 EXPLAIN QUERY PLAN；
+SQLite 的错误转换为 mysql.connector 的异常类型，服务层的错误处理不变。
+显式事务以 BEGIN IMMEDIATE 开始，写事务整体串行（MySQL 为行锁），只支持同步数据通路（DB_MODE=sync）。
+性能特征与 MySQL 不同，适合比较同一环境下两次运行的相对差异，而非估算线上容量。
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+import random
+import re
+import sqlite3
+import threading
+import zlib
+
+from mysql.connector import errors
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) NOT NULL UNIQUE,
+    email VARCHAR(100) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL,
+    full_name VARCHAR(100),
+    phone VARCHAR(20),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, user_id);
+
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_name VARCHAR(100) NOT NULL,
+    parent_id INTEGER,
+    description TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_categories_parent ON categories (parent_id);
+
+CREATE TABLE IF NOT EXISTS products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_name VARCHAR(200) NOT NULL,
+    description TEXT,
+    price DECIMAL(10, 2) NOT NULL,
+    stock_quantity INTEGER NOT NULL DEFAULT 0,
+    category_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_products_created ON products (created_at, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id, product_name, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_name ON products (product_name, product_id);
+
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    total_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    shipping_address TEXT,
+    order_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (order_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, order_date);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price DECIMAL(10, 2) NOT NULL,
+    subtotal DECIMAL(12, 2) GENERATED ALWAYS AS (quantity * unit_price) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);
+
+CREATE TABLE IF NOT EXISTS stock_leases (
+    owner VARCHAR(64) NOT NULL,
+    product_id INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    renewed_at BIGINT NOT NULL,
+    PRIMARY KEY (owner, product_id)
+);
+"""
+
+_PLACEHOLDER = re.compile(r"%s")
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\s*$", re.IGNORECASE)
+_UPDATE_ORDER_BY = re.compile(r"^(\s*(?:UPDATE|DELETE)\b.*?)\s+ORDER\s+BY\s+[\w.]+(?:\s*,\s*[\w.]+)*\s*$",
+                              re.IGNORECASE | re.DOTALL)
+_EXPLAIN = re.compile(r"^\s*EXPLAIN\s+", re.IGNORECASE)
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DECIMAL", lambda raw: Decimal(raw.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode()))
+
+
+@lru_cache(maxsize=1024)
+def translate(query: str) -> str:
+    """把服务层的 MySQL 语句改写为 SQLite 可执行的形式"""
+    text = _FOR_UPDATE.sub("", query.rstrip().rstrip(";"))
+    text = _UPDATE_ORDER_BY.sub(r"\1", text)
+    text = _EXPLAIN.sub("EXPLAIN QUERY PLAN ", text)
+    return _PLACEHOLDER.sub("?", text)
+
+
+def _concat_ws(separator, *values):
+    if separator is None:
+        return None
+    return separator.join(str(v) for v in values if v is not None)
+
+
+def _crc32(value):
+    return None if value is None else zlib.crc32(str(value).encode())
+
+
+class _BitXor:
+    """MySQL BIT_XOR 聚合（空集合为 0）"""
+
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= int(value)
+
+    def finalize(self):
+        return self.value
+
+
+def _mysql_error(e: sqlite3.Error) -> errors.Error:
+    if isinstance(e, sqlite3.IntegrityError):
+        return errors.IntegrityError(msg=str(e))
+    if isinstance(e, sqlite3.OperationalError):
+        return errors.OperationalError(msg=str(e))
+    if isinstance(e, sqlite3.ProgrammingError):
+        return errors.ProgrammingError(msg=str(e))
+    return errors.DatabaseError(msg=str(e))
+
+
+class LocalCursor:
+    """mysql.connector 游标的子集：dictionary 行、column_names、rowcount 与 lastrowid"""
+
+    def __init__(self, connection: "LocalConnection", dictionary: bool = False):
+        self._connection = connection
+        self._cursor = connection._conn.cursor()
+        self._dictionary = dictionary
+        self.column_names = ()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, query: str, params=()):
+        try:
+            self._cursor.execute(translate(query), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise _mysql_error(e) from e
+        description = self._cursor.description
+        self.column_names = tuple(column[0] for column in description) if description else ()
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        if self.rowcount > 1 and query.lstrip()[:6].upper() == "INSERT":
+            # MySQL 的 LAST_INSERT_ID() 是多行 INSERT 的第一行，SQLite 返回最后一行
+            self.lastrowid -= self.rowcount - 1
+
+    def _row(self, row):
+        return dict(zip(self.column_names, row)) if self._dictionary and row is not None else row
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = 1) -> List[Any]:
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self) -> List[Any]:
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class LocalConnection:
+    """mysql.connector 连接的子集，连接可跨线程移交（同一时刻只由一个线程使用，与连接池约定一致）"""
+
+    unread_result = False
+
+    def __init__(self, path: str, busy_timeout: float):
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        # 服务层用到的 MySQL 函数
+        self._conn.create_function("CONCAT_WS", -1, _concat_ws, deterministic=True)
+        self._conn.create_function("CRC32", 1, _crc32, deterministic=True)
+        self._conn.create_aggregate("BIT_XOR", 1, _BitXor)
+        self._closed = False
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._conn.in_transaction
+
+    def cursor(self, dictionary: bool = False, prepared: bool = False, buffered: Optional[bool] = None) -> LocalCursor:
+        # SQLite 模块自带语句缓存，prepared/buffered 不需要区别处理
+        return LocalCursor(self, dictionary)
+
+    def start_transaction(self):
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            raise _mysql_error(e) from e
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+    def ping(self, reconnect: bool = False):
+        if self._closed:
+            raise errors.InterfaceError(msg="连接已关闭")
+
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        self._closed = True
+        self._conn.close()
+
+
+class LocalDatabase:
+    """本地数据库替身：一个 SQLite 文件（WAL 模式），connect 可直接作为 DatabaseManager 的 connector"""
+
+    def __init__(self, path: str = "local_db.sqlite3", busy_timeout: float = 30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def connect(self, **connect_args) -> LocalConnection:
+        """忽略 host/user/password 等 MySQL 连接参数"""
+        conn = LocalConnection(self.path, self.busy_timeout)
+        conn._conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def counts(self) -> Dict[str, int]:
+        conn = sqlite3.connect(self.path)
+        try:
+            return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("users", "categories", "products", "orders", "order_items")}
+        finally:
+            conn.close()
+
+    def seed(self, users: int = 1000, categories: int = 50, products: int = 5000, orders: int = 5000,
+             seed: int = 42) -> Dict[str, int]:
+        """写入确定性的合成数据（表已有数据时跳过），返回各表行数
+
+        user_id/category_id/product_id/order_id 从 1 连续编号，基准测试据此生成路径参数。
+        """
+        with self._lock:
+            if self.counts()["users"]:
+                return self.counts()
+            rng = random.Random(seed)
+            start = datetime(2024, 1, 1)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO users (username, email, password, full_name, phone, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(f"user{i}", f"user{i}@example.com", "x" * 60, f"用户 {i}", f"138{i:08d}",
+                          (start + timedelta(minutes=i)).isoformat(" ")) for i in range(1, users + 1)],
+                    )
+                    conn.executemany(
+                        "INSERT INTO categories (category_name, parent_id, description) VALUES (?, ?, ?)",
+                        [(f"分类 {i}", None if i <= 10 else rng.randint(1, i - 1), None)
+                         for i in range(1, categories + 1)],
+                    )
+                    prices = [Decimal(rng.randint(100, 99900)) / 100 for _ in range(products)]
+                    conn.executemany(
+                        "INSERT INTO products (product_name, description, price, stock_quantity, category_id, "
+                        "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(f"商品 {i}", f"商品 {i} 的描述，正品保障", str(prices[i - 1]), rng.randint(0, 500),
+                          rng.randint(1, categories), (start + timedelta(minutes=i)).isoformat(" "))
+                         for i in range(1, products + 1)],
+                    )
+                    order_rows, item_rows = [], []
+                    for order_id in range(1, orders + 1):
+                        items = [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 3))]
+                        total = sum(prices[product_id - 1] * quantity for product_id, quantity in items)
+                        order_rows.append((rng.randint(1, users), str(total), "pending", "北京市朝阳区建国路 88 号",
+                                           (start + timedelta(minutes=order_id)).isoformat(" ")))
+                        item_rows.extend((order_id, product_id, quantity, str(prices[product_id - 1]))
+                                         for product_id, quantity in items)
+                    conn.executemany(
+                        "INSERT INTO orders (user_id, total_amount, status, shipping_address, order_date) "
+                        "VALUES (?, ?, ?, ?, ?)", order_rows,
+                    )
+                    conn.executemany(
+                        "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)",
+                        item_rows,
+                    )
+            finally:
+                conn.close()
+            return self.counts()
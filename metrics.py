@@ -0,0 +1,222 @@
+"""
+运行指标
+按语句指纹统计的数据库耗时直方图、行数与错误数，按路由统计的请求耗时直方图，
+以及连接池、缓存等状态的 Prometheus 文本格式输出（server.py 的 /metrics 端点）
+"""
+
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+import re
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 直方图桶上界（秒）
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 超出序列数上限的标签值统一记为 other，防止指标基数失控
+OVERFLOW_LABEL = "other"
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_WHEN_THEN = re.compile(r"(?:WHEN \? THEN \? ?)+", re.IGNORECASE)
+
+# 长语句（长 IN 列表、多行 INSERT、多分支 CASE）先折叠连续的占位符再查缓存，
+# 否则每种列表长度各占一个缓存项，单项可达数十 KB；折叠后仍很长的语句不缓存
+_PLACEHOLDER_RUN = re.compile(r"%s(?:\s*,\s*%s)+")
+_ROW_RUN = re.compile(r"\(%s\)(?:\s*,\s*\(%s\))+")
+_WHEN_THEN_RUN = re.compile(r"(?:WHEN\s+%s\s+THEN\s+%s\s*){2,}", re.IGNORECASE)
+_COLLAPSE_MIN_LENGTH = 512
+_CACHE_MAX_LENGTH = 2048
+
+
+def fingerprint(query: str) -> str:
+    """语句指纹：字面量与占位符替换为 ?，IN 列表、多行 VALUES、CASE 分支折叠，同一模板的语句指纹相同"""
+    if len(query) > _COLLAPSE_MIN_LENGTH:
+        query = _PLACEHOLDER_RUN.sub("%s", query)
+        query = _ROW_RUN.sub("(%s)", query)
+        query = _WHEN_THEN_RUN.sub("WHEN %s THEN %s ", query)
+        if len(query) > _CACHE_MAX_LENGTH:
+            return _fingerprint(query)
+    return _cached_fingerprint(query)
+
+
+def _fingerprint(query: str) -> str:
+    text = _WHITESPACE.sub(" ", query).strip()
+    text = _STRING.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(...)", text)
+    text = _VALUES_ROWS.sub("(...)", text)
+    return _WHEN_THEN.sub("WHEN ? THEN ? ", text)
+
+
+_cached_fingerprint = lru_cache(maxsize=4096)(_fingerprint)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Family:
+    """同名指标的一组序列，按标签值元组区分"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), max_series: int = 1000):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, values: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        if values in self._series or len(self._series) < self.max_series:
+            return values
+        return (OVERFLOW_LABEL,) * len(self.labels)
+
+
+class Counter(_Family):
+    """单调递增计数"""
+
+    def inc(self, values: Tuple[Any, ...] = (), amount: float = 1):
+        with self._lock:
+            key = self._key(values)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in series)
+        return lines
+
+
+class Histogram(_Family):
+    """直方图：每个序列保存各桶计数（非累计）、总和与次数，输出时再累加"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DB_BUCKETS, max_series: int = 1000):
+        super().__init__(name, help, labels, max_series)
+        self.buckets = tuple(buckets)
+
+    def observe(self, values: Tuple[Any, ...], seconds: float):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            key = self._key(values)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+class QueryMetrics:
+    """数据库语句指标：按指纹统计耗时、返回/影响行数与错误数
+
+    热路径上只有一次带缓存的指纹计算和三次加锁累加，可在生产环境常开。
+    """
+
+    def __init__(self, max_fingerprints: int = 500):
+        self.latency = Histogram("db_query_duration_seconds", "数据库语句耗时（秒）",
+                                 ("statement",), DB_BUCKETS, max_fingerprints)
+        self.rows = Counter("db_query_rows_total", "数据库语句返回或影响的行数", ("statement",), max_fingerprints)
+        self.errors = Counter("db_query_errors_total", "数据库语句执行失败次数", ("statement",), max_fingerprints)
+
+    def observe(self, query: str, seconds: float, rows: int = 0, failed: bool = False):
+        key = (fingerprint(query),)
+        self.latency.observe(key, seconds)
+        if rows:
+            self.rows.inc(key, rows)
+        if failed:
+            self.errors.inc(key)
+
+    def render(self) -> List[str]:
+        return self.latency.render() + self.rows.render() + self.errors.render()
+
+
+def gauges(prefix: str, stats: Dict[str, Any], help: str = "") -> List[str]:
+    """把 stats() 字典中的数值项输出为 {prefix}_{键} 仪表；布尔值记为 0/1，其余类型忽略"""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        elif not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        if help:
+            lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_number(value)}")
+    return lines
+
+
+def render(parts: Iterable[List[str]]) -> str:
+    return "\n".join(line for part in parts for line in part) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """ASGI 中间件：按 (方法, 路由模板, 状态码) 记录请求耗时，直到响应体发送完毕
+
+    路由模板取自路由匹配后写入 scope 的 route，未匹配的请求记为 unmatched，避免按原始路径产生大量序列。
+    """
+
+    def __init__(self, app, histogram: Histogram):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.histogram.observe((scope["method"], route, status), time.perf_counter() - start)
+
+
+def request_histogram() -> Histogram:
+    return Histogram("http_request_duration_seconds", "HTTP 请求耗时（秒）",
+                     ("method", "route", "status"), REQUEST_BUCKETS)
@@ -0,0 +1,141 @@
+"""
+列表端点响应序列化的 CPU 剖析
+对比 FastAPI 默认通路（字典行 + response_model 逐元素校验 + 序列化）与快速通路
+（responses.list_response：元组行按模型投影后直接编码）在各列表端点上的耗时。
+
+数据为与端点查询列一致的合成行，不需要数据库；--profile 时额外输出两条通路的 cProfile 热点函数。
+
+    python profile_responses.py --rows 1000 --repeat 50
+    python profile_responses.py --endpoints /products --profile
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+import argparse
+import asyncio
+import cProfile
+import inspect
+import io
+import pstats
+import statistics
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from api import CategoryResponse, OrderResponse, ProductResponse, UserResponse
+from rows import build_rows
+import responses
+
+BASE_TIME = datetime(2024, 1, 1, 8, 30, 15, 250000)
+
+
+def product_rows(count: int):
+    columns = ("product_id", "product_name", "description", "price", "category_id", "stock_quantity",
+               "created_at", "updated_at", "category_name")
+    rows = [(i, f"商品 {i} 轻薄笔记本电脑", "正品保障，全国联保，限时特惠", Decimal("4999.00") + i, i % 50 + 1,
+             i % 300, BASE_TIME + timedelta(minutes=i), None, "电脑办公") for i in range(count, 0, -1)]
+    return columns, rows
+
+
+def order_rows(count: int):
+    columns = ("order_id", "user_id", "total_amount", "status", "shipping_address", "order_date",
+               "updated_at", "username", "full_name")
+    rows = [(i, i % 1000 + 1, Decimal("258.50") + i, "pending", "北京市朝阳区建国路 88 号",
+             BASE_TIME + timedelta(minutes=i), None, f"user{i % 1000}", "张三") for i in range(count, 0, -1)]
+    return columns, rows
+
+
+def user_rows(count: int):
+    columns = ("user_id", "username", "email", "full_name", "phone", "created_at", "updated_at")
+    rows = [(i, f"user{i}", f"user{i}@example.com", "张三", "13800000000",
+             BASE_TIME + timedelta(minutes=i), None) for i in range(count, 0, -1)]
+    return columns, rows
+
+
+def category_rows(count: int):
+    columns = ("category_id", "category_name", "parent_id", "description", "created_at")
+    rows = [(i, f"分类 {i}", i // 10 or None, None, BASE_TIME) for i in range(1, count + 1)]
+    return columns, rows
+
+
+ENDPOINTS = {
+    "/products": (ProductResponse, product_rows),
+    "/orders": (OrderResponse, order_rows),
+    "/users": (UserResponse, user_rows),
+    "/categories": (CategoryResponse, category_rows),
+}
+
+
+def default_path(model):
+    """按 FastAPI 处理 response_model 的方式编码字典行（新版本直接由 pydantic 输出 JSON 字节）"""
+    field = APIRoute("/", lambda: None, response_model=List[model]).response_field
+    dump_json = "dump_json" in inspect.signature(serialize_response).parameters
+
+    def encode(rows) -> bytes:
+        content = asyncio.run(serialize_response(field=field, response_content=rows, dump_json=dump_json)) \
+            if dump_json else asyncio.run(serialize_response(field=field, response_content=rows))
+        return content if isinstance(content, bytes) else JSONResponse(content).body
+
+    return encode
+
+
+def fast_path(model):
+    def encode(rows) -> bytes:
+        return responses.list_response(rows, model).body
+
+    return encode
+
+
+def measure(encode, rows, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        encode(rows)
+        timings.append((time.process_time() - start) * 1000)
+    return timings
+
+
+def hotspots(encode, rows, repeat: int, top: int) -> str:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(repeat):
+        encode(rows)
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("tottime").print_stats(top)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表端点响应序列化的 CPU 剖析")
+    parser.add_argument("--rows", type=int, default=1000, help="每个响应的行数（分页上限）")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--endpoints", nargs="*", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--profile", action="store_true", help="输出 cProfile 热点函数")
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    encoder = "orjson" if responses.orjson is not None else "json（未安装 orjson）"
+    print(f"每响应 {args.rows} 行，重复 {args.repeat} 次，快速通路编码器: {encoder}")
+    print(f"{'端点':<12}{'默认通路 ms':>14}{'快速通路 ms':>14}{'加速比':>10}")
+    for path in args.endpoints:
+        model, generate = ENDPOINTS[path]
+        columns, tuples = generate(args.rows)
+        dict_rows = build_rows("dict", columns, tuples)
+        tuple_rows = build_rows("tuple", columns, tuples)
+        before, after = default_path(model), fast_path(model)
+        assert before(dict_rows) == after(tuple_rows), f"{path} 两条通路的输出不一致"
+        before_ms = statistics.median(measure(before, dict_rows, args.repeat))
+        after_ms = statistics.median(measure(after, tuple_rows, args.repeat))
+        print(f"{path:<12}{before_ms:>14.2f}{after_ms:>14.2f}{before_ms / after_ms:>9.1f}x")
+        if args.profile:
+            print(f"\n--- {path} 默认通路 ---")
+            print(hotspots(before, dict_rows, args.repeat, args.top))
+            print(f"--- {path} 快速通路 ---")
+            print(hotspots(after, tuple_rows, args.repeat, args.top))
+
+
+if __name__ == "__main__":
+    main()
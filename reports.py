@@ -0,0 +1,370 @@
+"""
+销售报表
+按天流式读取订单与订单项（配置了只读副本时走副本，不占用主库），逐块转为 NumPy 列数组，
+按天、分类、订单状态与用户群（注册月份）向量化分组汇总销售额、订单数与销量。
+
+载入的列按天分区缓存：每次出报表先用一条按天 GROUP BY 的查询取各天订单的行数、总金额与行校验和，
+只重新载入指纹变化（或超过 partition_max_age）的日分区，历史日期的报表不再扫描订单表。
+商品所属分类来自 ProductService（超过 dimension_max_age 后整表重载），用户注册时间按 user_id 增量加载。
+
+金额以分为单位的 int64 累加，输出时换算为元。NumPy 为可选依赖，未安装时 SalesReports 不可用。
+"""
+
+from collections import OrderedDict
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # 报表为可选功能
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("day", "category", "status", "cohort")
+UNKNOWN = -1
+
+
+def _columns(rows: Iterator[Dict[str, Any]], spec: Dict[str, Tuple[Any, Any]], chunk_rows: int) -> Dict[str, "np.ndarray"]:
+    """把行迭代器逐块转为列数组：spec 为 {列名: (dtype, 取值函数)}，每块 chunk_rows 行，最后拼接"""
+    chunks = {name: [] for name in spec}
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            break
+        for name, (dtype, value) in spec.items():
+            chunks[name].append(np.fromiter((value(row) for row in chunk), dtype=dtype, count=len(chunk)))
+    return {name: np.concatenate(parts) if parts else np.empty(0, dtype=spec[name][0])
+            for name, parts in chunks.items()}
+
+
+def _cents(value) -> float:
+    return float(value) * 100 if value is not None else 0.0
+
+
+def _month_index(value: datetime) -> int:
+    return value.year * 12 + value.month - 1
+
+
+class SalesPartition:
+    """一天的订单列（按 order_id 升序）与订单项列（item_order 为所属订单在本分区中的行号）"""
+
+    __slots__ = ("day", "fingerprint", "loaded_at", "order_id", "user_id", "status", "revenue", "units",
+                 "item_order", "item_product", "item_quantity", "item_revenue")
+
+    def __init__(self, day: int, fingerprint, orders: Dict[str, "np.ndarray"], items: Dict[str, "np.ndarray"]):
+        self.day = day
+        self.fingerprint = fingerprint
+        self.loaded_at = time.monotonic()
+        self.order_id = orders["order_id"]
+        self.user_id = orders["user_id"]
+        self.status = orders["status"]
+        self.item_order = items["order"]
+        self.item_product = items["product_id"]
+        self.item_quantity = items["quantity"]
+        self.item_revenue = items["revenue"]
+        count = len(self.order_id)
+        self.revenue = np.bincount(self.item_order, weights=self.item_revenue, minlength=count).astype(np.int64)
+        self.units = np.bincount(self.item_order, weights=self.item_quantity, minlength=count).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__slots__[3:])
+
+
+class SalesReports:
+    """销售报表引擎，service 为未绑定请求连接的 ECommerceService（同步）"""
+
+    def __init__(self, service, chunk_rows: int = 10000, max_partitions: int = 800,
+                 partition_max_age: float = 3600.0, dimension_max_age: float = 300.0):
+        if np is None:
+            raise RuntimeError("销售报表需要 numpy")
+        self.service = service
+        self.chunk_rows = chunk_rows
+        self.max_partitions = max_partitions
+        self.partition_max_age = partition_max_age
+        self.dimension_max_age = dimension_max_age
+        self._lock = threading.Lock()
+        self._partitions = OrderedDict()    # 日序号 -> SalesPartition
+        self._statuses = {}                 # 状态 -> 编码（只追加，编码在各分区间稳定）
+        # 维度表整体替换，读者无需加锁：(user_id 升序, 注册月份) 与 (product_id 升序, 分类ID, {分类ID: 分类名})
+        self._users = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self._products = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), {})
+        self._dimensions_loaded_at = None
+
+        self.hits = 0
+        self.loads = 0
+        self.rows_loaded = 0
+
+    # ------------------------------------------------------------------ 载入
+
+    def _status_code(self, status: str) -> int:
+        code = self._statuses.get(status)
+        if code is None:
+            code = self._statuses[status] = len(self._statuses)
+        return code
+
+    def _load_days(self, first: int, last: int, fingerprints: Dict[int, Any]) -> List[SalesPartition]:
+        """一次流式读取连续的 [first, last] 天，按天切分为分区"""
+        start, end = datetime.fromordinal(first), datetime.fromordinal(last + 1)
+        orders = _columns(self.service.order_service.iter_orders_between(start, end), {
+            "order_id": (np.int64, lambda row: row['order_id']),
+            "user_id": (np.int64, lambda row: row['user_id']),
+            "status": (np.int16, lambda row: self._status_code(row['status'])),
+            "day": (np.int32, lambda row: row['order_date'].toordinal()),
+        }, self.chunk_rows)
+        items = _columns(self.service.order_item_service.iter_items_between(start, end), {
+            "order_id": (np.int64, lambda row: row['order_id']),
+            "product_id": (np.int64, lambda row: row['product_id']),
+            "quantity": (np.int64, lambda row: row['quantity']),
+            "revenue": (np.int64, lambda row: round(_cents(row['subtotal']))),
+        }, self.chunk_rows)
+        self.rows_loaded += len(orders["order_id"]) + len(items["order_id"])
+
+        # 订单按 (天, order_id) 排序后各天是连续的一段；订单项按所属订单的行号归入对应的天，
+        # 两次读取之间新下的订单只有订单项没有订单行，丢弃这些订单项
+        order = np.lexsort((orders["order_id"], orders["day"]))
+        orders = {name: column[order] for name, column in orders.items()}
+        item_row = self._lookup(orders["order_id"], np.arange(len(order), dtype=np.int64), items["order_id"])
+        found = item_row != UNKNOWN
+        items = {name: column[found] for name, column in items.items()}
+        item_row = item_row[found]
+        item_day = orders["day"][item_row]
+
+        partitions = []
+        bounds = np.searchsorted(orders["day"], np.arange(first, last + 2))
+        for day in range(first, last + 1):
+            lo, hi = bounds[day - first], bounds[day - first + 1]
+            mask = item_day == day
+            partitions.append(SalesPartition(day, fingerprints.get(day), {
+                "order_id": orders["order_id"][lo:hi],
+                "user_id": orders["user_id"][lo:hi],
+                "status": orders["status"][lo:hi],
+            }, {
+                "order": (item_row[mask] - lo).astype(np.int64),
+                "product_id": items["product_id"][mask],
+                "quantity": items["quantity"][mask],
+                "revenue": items["revenue"][mask],
+            }))
+        return partitions
+
+    def _fingerprints(self, first: int, last: int) -> Dict[int, Any]:
+        rows = self.service.order_service.get_daily_fingerprints(datetime.fromordinal(first),
+                                                                 datetime.fromordinal(last + 1))
+        return {date.fromisoformat(str(row['day'])[:10]).toordinal():
+                (row['orders'], str(row['total']), str(row['checksum'])) for row in rows}
+
+    def _fresh(self, partition: Optional[SalesPartition], fingerprint) -> bool:
+        return (partition is not None and partition.fingerprint == fingerprint
+                and time.monotonic() - partition.loaded_at < self.partition_max_age)
+
+    def partitions(self, first: int, last: int) -> List[SalesPartition]:
+        """[first, last] 各天的分区，过期或未缓存的连续天数合并为一次流式读取"""
+        with self._lock:
+            fingerprints = self._fingerprints(first, last)
+            result, stale = {}, []
+            for day in range(first, last + 1):
+                partition = self._partitions.get(day)
+                if self._fresh(partition, fingerprints.get(day)):
+                    self._partitions.move_to_end(day)
+                    result[day] = partition
+                    self.hits += 1
+                elif fingerprints.get(day) is None:
+                    # 当天没有订单：不查询，直接得到空分区
+                    result[day] = self._empty(day)
+                else:
+                    stale.append(day)
+            for run_first, run_last in self._runs(stale):
+                started = time.perf_counter()
+                for partition in self._load_days(run_first, run_last, fingerprints):
+                    result[partition.day] = partition
+                    self.loads += 1
+                logger.info(f"报表载入 {date.fromordinal(run_first)} 至 {date.fromordinal(run_last)}，"
+                            f"耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+            for day, partition in result.items():
+                self._partitions[day] = partition
+                self._partitions.move_to_end(day)
+            while len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+            return [result[day] for day in range(first, last + 1)]
+
+    @staticmethod
+    def _runs(days: List[int]) -> Iterator[Tuple[int, int]]:
+        """把升序的天序号合并为连续区间"""
+        run_first = previous = None
+        for day in days:
+            if previous is not None and day == previous + 1:
+                previous = day
+                continue
+            if run_first is not None:
+                yield run_first, previous
+            run_first = previous = day
+        if run_first is not None:
+            yield run_first, previous
+
+    def _empty(self, day: int) -> SalesPartition:
+        empty = lambda dtype: np.empty(0, dtype=dtype)
+        return SalesPartition(day, None, {
+            "order_id": empty(np.int64), "user_id": empty(np.int64), "status": empty(np.int16),
+        }, {
+            "order": empty(np.int64), "product_id": empty(np.int64), "quantity": empty(np.int64),
+            "revenue": empty(np.int64),
+        })
+
+    def _refresh_dimensions(self):
+        """增量加载新注册用户；商品分类与分类名超过 dimension_max_age 后整表重载"""
+        with self._lock:
+            user_ids, cohorts = self._users
+            after = int(user_ids[-1]) if len(user_ids) else 0
+            users = _columns(self.service.user_service.iter_user_signups(after), {
+                "user_id": (np.int64, lambda row: row['user_id']),
+                "cohort": (np.int64, lambda row: _month_index(row['created_at'])),
+            }, self.chunk_rows)
+            if len(users["user_id"]):
+                self._users = (np.concatenate([user_ids, users["user_id"]]),
+                               np.concatenate([cohorts, users["cohort"]]))
+            if (self._dimensions_loaded_at is not None
+                    and time.monotonic() - self._dimensions_loaded_at < self.dimension_max_age):
+                return
+            products = _columns(self.service.product_service.iter_products(), {
+                "product_id": (np.int64, lambda row: row['product_id']),
+                "category_id": (np.int64, lambda row: row['category_id'] if row['category_id'] is not None else UNKNOWN),
+            }, self.chunk_rows)
+            order = np.argsort(products["product_id"])
+            names = {row['category_id']: row['category_name']
+                     for row in self.service.category_service.get_all_categories()}
+            self._products = (products["product_id"][order], products["category_id"][order], names)
+            self._dimensions_loaded_at = time.monotonic()
+
+    @staticmethod
+    def _lookup(keys: "np.ndarray", values: "np.ndarray", wanted: "np.ndarray") -> "np.ndarray":
+        """按升序键数组查值，找不到的记为 UNKNOWN"""
+        if not len(keys):
+            return np.full(len(wanted), UNKNOWN, dtype=np.int64)
+        index = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[index] == wanted, values[index], UNKNOWN).astype(np.int64)
+
+    # ------------------------------------------------------------------ 汇总
+
+    def sales(self, start: date, end: date, group_by: Sequence[str] = ("day",),
+              statuses: Iterable[str] = None) -> Dict[str, Any]:
+        """[start, end] 的销售额、订单数与销量，按 group_by 中的维度分组（可多个，按维度值排序）
+
+        按分类分组时订单数为含该分类商品的订单数，同一订单可能计入多个分类。
+        """
+        group_by = list(dict.fromkeys(group_by))
+        unknown = [dim for dim in group_by if dim not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"不支持的分组维度: {', '.join(unknown)}（可选 {', '.join(DIMENSIONS)}）")
+        if end < start:
+            raise ValueError("结束日期早于开始日期")
+        self._refresh_dimensions()
+        partitions = self.partitions(start.toordinal(), end.toordinal())
+        (user_ids, cohorts), (product_ids, categories, category_names) = self._users, self._products
+
+        def concat(name):
+            return np.concatenate([getattr(p, name) for p in partitions])
+
+        days = np.concatenate([np.full(len(p.order_id), p.day, dtype=np.int64) for p in partitions])
+        offsets = np.cumsum([0] + [len(p.order_id) for p in partitions[:-1]])
+        status, user_id = concat("status"), concat("user_id")
+        wanted = np.ones(len(status), dtype=bool)
+        if statuses is not None:
+            codes = [self._statuses[s] for s in statuses if s in self._statuses]
+            wanted = np.isin(status, codes)
+
+        by_item = "category" in group_by
+        if by_item:
+            # 订单项粒度：每项带上所属订单的全局行号
+            order_row = np.concatenate([p.item_order + offset for p, offset in zip(partitions, offsets)])
+            product = concat("item_product")
+            revenue, units = concat("item_revenue"), concat("item_quantity")
+            keep = wanted[order_row]
+            order_row, product, revenue, units = order_row[keep], product[keep], revenue[keep], units[keep]
+        else:
+            order_row = np.flatnonzero(wanted)
+            revenue, units = concat("revenue")[order_row], concat("units")[order_row]
+
+        columns = {
+            "day": lambda: days[order_row],
+            "status": lambda: status[order_row].astype(np.int64),
+            "cohort": lambda: self._lookup(user_ids, cohorts, user_id[order_row]),
+            "category": lambda: self._lookup(product_ids, categories, product),
+        }
+        totals = self._totals(revenue, units, order_row)
+        if not group_by:
+            return {"start": start.isoformat(), "end": end.isoformat(), "group_by": [], "rows": [], "totals": totals}
+
+        groups, inverse = self._group(columns[dim]() for dim in group_by)
+        count = groups.shape[1]
+        group_revenue = np.bincount(inverse, weights=revenue, minlength=count)
+        group_units = np.bincount(inverse, weights=units, minlength=count)
+        if by_item:
+            # 同一订单在同一分组内只计一次
+            stride = int(order_row.max(initial=0)) + 1
+            group_orders = np.bincount(np.unique(inverse * stride + order_row) // stride, minlength=count)
+        else:
+            group_orders = np.bincount(inverse, minlength=count)
+
+        status_names = {code: name for name, code in self._statuses.items()}
+        rows = []
+        for g in range(count):
+            row = {}
+            for dim, value in zip(group_by, groups[:, g].tolist()):
+                if dim == "day":
+                    row["day"] = date.fromordinal(value).isoformat()
+                elif dim == "status":
+                    row["status"] = status_names[value]
+                elif dim == "cohort":
+                    row["cohort"] = None if value == UNKNOWN else f"{value // 12:04d}-{value % 12 + 1:02d}"
+                else:
+                    row["category_id"] = None if value == UNKNOWN else value
+                    row["category_name"] = category_names.get(value)
+            row.update(revenue=round(group_revenue[g] / 100, 2), orders=int(group_orders[g]),
+                       units=int(group_units[g]))
+            rows.append(row)
+        return {"start": start.isoformat(), "end": end.isoformat(), "group_by": group_by, "rows": rows,
+                "totals": totals}
+
+    @staticmethod
+    def _group(keys: Iterable["np.ndarray"]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """多列分组：各列先编码为 0..n-1，再按混合进制合成一列 int64 做一次一维 unique
+        （比按列 unique(axis=1) 快一个数量级）；返回 (各分组的键值，形状为 列数×分组数, 每行所属分组)"""
+        values, combined, radix = [], None, []
+        for column in keys:
+            distinct, codes = np.unique(column, return_inverse=True)
+            values.append(distinct)
+            radix.append(len(distinct))
+            combined = codes.astype(np.int64) if combined is None else combined * len(distinct) + codes
+        group_codes, inverse = np.unique(combined, return_inverse=True)
+        digits = np.unravel_index(group_codes, radix) if len(group_codes) else [group_codes] * len(values)
+        return np.vstack([distinct[digit] for distinct, digit in zip(values, digits)]), inverse.reshape(-1)
+
+    @staticmethod
+    def _totals(revenue, units, order_row) -> Dict[str, Any]:
+        return {"revenue": round(int(revenue.sum()) / 100, 2), "orders": int(len(np.unique(order_row))),
+                "units": int(units.sum())}
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._dimensions_loaded_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            partitions = list(self._partitions.values())
+        return {
+            "partitions": len(partitions),
+            "first_day": date.fromordinal(min(p.day for p in partitions)).isoformat() if partitions else None,
+            "last_day": date.fromordinal(max(p.day for p in partitions)).isoformat() if partitions else None,
+            "bytes": sum(p.nbytes for p in partitions),
+            "hits": self.hits,
+            "loads": self.loads,
+            "rows_loaded": self.rows_loaded,
+            "users": len(self._users[0]),
+            "products": len(self._products[0]),
+        }
@@ -0,0 +1,125 @@
+"""
+快速 JSON 响应
+列表端点的行直接来自服务层的查询，字段类型已由表结构保证。这里按响应模型的字段投影后直接编码，
+跳过 FastAPI 对每个元素的 response_model 二次校验；端点仍声明 response_model，OpenAPI 中的响应结构不变。
+安装了 orjson 时用它编码（datetime 原生支持，Decimal 经 default 转为 float），否则退回标准库 json。
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union, get_args, get_origin
+import json
+
+from fastapi import Response
+
+from rows import ColumnBlock, TupleRows
+
+try:
+    import orjson
+except ImportError:  # 快速编码为可选依赖
+    orjson = None
+
+_MISSING = object()
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def _orjson_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """编码为 UTF-8 JSON 字节串，输出与 FastAPI 默认编码一致（紧凑、不转义非 ASCII 字符）"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_orjson_default)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _is_float(annotation) -> bool:
+    if annotation is float:
+        return True
+    return get_origin(annotation) is Union and float in get_args(annotation)
+
+
+@lru_cache(maxsize=None)
+def _field_plan(model) -> Tuple[Tuple[str, bool, Any], ...]:
+    """响应模型的字段计划 ((字段名, 是否 float, 缺省值), ...)，按模型字段顺序"""
+    fields = getattr(model, "model_fields", None)
+    if fields is not None:
+        return tuple(
+            (name, _is_float(field.annotation), _MISSING if field.is_required() else field.default)
+            for name, field in fields.items()
+        )
+    return tuple(
+        (name, _is_float(field.outer_type_), _MISSING if field.required else field.default)
+        for name, field in model.__fields__.items()
+    )
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def project(rows, model) -> List[Dict[str, Any]]:
+    """按响应模型投影：只保留模型字段并按模型顺序排列，float 字段（如 Decimal 金额）转为 float
+
+    rows 可以是字典行、slots 行、TupleRows 或 ColumnBlock。行中缺少的字段取模型缺省值；
+    必填字段缺失说明查询与模型不匹配，抛出 KeyError。
+    """
+    plan = _field_plan(model)
+    if isinstance(rows, (TupleRows, ColumnBlock)):
+        index = {name: i for i, name in enumerate(rows.columns)}
+        getters = []
+        for name, is_float, default in plan:
+            if name not in index:
+                if default is _MISSING:
+                    raise KeyError(name)
+                getters.append((name, None, default, False))
+            else:
+                getters.append((name, index[name], None, is_float))
+        return [
+            {
+                name: (default if i is None else _float(row[i]) if is_float else row[i])
+                for name, i, default, is_float in getters
+            }
+            for row in rows
+        ]
+    result = []
+    for row in rows:
+        get = row.get
+        item = {}
+        for name, is_float, default in plan:
+            value = get(name, default)
+            if value is _MISSING:
+                raise KeyError(name)
+            item[name] = _float(value) if is_float else value
+        result.append(item)
+    return result
+
+
+def list_response(rows, model, response: Optional[Response] = None) -> FastJSONResponse:
+    """把可信的服务层结果编码为 JSON 列表响应；response 为端点注入的 Response，其响应头（如分页游标）一并带上"""
+    fast = FastJSONResponse(project(rows, model))
+    if response is not None:
+        # 逐条追加原始响应头，Set-Cookie 等可重复的头不会被合并；内容长度与类型以编码结果为准
+        fast.raw_headers.extend(
+            (name, value) for name, value in response.raw_headers
+            if name not in (b"content-length", b"content-type")
+        )
+    return fast
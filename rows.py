@@ -0,0 +1,151 @@
+"""
+查询结果的行格式
+fetch_all 默认每行一个字典，大结果集下每行都带一份键字符串，内存与 GC 压力大。这里提供三种紧凑格式：
+
+    tuple    TupleRows：行为元组，整个结果集共用一份列名索引
+    slots    每种列组合生成一个 dataclass(slots=True) 行类，行对象无 __dict__，支持 row.col 与 row["col"]
+    columns  ColumnBlock：按列存储，每列一个列表，适合聚合与导出
+
+slots 行可以直接作为端点返回值：FastAPI 按 response_model 从属性读取字段，JSON 输出与字典行一致。
+"""
+
+from dataclasses import make_dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+import keyword
+
+ROW_FORMATS = ("dict", "tuple", "slots", "columns")
+
+
+def check_row_format(row_format: str) -> str:
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"不支持的行格式: {row_format}")
+    return row_format
+
+
+class TupleRows(list):
+    """元组行列表，columns/index 为整个结果集共用的列名与列序号"""
+
+    def __init__(self, columns: Sequence[str], rows=()):
+        super().__init__(rows)
+        self.columns = tuple(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return TupleRows(self.columns, super().__getitem__(item))
+        return super().__getitem__(item)
+
+    def value(self, row: tuple, name: str) -> Any:
+        return row[self.index[name]]
+
+    def column(self, name: str) -> List[Any]:
+        i = self.index[name]
+        return [row[i] for row in self]
+
+    def dicts(self) -> Iterator[Dict[str, Any]]:
+        """逐行生成字典，不一次性物化整个结果集"""
+        columns = self.columns
+        for row in self:
+            yield dict(zip(columns, row))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return list(self.dicts())
+
+
+def _slots_getitem(self, name: str) -> Any:
+    try:
+        return getattr(self, name)
+    except AttributeError:
+        raise KeyError(name) from None
+
+
+def _slots_get(self, name: str, default: Any = None) -> Any:
+    return getattr(self, name, default)
+
+
+def _slots_keys(self) -> Tuple[str, ...]:
+    return self.__slots__
+
+
+def _slots_asdict(self) -> Dict[str, Any]:
+    return {name: getattr(self, name) for name in self.__slots__}
+
+
+@lru_cache(maxsize=256)
+def row_class(columns: Tuple[str, ...]) -> type:
+    """按列组合生成（并缓存）slots 行类；列名必须是合法且不重复的标识符，否则应在 SQL 中起别名"""
+    invalid = [name for name in columns if not name.isidentifier() or keyword.iskeyword(name)]
+    if invalid or len(set(columns)) != len(columns):
+        raise ValueError(f"列名无法用作行类属性: {invalid or list(columns)}")
+    return make_dataclass(
+        "Row",
+        columns,
+        slots=True,
+        namespace={
+            "__getitem__": _slots_getitem,
+            "get": _slots_get,
+            "keys": _slots_keys,
+            "to_dict": _slots_asdict,
+        },
+    )
+
+
+class ColumnBlock:
+    """列式结果块：data 为 {列名: 值列表}，各列等长"""
+
+    def __init__(self, columns: Sequence[str], data: Dict[str, List[Any]]):
+        self.columns = tuple(columns)
+        self.data = data
+
+    @classmethod
+    def from_tuples(cls, columns: Sequence[str], rows: List[tuple]) -> "ColumnBlock":
+        columns = tuple(columns)
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        return cls(columns, {name: list(column) for name, column in zip(columns, values)})
+
+    def __len__(self) -> int:
+        return len(self.data[self.columns[0]]) if self.columns else 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        return zip(*(self.data[name] for name in self.columns))
+
+    def column(self, name: str) -> List[Any]:
+        return self.data[name]
+
+    def dicts(self) -> Iterator[Dict[str, Any]]:
+        columns = self.columns
+        for row in self:
+            yield dict(zip(columns, row))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return list(self.dicts())
+
+
+def build_rows(row_format: str, columns: Sequence[str], rows: List[tuple]):
+    """由游标返回的元组行构造指定格式的结果"""
+    if row_format == "dict":
+        columns = tuple(columns)
+        return [dict(zip(columns, row)) for row in rows]
+    if row_format == "tuple":
+        return TupleRows(columns, rows)
+    if row_format == "slots":
+        cls = row_class(tuple(columns))
+        return [cls(*row) for row in rows]
+    if row_format == "columns":
+        return ColumnBlock.from_tuples(columns, rows)
+    raise ValueError(f"不支持的行格式: {row_format}")
+
+
+def row_value(rows, row, name: str) -> Any:
+    """按列名取一行中的值，适用于字典行、slots 行与 TupleRows 中的元组行"""
+    if isinstance(rows, TupleRows):
+        return rows.value(row, name)
+    return row[name]
+
+
+def to_dicts(rows) -> List[Dict[str, Any]]:
+    """任意格式的结果转为字典列表"""
+    if isinstance(rows, (TupleRows, ColumnBlock)):
+        return rows.to_dicts()
+    return [row if isinstance(row, dict) else row.to_dict() for row in rows]
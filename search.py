@@ -0,0 +1,227 @@
+"""
+商品全文检索
+进程内倒排索引，覆盖商品名称与描述：中文按二元组切分，英文/数字按词切分，BM25 排序
+"""
+
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+import asyncio
+import heapq
+import math
+import re
+import threading
+import time
+
+# CJK 统一表意文字（含扩展A与兼容区）连续段，以及字母数字词
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：CJK 段切为相邻二元组（单字段保留单字），其余按字母数字词切分并转小写"""
+    if not text:
+        return []
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        segment = match.group()
+        if _CJK_RE.match(segment):
+            if len(segment) == 1:
+                tokens.append(segment)
+            else:
+                tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+class ProductSearchIndex:
+    """商品倒排索引
+
+    为控制百万级商品的内存占用，倒排表以紧凑数组存储：词 -> (内部文档号 array, 加权词频 array)，
+    名称中的词频按 name_weight 加权。商品每次（重新）入索引分配新的内部文档号，旧文档号标记失效
+    （墓碑），失效比例过高时压缩重建。每个文档保留其词元序列（词ID数组），用于单字段更新。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, name_weight: int = 3,
+                 max_age: float = 3600.0, compact_ratio: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+        self.max_age = max_age
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        # 整表重载的单飞锁：并发请求发现索引过期时只由一个重载，其余等待后复用（同步与异步通路各一把）
+        self.reload_lock = threading.Lock()
+        self.async_reload_lock = asyncio.Lock()
+        self._loaded_at = None
+        self._reset()
+
+    def _reset(self):
+        self._vocab = {}                    # 词 -> 词ID
+        self._post_docs = []                # 词ID -> array('I') 内部文档号
+        self._post_tfs = []                 # 词ID -> array('H') 加权词频
+        self._df = array('I')               # 词ID -> 存活文档中含该词的文档数
+        self._doc_product = array('I')      # 文档号 -> 商品ID
+        self._doc_len = array('I')          # 文档号 -> 加权长度
+        self._doc_name_len = array('I')     # 文档号 -> 名称词元数
+        self._doc_offsets = array('Q', [0])  # 文档号 -> 词元序列在 _tokens 中的起止
+        self._tokens = array('I')
+        self._alive = bytearray()
+        self._current = {}                  # 商品ID -> 当前文档号
+        self._total_len = 0
+        self._dead = 0
+
+    @property
+    def loaded(self) -> bool:
+        """索引已加载且未过期"""
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age
+
+    def __len__(self):
+        return len(self._current)
+
+    def load(self, products: Iterable[Dict[str, Any]]):
+        """由商品行（product_id/product_name/description）重建索引"""
+        with self._lock:
+            self._reset()
+            for row in products:
+                self._index(row['product_id'],
+                            self._term_ids(row.get('product_name')),
+                            self._term_ids(row.get('description')))
+            self._loaded_at = time.monotonic()
+
+    def _term_ids(self, text: str) -> List[int]:
+        ids = []
+        for term in tokenize(text):
+            tid = self._vocab.get(term)
+            if tid is None:
+                tid = self._vocab[term] = len(self._post_docs)
+                self._post_docs.append(array('I'))
+                self._post_tfs.append(array('H'))
+                self._df.append(0)
+            ids.append(tid)
+        return ids
+
+    def _index(self, product_id: int, name_ids: List[int], desc_ids: List[int]):
+        docno = len(self._doc_product)
+        weighted = Counter(desc_ids)
+        for tid in name_ids:
+            weighted[tid] += self.name_weight
+        for tid, tf in weighted.items():
+            self._post_docs[tid].append(docno)
+            self._post_tfs[tid].append(min(tf, 0xFFFF))
+            self._df[tid] += 1
+        length = sum(weighted.values())
+        self._doc_product.append(product_id)
+        self._doc_len.append(length)
+        self._doc_name_len.append(len(name_ids))
+        self._tokens.extend(name_ids)
+        self._tokens.extend(desc_ids)
+        self._doc_offsets.append(len(self._tokens))
+        self._alive.append(1)
+        self._current[product_id] = docno
+        self._total_len += length
+
+    def _doc_terms(self, docno: int) -> Tuple[List[int], List[int]]:
+        start, end = self._doc_offsets[docno], self._doc_offsets[docno + 1]
+        split = start + self._doc_name_len[docno]
+        return self._tokens[start:split].tolist(), self._tokens[split:end].tolist()
+
+    def _remove(self, product_id: int):
+        docno = self._current.pop(product_id, None)
+        if docno is None:
+            return None
+        self._alive[docno] = 0
+        self._total_len -= self._doc_len[docno]
+        self._dead += 1
+        name_ids, desc_ids = self._doc_terms(docno)
+        for tid in set(name_ids).union(desc_ids):
+            self._df[tid] -= 1
+        return name_ids, desc_ids
+
+    def _maybe_compact(self):
+        """失效文档号比例超过 compact_ratio 时，按存活文档重建倒排表"""
+        if self._dead < 1024 or self._dead < self.compact_ratio * len(self._doc_product):
+            return
+        docs = [(self._doc_product[docno], *self._doc_terms(docno))
+                for docno in sorted(self._current.values())]
+        vocab = self._vocab
+        self._reset()
+        self._vocab = vocab
+        self._post_docs = [array('I') for _ in vocab]
+        self._post_tfs = [array('H') for _ in vocab]
+        self._df = array('I', bytes(4 * len(vocab)))
+        for product_id, name_ids, desc_ids in docs:
+            self._index(product_id, name_ids, desc_ids)
+
+    # ------------------------------------------------------------------
+    # 增量维护（未加载时忽略，首次检索时整表加载）
+    # ------------------------------------------------------------------
+
+    def add(self, product_id: int, name: str, description: str = None):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._remove(product_id)
+            self._index(product_id, self._term_ids(name), self._term_ids(description))
+            self._maybe_compact()
+
+    def update(self, product_id: int, **fields):
+        """更新名称和/或描述，未给出的字段保留原有词元"""
+        if 'product_name' not in fields and 'description' not in fields:
+            return
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            old = self._remove(product_id)
+            if old is None:
+                return
+            name_ids, desc_ids = old
+            if 'product_name' in fields:
+                name_ids = self._term_ids(fields['product_name'])
+            if 'description' in fields:
+                desc_ids = self._term_ids(fields['description'])
+            self._index(product_id, name_ids, desc_ids)
+            self._maybe_compact()
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+            self._maybe_compact()
+
+    # ------------------------------------------------------------------
+    # 检索
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Tuple[int, float]], int]:
+        """BM25 检索，返回 ([(商品ID, 得分)], 命中总数)，按得分降序、商品ID 升序稳定排序"""
+        terms = set(tokenize(query))
+        if not terms:
+            return [], 0
+        with self._lock:
+            n = len(self._current)
+            if n == 0:
+                return [], 0
+            avg_len = self._total_len / n
+            k1, b = self.k1, self.b
+            alive, doc_len = self._alive, self._doc_len
+            norm = k1 * (1 - b)
+            scale = k1 * b / avg_len
+            scores = {}
+            for term in terms:
+                tid = self._vocab.get(term)
+                if tid is None:
+                    continue
+                docs, tfs = self._post_docs[tid], self._post_tfs[tid]
+                df = self._df[tid]
+                if df == 0:
+                    continue
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                weight = idf * (k1 + 1)
+                for docno, tf in zip(docs, tfs):
+                    if alive[docno]:
+                        scores[docno] = scores.get(docno, 0.0) + weight * tf / (tf + norm + scale * doc_len[docno])
+            products = self._doc_product
+            ranked = heapq.nsmallest(offset + limit, scores.items(),
+                                     key=lambda item: (-item[1], products[item[0]]))
+            return [(products[docno], score) for docno, score in ranked[offset:]], len(scores)
@@ -3,53 +3,474 @@ FastAPI API端点定义
 为code.py中的服务类提供RESTful API接口
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool, contextmanager_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
+import asyncio
+import inspect
+import os
+import threading
 import code
-from code import DatabaseManager, ECommerceService
-from .api import UserCreateRequest,UserUpdateRequest,UserResponse,CategoryCreateRequest,CategoryUpdateRequest,CategoryResponse, ProductCreateRequest, ProductUpdateRequest, ProductResponse, OrderItemRequest, OrderCreateRequest, OrderResponse, OrderItemResponse, ChangePasswordRequest, SearchRequest, UpdateStockRequest, UpdateOrderStatusRequest
+import bulk_import
+import cache
+import group_commit
+import metrics
+import reports
+import responses
+import snapshot
+import versions
+from category_tree import CategoryTreeIndex
+from rows import ColumnBlock, TupleRows, to_dicts
+from inventory import InsufficientStockError, StockLedger
+from search import ProductSearchIndex
+from code import DatabaseManager, AsyncDatabaseManager, ECommerceService
+from .api import UserCreateRequest,UserUpdateRequest,UserResponse,CategoryCreateRequest,CategoryUpdateRequest,CategoryResponse, ProductCreateRequest, ProductUpdateRequest, ProductResponse, OrderItemRequest, OrderCreateRequest, OrderResponse, OrderItemResponse, ChangePasswordRequest, SearchRequest, UpdateStockRequest, UpdateOrderStatusRequest, BulkImportResponse, AdjustStockRequest, OrderTotalsRequest, OrderTotalsResponse
 
 
 app = FastAPI(title="E-Commerce API", version="1.0.0", description="电商系统API接口")
 
-# 全局数据库管理器（实际应用中应该使用依赖注入）
+# 按路由统计的请求耗时，随数据库语句指标与连接池、缓存状态一起由 /metrics 输出
+request_metrics = metrics.request_histogram()
+app.add_middleware(metrics.RequestMetricsMiddleware, histogram=request_metrics)
+
+# 数据通路：sync 使用线程池 + DatabaseManager，async 使用 AsyncDatabaseManager
+DB_MODE = os.environ.get("DB_MODE", "sync")
+
+def parse_replicas(spec: str) -> List[Dict[str, Any]]:
+    """解析只读副本列表 "host[:port][*weight],..."，如 "10.0.0.2:3306*2,10.0.0.3" """
+    replicas = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        address, _, weight = item.partition("*")
+        host, _, port = address.partition(":")
+        replicas.append({"host": host, "port": int(port or 3306), "weight": int(weight or 1)})
+    return replicas
+
+# 数据库配置（可通过环境变量覆盖）
+# DB_REPLICAS 配置只读副本后，事务外的读查询按权重路由到副本；复制延迟超过 DB_REPLICA_MAX_LAG 秒的副本暂停使用，
+# 写入后 DB_READ_YOUR_WRITES 秒内同一请求或同一客户端（X-Client-Id 请求头）的读取仍走主库
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "port": int(os.environ.get("DB_PORT", "3306")),
+    "database": os.environ.get("DB_NAME", "test1"),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", ""),
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "3600")),
+    "statement_cache_size": int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "64")),
+    "replicas": parse_replicas(os.environ.get("DB_REPLICAS", "")),
+    "max_replica_lag": float(os.environ["DB_REPLICA_MAX_LAG"]) if os.environ.get("DB_REPLICA_MAX_LAG") else None,
+    "read_your_writes": float(os.environ.get("DB_READ_YOUR_WRITES", "2")),
+    # 慢查询日志：SLOW_QUERY_MS=off 关闭；每个指纹首次变慢时采集 EXPLAIN（SLOW_QUERY_EXPLAIN=0 关闭）
+    "slow_query_ms": (
+        float(os.environ.get("SLOW_QUERY_MS", "200"))
+        if os.environ.get("SLOW_QUERY_MS", "200") != "off" else None
+    ),
+    "slow_query_buffer": int(os.environ.get("SLOW_QUERY_BUFFER", "1000")),
+    "explain_slow_queries": os.environ.get("SLOW_QUERY_EXPLAIN", "1").lower() in ("1", "true", "on"),
+}
+
+# DB_BACKEND=local 时使用本地数据库替身（SQLite 文件 LOCAL_DB_PATH，见 local_db.py），用于基准测试与本地开发
+DB_BACKEND = os.environ.get("DB_BACKEND", "mysql")
+if DB_BACKEND == "local":
+    if DB_MODE == "async":
+        raise RuntimeError("本地数据库替身只支持 DB_MODE=sync")
+    import local_db
+    DB_CONFIG["connector"] = local_db.LocalDatabase(os.environ.get("LOCAL_DB_PATH", "local_db.sqlite3")).connect
+
+# 慢查询环形缓冲区的导出文件：POST /debug/queries/dump 与停机时写入
+SLOW_QUERY_DUMP = os.environ.get("SLOW_QUERY_DUMP", "slow_queries.ndjson")
+
+# 读己之写的客户端标识请求头；请求未带时服务端生成一个，经同名响应头返回
+CLIENT_ID_HEADER = "X-Client-Id"
+
+# 实体缓存配置：CACHE_BACKEND=memory（进程内）| shared（Redis 兼容共享存储）| none
+CACHE_CONFIG = {
+    "backend": os.environ.get("CACHE_BACKEND", "memory"),
+    "ttl": float(os.environ.get("CACHE_TTL", "300")),
+    "max_entries": int(os.environ.get("CACHE_MAX_ENTRIES", "10000")),
+    "max_bytes": int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    "redis_url": os.environ.get("CACHE_REDIS_URL"),
+}
+
+def build_shared_store():
+    """共享模式下缓存与版本计数器共用的存储客户端；未配置 CACHE_REDIS_URL 时使用 LocalStore 本地替身"""
+    if CACHE_CONFIG["backend"] != "shared":
+        return None
+    if CACHE_CONFIG["redis_url"]:
+        import redis
+        return redis.Redis.from_url(CACHE_CONFIG["redis_url"])
+    return cache.LocalStore()
+
+shared_store = build_shared_store()
+
+def build_cache():
+    """按配置创建实体缓存"""
+    backend = CACHE_CONFIG["backend"]
+    if backend == "none":
+        return cache.NULL_CACHE
+    if backend == "shared":
+        return cache.SharedStoreCache(shared_store, ttl=CACHE_CONFIG["ttl"])
+    return cache.LRUCache(
+        max_entries=CACHE_CONFIG["max_entries"],
+        max_bytes=CACHE_CONFIG["max_bytes"],
+        ttl=CACHE_CONFIG["ttl"],
+    )
+
+entity_cache = build_cache()
+
+# 条件 GET 用的数据版本计数器：共享缓存模式下放在共享存储中，否则在进程内。CONDITIONAL_GET=off 时不生成 ETag。
+# 多进程部署（WEB_CONCURRENCY > 1，同 uvicorn/gunicorn 的约定）须使用 Redis 共享存储，进程内计数器
+# 与 LocalStore 看不到其他进程的写入，会对已变更的数据返回 304，此时拒绝启动
+CONDITIONAL_GET = os.environ.get("CONDITIONAL_GET", "on").lower() in ("1", "true", "on")
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+def build_version_counters() -> versions.VersionCounters:
+    if not CONDITIONAL_GET:
+        return versions.NULL_VERSIONS
+    if WEB_CONCURRENCY > 1 and not (shared_store is not None and CACHE_CONFIG["redis_url"]):
+        raise RuntimeError("多进程部署的条件 GET 需要 CACHE_BACKEND=shared 与 CACHE_REDIS_URL，"
+                           "或设置 CONDITIONAL_GET=off")
+    return versions.SharedVersions(shared_store) if shared_store is not None else versions.LocalVersions()
+
+version_counters = build_version_counters()
+
+# 分类树索引在进程内共享，超过 max_age 后整表重载以同步其他进程的写入
+category_tree = CategoryTreeIndex(max_age=float(os.environ.get("CATEGORY_TREE_MAX_AGE", "60")))
+
+# 商品倒排索引：SEARCH_BACKEND=index（默认）| like（退回 LIKE 查询）
+product_search_index = (
+    ProductSearchIndex(max_age=float(os.environ.get("SEARCH_INDEX_MAX_AGE", "3600")))
+    if os.environ.get("SEARCH_BACKEND", "index") == "index" else None
+)
+
+# 目录快照：CATALOG_SNAPSHOT 为快照文件路径时，/products、/products/{id}、/products/category/{id}、/categories
+# 由内存映射的快照应答（不借出数据库连接），每 CATALOG_SNAPSHOT_CHECK 秒检查一次是否有新快照发布；
+# 文件不存在时退回数据库。快照由 POST /catalog/snapshot 或 python snapshot.py build 生成
+CATALOG_SNAPSHOT = os.environ.get("CATALOG_SNAPSHOT", "")
+catalog_snapshot = (
+    snapshot.SnapshotStore(CATALOG_SNAPSHOT, check_interval=float(os.environ.get("CATALOG_SNAPSHOT_CHECK", "5")))
+    if CATALOG_SNAPSHOT else None
+)
+
+# 销售报表：订单与订单项按天流式载入为 NumPy 列并按日分区缓存，/reports/sales 在服务端向量化汇总，
+# 财务报表不再拉取全部订单；配置了 DB_REPLICAS 时读查询路由到只读副本。未安装 numpy 时报表端点返回 501
+REPORTS_CONFIG = {
+    "chunk_rows": int(os.environ.get("REPORT_CHUNK_ROWS", "10000")),
+    "max_partitions": int(os.environ.get("REPORT_MAX_PARTITIONS", "800")),
+    "partition_max_age": float(os.environ.get("REPORT_PARTITION_MAX_AGE", "3600")),
+    "dimension_max_age": float(os.environ.get("REPORT_DIMENSION_MAX_AGE", "300")),
+}
+REPORT_MAX_DAYS = int(os.environ.get("REPORT_MAX_DAYS", "731"))
+
+# 热点商品库存租约：默认关闭（0），所有商品逐单条件扣减。开启后各进程分别持有租约，
+# 租约中的件数在归还前不计入 products.stock_quantity，其他进程可能因此提前报库存不足；
+# 未用完的件数记录在 stock_leases 表中，进程失联超过 INVENTORY_LEASE_STALE 秒后由其他进程回收
+INVENTORY_LEASE_SIZE = int(os.environ.get("INVENTORY_LEASE_SIZE", "0"))
+stock_ledger = (
+    StockLedger(
+        lease_size=INVENTORY_LEASE_SIZE,
+        hot_threshold=int(os.environ.get("INVENTORY_HOT_THRESHOLD", "20")),
+        idle_release=float(os.environ.get("INVENTORY_LEASE_IDLE", "5")),
+        stale_after=float(os.environ.get("INVENTORY_LEASE_STALE", "300")),
+        hot_products=[int(pid) for pid in os.environ.get("INVENTORY_HOT_SKUS", "").split(",") if pid.strip()],
+    )
+    if INVENTORY_LEASE_SIZE > 0 else None
+)
+
+# 订单组提交：ORDER_GROUP_COMMIT=1 时 POST /orders 经有界队列批量写入，
+# 每批最多等待 ORDER_GROUP_MAX_WAIT_MS 毫秒或攒满 ORDER_GROUP_MAX_BATCH 单
+ORDER_GROUP_COMMIT = os.environ.get("ORDER_GROUP_COMMIT", "0").lower() in ("1", "true", "on")
+ORDER_GROUP_CONFIG = {
+    "max_batch": int(os.environ.get("ORDER_GROUP_MAX_BATCH", "50")),
+    "max_wait_ms": float(os.environ.get("ORDER_GROUP_MAX_WAIT_MS", "5")),
+    "max_queue": int(os.environ.get("ORDER_GROUP_QUEUE", "1000")),
+}
+
+# 全局数据库管理器，持有连接池；每个请求通过依赖注入得到请求范围的会话，连接按语句或事务借出
 db_manager = None
-ecommerce_service = None
+_db_manager_lock = threading.Lock()
 
 def get_db_manager():
     """获取数据库管理器"""
     global db_manager
     if db_manager is None:
-        db_manager = code.DatabaseManager(
-            host='localhost',
-            database='test1',
-            user='root',
-            password=''
-        )
-        db_manager.connect()
+        with _db_manager_lock:
+            if db_manager is None:
+                manager = code.DatabaseManager(**DB_CONFIG)
+                manager.connect()
+                db_manager = manager
     return db_manager
 
-def get_ecommerce_service():
-    """获取电商服务"""
-    global ecommerce_service
-    if ecommerce_service is None:
-        db = get_db_manager()
-        ecommerce_service = code.ECommerceService(db)
-    return ecommerce_service
+async_db_manager = None
+_async_db_manager_lock = asyncio.Lock()
+
+async def get_async_db_manager():
+    """获取异步数据库管理器"""
+    global async_db_manager
+    if async_db_manager is None:
+        async with _async_db_manager_lock:
+            if async_db_manager is None:
+                manager = code.AsyncDatabaseManager(**DB_CONFIG)
+                await manager.connect()
+                async_db_manager = manager
+    return async_db_manager
+
+def client_id(request: Request, response: Optional[Response]) -> Optional[str]:
+    """读己之写的客户端标识：取自 X-Client-Id 请求头；没有时生成一个并通过同名响应头返回，
+    客户端在后续请求中带上它，写入后的读取即走主库"""
+    client = request.headers.get(CLIENT_ID_HEADER)
+    if client is None and response is not None:
+        client = os.urandom(16).hex()
+        response.headers[CLIENT_ID_HEADER] = client
+    return client
+
+async def get_ecommerce_service(request: Request, response: Response):
+    """获取请求范围的电商服务：会话不预先占用连接，事务外每条语句临时借出，事务期间持有一个连接"""
+    client = client_id(request, response)
+    if DB_MODE == "async":
+        manager = await get_async_db_manager()
+        async with manager.session(client) as session:
+            yield code.AsyncECommerceService(session, entity_cache, category_tree, product_search_index, stock_ledger,
+                                             version_counters)
+    else:
+        manager = await run_in_threadpool(get_db_manager)
+        async with contextmanager_in_threadpool(manager.session(client)) as session:
+            yield code.ECommerceService(session, entity_cache, category_tree, product_search_index, stock_ledger,
+                                        version_counters)
+
+async def get_unbound_service(request: Request, response: Response = None):
+    """获取不带请求会话的电商服务（事务状态按线程隔离）：流式导出在响应发送期间独立借出并持有连接，
+    下单只在事务期间借出连接（组提交模式下则完全由队列写入）；
+    处理函数直接调用（不传 response）时不生成客户端标识"""
+    client = client_id(request, response)
+    if DB_MODE == "async":
+        manager = (await get_async_db_manager()).for_client(client)
+        return code.AsyncECommerceService(manager, entity_cache, category_tree, product_search_index, stock_ledger,
+                                          version_counters)
+    manager = (await run_in_threadpool(get_db_manager)).for_client(client)
+    return code.ECommerceService(manager, entity_cache, category_tree, product_search_index, stock_ledger,
+                                 version_counters)
+
+sales_reports = None
+_sales_reports_lock = threading.Lock()
+
+def get_sales_reports() -> reports.SalesReports:
+    """获取销售报表引擎（首次使用时创建）；报表在线程池中运行，异步模式下同样使用同步数据库管理器"""
+    global sales_reports
+    if sales_reports is None:
+        with _sales_reports_lock:
+            if sales_reports is None:
+                sales_reports = reports.SalesReports(code.ECommerceService(get_db_manager()), **REPORTS_CONFIG)
+    return sales_reports
+
+order_queue = None
+_order_queue_lock = asyncio.Lock()
+
+async def get_order_queue():
+    """获取订单组提交队列（首次使用时创建并启动工作者）"""
+    global order_queue
+    if order_queue is None:
+        async with _order_queue_lock:
+            if order_queue is None:
+                if DB_MODE == "async":
+                    service = code.AsyncECommerceService(await get_async_db_manager(), entity_cache, category_tree,
+                                                         product_search_index, stock_ledger, version_counters)
+                    queue = group_commit.AsyncGroupCommitQueue(service, **ORDER_GROUP_CONFIG)
+                else:
+                    service = code.ECommerceService(await run_in_threadpool(get_db_manager), entity_cache,
+                                                    category_tree, product_search_index, stock_ledger,
+                                                    version_counters)
+                    queue = group_commit.GroupCommitQueue(service, **ORDER_GROUP_CONFIG)
+                queue.start()
+                order_queue = queue
+    return order_queue
+
+async def place_order_grouped(**order) -> int:
+    """经组提交队列下单，等待所在批次提交后返回订单ID"""
+    future = (await get_order_queue()).submit(**order)
+    return await (future if DB_MODE == "async" else asyncio.wrap_future(future))
+
+# 快速 JSON 通路：FAST_JSON=1（默认）时列表端点把服务层查询结果按响应模型投影后直接编码（orjson 可用时使用），
+# 跳过 FastAPI 对每个元素的 response_model 二次校验；端点声明的 response_model 仍用于 OpenAPI
+FAST_JSON = os.environ.get("FAST_JSON", "1").lower() in ("1", "true", "on")
+
+# 列表端点查询结果的行格式：tuple（快速通路下默认，共用列索引的元组行）| slots（每种列组合一个 slots 行类）| dict；
+# 各格式的 JSON 输出相同
+LIST_ROW_FORMAT = os.environ.get("LIST_ROW_FORMAT", "tuple" if FAST_JSON else "slots")
+if LIST_ROW_FORMAT not in ("tuple", "slots", "dict"):
+    raise ValueError(f"LIST_ROW_FORMAT 只能是 tuple、slots 或 dict: {LIST_ROW_FORMAT}")
+
+def list_result(rows, model, response: Response):
+    """列表端点的返回值：快速通路下直接编码为 JSON 响应（带上 response 中已设置的响应头，
+    包括依赖项设置的 X-Client-Id），否则交给 FastAPI 按 response_model 校验与序列化"""
+    if FAST_JSON:
+        return responses.list_response(rows, model, response)
+    return to_dicts(rows) if isinstance(rows, (TupleRows, ColumnBlock)) else rows
+
+# 分页游标通过响应头返回，响应体保持列表格式
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+# 按ID批量获取：?ids=1,2,3，去重后保持请求顺序；服务层按块拼 IN 查询
+MAX_BATCH_IDS = 10000
+
+def parse_ids(ids: str) -> List[int]:
+    """解析逗号分隔的ID列表，格式非法或数量超限时抛出 ValueError"""
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError(f"无效的ID列表: {ids}")
+    parsed = list(dict.fromkeys(parsed))
+    if len(parsed) > MAX_BATCH_IDS:
+        raise ValueError(f"单次最多获取 {MAX_BATCH_IDS} 个ID")
+    return parsed
+
+def in_request_order(rows_by_id: Dict[int, Dict[str, Any]], ids: List[int]) -> List[Dict[str, Any]]:
+    """按请求顺序输出，不存在的ID跳过"""
+    return [rows_by_id[i] for i in ids if i in rows_by_id]
+
+# 由快照应答的响应带上快照版本
+SNAPSHOT_VERSION_HEADER = "X-Catalog-Snapshot"
+
+async def serving_snapshot(response: Response) -> Optional[snapshot.CatalogSnapshot]:
+    """当前可用的目录快照（未配置或尚未发布时为 None），并在响应头中标明快照版本；
+    到了检查时间才进入线程池检查文件（加载新快照要做一次 CRC 校验）"""
+    if catalog_snapshot is None:
+        return None
+    if catalog_snapshot.needs_check():
+        await run_in_threadpool(catalog_snapshot.refresh)
+    current = catalog_snapshot.snapshot
+    if current is not None:
+        response.headers[SNAPSHOT_VERSION_HEADER] = str(current.version)
+    return current
+
+# 条件 GET：轮询端点在查询前由版本计数器（由快照应答时为快照版本）拼出弱 ETag，
+# If-None-Match 命中时直接返回 304，不查询数据库也不序列化响应体。
+# 计数器在写入提交后才递增，先取版本再查询（响应体从主库读取，见 run_on_primary），
+# 最坏情况是响应体比 ETag 新，下次轮询多返回一次 200
+def current_etag(catalog: Optional[snapshot.CatalogSnapshot], *keys: str) -> Optional[str]:
+    if catalog is not None:
+        return f'W/"snapshot-{catalog.version}"'
+    return version_counters.etag(*keys)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 按弱比较匹配（忽略 W/ 前缀）"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+def not_modified(request: Request, response: Response, etag: Optional[str]) -> Optional[Response]:
+    """客户端缓存仍然有效时返回 304 响应；否则把 ETag 写入响应头，返回 None 由端点继续查询"""
+    if etag is None:
+        return None
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers, ETag=etag))
+    response.headers["ETag"] = etag
+    return None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_ROWS = 500
+
+def _ndjson_lines(rows) -> bytes:
+    return b"".join(responses.dumps(row) + b"\n" for row in rows)
+
+def ndjson_response(rows) -> StreamingResponse:
+    """将行迭代器（同步或异步）按批编码为 NDJSON 流式输出，首批行就绪即开始发送"""
+    if hasattr(rows, "__aiter__"):
+        async def body():
+            batch = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) >= NDJSON_BATCH_ROWS:
+                    yield _ndjson_lines(batch)
+                    batch = []
+            if batch:
+                yield _ndjson_lines(batch)
+    else:
+        def body():
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= NDJSON_BATCH_ROWS:
+                    yield _ndjson_lines(batch)
+                    batch = []
+            if batch:
+                yield _ndjson_lines(batch)
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+async def run(fn, *args, **kwargs):
+    """调用服务方法：异步模式直接 await，同步模式放入线程池执行"""
+    if DB_MODE == "async":
+        result = fn(*args, **kwargs)
+        return await result if inspect.isawaitable(result) else result
+    return await run_in_threadpool(fn, *args, **kwargs)
+
+async def run_on_primary(fn, *args, **kwargs):
+    """同 run，只读查询走主库：带 ETag 的响应体不能比 ETag 旧，落后的只读副本会让客户端
+    把旧数据存在新 ETag 下，直到下一次写入前一直得到 304（线程池调用继承当前上下文）"""
+    with code.primary_reads():
+        return await run(fn, *args, **kwargs)
+
+# 批量导入请求体：JSON 数组，或按行流式解析的 NDJSON / CSV（首行为表头）
+BULK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+            "application/x-ndjson": {"schema": {"type": "string"}},
+            "text/csv": {"schema": {"type": "string"}},
+        },
+    }
+}
+
+async def bulk_import_body(request: Request, model, write) -> Dict[str, Any]:
+    """边接收请求体边解析校验，每攒满一批交给 write（服务层批量写入方法）"""
+    fmt = bulk_import.format_for_content_type(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="仅支持 application/json、application/x-ndjson、text/csv")
+    importer = bulk_import.BulkImporter(fmt, model)
+    try:
+        async for data in request.stream():
+            for batch in importer.feed(data):
+                await write_batch(importer, batch, write)
+        for batch in importer.close():
+            await write_batch(importer, batch, write)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except code.BulkInsertError as e:
+        # 导入中断：之前的批次与本批已提交的块已写入，随错误一并报告
+        raise HTTPException(status_code=500, detail={"message": str(e), **importer.result()})
+    return importer.result()
+
+async def write_batch(importer, batch, write):
+    try:
+        importer.record(batch, await run(write, [row for _, row in batch]))
+    except code.BulkInsertError as e:
+        importer.record(batch, (e.ids, e.errors))
+        raise
 
 # ============================================================================
 # 用户相关API端点
 # ============================================================================
 
 @app.post("/users", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
-def create_user(request: UserCreateRequest):
+async def create_user(request: UserCreateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """创建新用户"""
     try:
-        service = get_ecommerce_service()
-        user_id = service.user_service.create_user(
+        user_id = await run(service.user_service.create_user,
             username=request.username,
             email=request.email,
             password=request.password,
@@ -60,12 +481,24 @@ def create_user(request: UserCreateRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/users/bulk", response_model=BulkImportResponse, openapi_extra=BULK_REQUEST_BODY)
+async def create_users_bulk(request: Request, service: ECommerceService = Depends(get_ecommerce_service)):
+    """批量创建用户，逐行报告校验与写入错误"""
+    return await bulk_import_body(request, UserCreateRequest, service.user_service.create_users)
+
+@app.get("/users/export", response_class=StreamingResponse)
+async def export_users(service: ECommerceService = Depends(get_unbound_service)):
+    """流式导出所有用户（NDJSON）"""
+    try:
+        return ndjson_response(service.user_service.iter_users())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/users/{user_id}", response_model=UserResponse)
-def get_user(user_id: int):
+async def get_user(user_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """根据ID获取用户"""
     try:
-        service = get_ecommerce_service()
-        user = service.user_service.get_user_by_id(user_id)
+        user = await run(service.user_service.get_user_by_id, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         return user
@@ -75,21 +508,29 @@ def get_user(user_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/users", response_model=List[UserResponse])
-def get_all_users():
-    """获取所有用户"""
+async def get_all_users(response: Response,
+                        limit: int = Query(code.DEFAULT_PAGE_SIZE, ge=1, le=code.MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None,
+                        ids: Optional[str] = Query(None, description="逗号分隔的ID列表，给出时按ID批量获取，忽略分页参数"),
+                        service: ECommerceService = Depends(get_ecommerce_service)):
+    """分页获取用户，下一页游标见 X-Next-Cursor 响应头；给出 ids 时按ID批量获取（一次 IN 查询）"""
     try:
-        service = get_ecommerce_service()
-        users = service.user_service.get_all_users()
-        return users
+        if ids is not None:
+            id_list = parse_ids(ids)
+            return list_result(in_request_order(await run(service.user_service.get_users_by_ids, id_list), id_list), UserResponse, response)
+        users, next_cursor = await run(service.user_service.get_users_page, limit, cursor, LIST_ROW_FORMAT)
+        set_next_cursor(response, next_cursor)
+        return list_result(users, UserResponse, response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/users/username/{username}", response_model=UserResponse)
-def get_user_by_username(username: str):
+async def get_user_by_username(username: str, service: ECommerceService = Depends(get_ecommerce_service)):
     """根据用户名获取用户"""
     try:
-        service = get_ecommerce_service()
-        user = service.user_service.get_user_by_username(username)
+        user = await run(service.user_service.get_user_by_username, username)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         return user
@@ -99,11 +540,10 @@ def get_user_by_username(username: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/users/email/{email}", response_model=UserResponse)
-def get_user_by_email(email: str):
+async def get_user_by_email(email: str, service: ECommerceService = Depends(get_ecommerce_service)):
     """根据邮箱获取用户"""
     try:
-        service = get_ecommerce_service()
-        user = service.user_service.get_user_by_email(email)
+        user = await run(service.user_service.get_user_by_email, email)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         return user
@@ -113,15 +553,14 @@ def get_user_by_email(email: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/users/{user_id}", response_model=Dict[str, Any])
-def update_user(user_id: int, request: UserUpdateRequest):
+async def update_user(user_id: int, request: UserUpdateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """更新用户信息"""
     try:
-        service = get_ecommerce_service()
         update_data = request.dict(exclude_unset=True)
         if not update_data:
             raise HTTPException(status_code=400, detail="没有提供更新数据")
         
-        result = service.user_service.update_user(user_id, **update_data)
+        result = await run(service.user_service.update_user, user_id, **update_data)
         return {"message": "用户更新成功", "affected_rows": result}
     except HTTPException:
         raise
@@ -129,11 +568,10 @@ def update_user(user_id: int, request: UserUpdateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user_id: int):
+async def delete_user(user_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """删除用户"""
     try:
-        service = get_ecommerce_service()
-        result = service.user_service.delete_user(user_id)
+        result = await run(service.user_service.delete_user, user_id)
         if result == 0:
             raise HTTPException(status_code=404, detail="用户不存在")
         return None
@@ -143,11 +581,10 @@ def delete_user(user_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/users/{user_id}/password", response_model=Dict[str, Any])
-def change_password(user_id: int, request: ChangePasswordRequest):
+async def change_password(user_id: int, request: ChangePasswordRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """修改用户密码"""
     try:
-        service = get_ecommerce_service()
-        result = service.user_service.change_password(user_id, request.new_password)
+        result = await run(service.user_service.change_password, user_id, request.new_password)
         return {"message": "密码修改成功", "affected_rows": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -157,11 +594,10 @@ def change_password(user_id: int, request: ChangePasswordRequest):
 # ============================================================================
 
 @app.post("/categories", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
-def create_category(request: CategoryCreateRequest):
+async def create_category(request: CategoryCreateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """创建分类"""
     try:
-        service = get_ecommerce_service()
-        category_id = service.category_service.create_category(
+        category_id = await run(service.category_service.create_category,
             category_name=request.category_name,
             parent_id=request.parent_id,
             description=request.description
@@ -170,12 +606,29 @@ def create_category(request: CategoryCreateRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/categories/root", response_model=List[CategoryResponse])
+async def get_root_categories(response: Response, service: ECommerceService = Depends(get_ecommerce_service)):
+    """获取所有一级分类"""
+    try:
+        categories = await run(service.category_service.get_root_categories)
+        return list_result(categories, CategoryResponse, response)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/categories/tree", response_model=List[Dict[str, Any]])
+async def get_category_tree(root_id: Optional[int] = None,
+                            service: ECommerceService = Depends(get_ecommerce_service)):
+    """获取嵌套分类树，root_id 为空时返回整棵树"""
+    try:
+        return await run(service.category_service.get_category_tree, root_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/categories/{category_id}", response_model=CategoryResponse)
-def get_category(category_id: int):
+async def get_category(category_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """根据ID获取分类"""
     try:
-        service = get_ecommerce_service()
-        category = service.category_service.get_category_by_id(category_id)
+        category = await run(service.category_service.get_category_by_id, category_id)
         if not category:
             raise HTTPException(status_code=404, detail="分类不存在")
         return category
@@ -185,57 +638,65 @@ def get_category(category_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/categories", response_model=List[CategoryResponse])
-def get_all_categories():
-    """获取所有分类"""
+async def get_all_categories(request: Request, response: Response):
+    """获取所有分类；支持 If-None-Match 条件请求"""
     try:
-        service = get_ecommerce_service()
-        categories = service.category_service.get_all_categories()
-        return categories
+        catalog = await serving_snapshot(response)
+        cached = not_modified(request, response, current_etag(catalog, "categories"))
+        if cached is not None:
+            return cached
+        if catalog is not None:
+            return list_result(catalog.categories(), CategoryResponse, response)
+        service = await get_unbound_service(request)
+        categories = await run_on_primary(service.category_service.get_all_categories, LIST_ROW_FORMAT)
+        return list_result(categories, CategoryResponse, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/categories/root", response_model=List[CategoryResponse])
-def get_root_categories():
-    """获取所有一级分类"""
+@app.get("/categories/{parent_id}/children", response_model=List[CategoryResponse])
+async def get_subcategories(parent_id: int, response: Response, service: ECommerceService = Depends(get_ecommerce_service)):
+    """获取指定父分类的子分类"""
     try:
-        service = get_ecommerce_service()
-        categories = service.category_service.get_root_categories()
-        return categories
+        categories = await run(service.category_service.get_subcategories, parent_id)
+        return list_result(categories, CategoryResponse, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/categories/{parent_id}/children", response_model=List[CategoryResponse])
-def get_subcategories(parent_id: int):
-    """获取指定父分类的子分类"""
+@app.get("/categories/{category_id}/breadcrumbs", response_model=List[CategoryResponse])
+async def get_category_breadcrumbs(category_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
+    """获取从一级分类到该分类的路径"""
     try:
-        service = get_ecommerce_service()
-        categories = service.category_service.get_subcategories(parent_id)
-        return categories
+        breadcrumbs = await run(service.category_service.get_category_breadcrumbs, category_id)
+        if not breadcrumbs:
+            raise HTTPException(status_code=404, detail="分类不存在")
+        return breadcrumbs
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/categories/{category_id}", response_model=Dict[str, Any])
-def update_category(category_id: int, request: CategoryUpdateRequest):
+async def update_category(category_id: int, request: CategoryUpdateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """更新分类信息"""
     try:
-        service = get_ecommerce_service()
         update_data = request.dict(exclude_unset=True)
         if not update_data:
             raise HTTPException(status_code=400, detail="没有提供更新数据")
         
-        result = service.category_service.update_category(category_id, **update_data)
+        result = await run(service.category_service.update_category, category_id, **update_data)
         return {"message": "分类更新成功", "affected_rows": result}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/categories/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_category(category_id: int):
+async def delete_category(category_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """删除分类"""
     try:
-        service = get_ecommerce_service()
-        result = service.category_service.delete_category(category_id)
+        result = await run(service.category_service.delete_category, category_id)
         if result == 0:
             raise HTTPException(status_code=404, detail="分类不存在")
         return None
@@ -249,11 +710,10 @@ def delete_category(category_id: int):
 # ============================================================================
 
 @app.post("/products", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
-def create_product(request: ProductCreateRequest):
+async def create_product(request: ProductCreateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """创建商品"""
     try:
-        service = get_ecommerce_service()
-        product_id = service.product_service.create_product(
+        product_id = await run(service.product_service.create_product,
             product_name=request.product_name,
             price=request.price,
             category_id=request.category_id,
@@ -264,12 +724,29 @@ def create_product(request: ProductCreateRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/products/bulk", response_model=BulkImportResponse, openapi_extra=BULK_REQUEST_BODY)
+async def create_products_bulk(request: Request, service: ECommerceService = Depends(get_ecommerce_service)):
+    """批量创建商品，逐行报告校验与写入错误；写入成功的商品随即加入检索索引"""
+    return await bulk_import_body(request, ProductCreateRequest, service.product_service.create_products)
+
+@app.get("/products/export", response_class=StreamingResponse)
+async def export_products(service: ECommerceService = Depends(get_unbound_service)):
+    """流式导出所有商品（NDJSON）"""
+    try:
+        return ndjson_response(service.product_service.iter_products())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/products/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int):
-    """根据ID获取商品"""
+async def get_product(product_id: int, request: Request, response: Response):
+    """根据ID获取商品；快照中没有的商品（快照之后新建）查数据库"""
     try:
-        service = get_ecommerce_service()
-        product = service.product_service.get_product_by_id(product_id)
+        catalog = await serving_snapshot(response)
+        product = catalog.product(product_id) if catalog is not None else None
+        if product is not None:
+            return product
+        service = await get_unbound_service(request)
+        product = await run(service.product_service.get_product_by_id, product_id)
         if not product:
             raise HTTPException(status_code=404, detail="商品不存在")
         return product
@@ -279,45 +756,86 @@ def get_product(product_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/products", response_model=List[ProductResponse])
-def get_all_products():
-    """获取所有商品"""
+async def get_all_products(request: Request, response: Response,
+                           limit: int = Query(code.DEFAULT_PAGE_SIZE, ge=1, le=code.MAX_PAGE_SIZE),
+                           cursor: Optional[str] = None,
+                           ids: Optional[str] = Query(None, description="逗号分隔的ID列表，给出时按ID批量获取，忽略分页参数")):
+    """分页获取商品，下一页游标见 X-Next-Cursor 响应头；给出 ids 时按ID批量获取（一次 IN 查询）"""
     try:
-        service = get_ecommerce_service()
-        products = service.product_service.get_all_products()
-        return products
+        catalog = await serving_snapshot(response)
+        if ids is not None:
+            id_list = parse_ids(ids)
+            found = catalog.products_by_ids(id_list) if catalog is not None else {}
+            missing = [i for i in id_list if i not in found]
+            if missing:
+                service = await get_unbound_service(request)
+                found.update(await run(service.product_service.get_products_by_ids, missing))
+            return list_result(in_request_order(found, id_list), ProductResponse, response)
+        if catalog is not None:
+            products, next_cursor = catalog.products_page(limit, cursor)
+            set_next_cursor(response, next_cursor)
+            return list_result(products, ProductResponse, response)
+        service = await get_unbound_service(request)
+        products, next_cursor = await run(service.product_service.get_products_page, limit, cursor, LIST_ROW_FORMAT)
+        set_next_cursor(response, next_cursor)
+        return list_result(products, ProductResponse, response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/products/category/{category_id}", response_model=List[ProductResponse])
-def get_products_by_category(category_id: int):
-    """根据分类获取商品"""
+async def get_products_by_category(category_id: int, request: Request, response: Response,
+                                   limit: int = Query(code.DEFAULT_PAGE_SIZE, ge=1, le=code.MAX_PAGE_SIZE),
+                                   cursor: Optional[str] = None,
+                                   include_subcategories: bool = False):
+    """分页获取分类下的商品（include_subcategories 时包含整棵子树，查数据库），下一页游标见 X-Next-Cursor 响应头；
+    支持 If-None-Match 条件请求（商品行带有分类名，任一商品或分类写入后 ETag 变化）"""
     try:
-        service = get_ecommerce_service()
-        products = service.product_service.get_products_by_category(category_id)
-        return products
+        catalog = await serving_snapshot(response) if not include_subcategories else None
+        cached = not_modified(request, response, current_etag(catalog, "products", "categories"))
+        if cached is not None:
+            return cached
+        if catalog is not None:
+            products, next_cursor = catalog.products_by_category_page(category_id, limit, cursor)
+            set_next_cursor(response, next_cursor)
+            return list_result(products, ProductResponse, response)
+        service = await get_unbound_service(request)
+        if include_subcategories:
+            products, next_cursor = await run_on_primary(service.get_products_in_category_tree,
+                                                         category_id, limit, cursor, LIST_ROW_FORMAT)
+        else:
+            products, next_cursor = await run_on_primary(service.product_service.get_products_by_category_page,
+                                                         category_id, limit, cursor, LIST_ROW_FORMAT)
+        set_next_cursor(response, next_cursor)
+        return list_result(products, ProductResponse, response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/products/search", response_model=List[ProductResponse])
-def search_products(request: SearchRequest):
-    """搜索商品"""
+async def search_products(request: SearchRequest, response: Response,
+                          service: ECommerceService = Depends(get_ecommerce_service)):
+    """按相关度分页搜索商品，命中总数见 X-Total-Count 响应头"""
     try:
-        service = get_ecommerce_service()
-        products = service.product_service.search_products(request.keyword)
-        return products
+        products, total = await run(service.product_service.search_products_ranked,
+                                    request.keyword, request.limit, request.offset)
+        if total is not None:
+            response.headers["X-Total-Count"] = str(total)
+        return list_result(products, ProductResponse, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/products/{product_id}", response_model=Dict[str, Any])
-def update_product(product_id: int, request: ProductUpdateRequest):
+async def update_product(product_id: int, request: ProductUpdateRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """更新商品信息"""
     try:
-        service = get_ecommerce_service()
         update_data = request.dict(exclude_unset=True)
         if not update_data:
             raise HTTPException(status_code=400, detail="没有提供更新数据")
         
-        result = service.product_service.update_product(product_id, **update_data)
+        result = await run(service.product_service.update_product, product_id, **update_data)
         return {"message": "商品更新成功", "affected_rows": result}
     except HTTPException:
         raise
@@ -325,21 +843,32 @@ def update_product(product_id: int, request: ProductUpdateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/products/{product_id}/stock", response_model=Dict[str, Any])
-def update_product_stock(product_id: int, request: UpdateStockRequest):
+async def update_product_stock(product_id: int, request: UpdateStockRequest, service: ECommerceService = Depends(get_ecommerce_service)):
     """更新商品库存"""
     try:
-        service = get_ecommerce_service()
-        result = service.product_service.update_stock(product_id, request.stock_quantity)
+        result = await run(service.product_service.update_stock, product_id, request.stock_quantity)
         return {"message": "库存更新成功", "affected_rows": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/products/{product_id}/stock/adjust", response_model=Dict[str, Any])
+async def adjust_product_stock(product_id: int, request: AdjustStockRequest, service: ECommerceService = Depends(get_ecommerce_service)):
+    """原子地增减商品库存，替代“读取-修改-写回”"""
+    try:
+        result = await run(service.product_service.adjust_stock, product_id, request.delta)
+        if result == 0:
+            raise HTTPException(status_code=409, detail="商品不存在或库存不足")
+        return {"message": "库存更新成功", "affected_rows": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(product_id: int):
+async def delete_product(product_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """删除商品"""
     try:
-        service = get_ecommerce_service()
-        result = service.product_service.delete_product(product_id)
+        result = await run(service.product_service.delete_product, product_id)
         if result == 0:
             raise HTTPException(status_code=404, detail="商品不存在")
         return None
@@ -353,30 +882,49 @@ def delete_product(product_id: int):
 # ============================================================================
 
 @app.post("/orders", response_model=Dict[str, Any], status_code=status.HTTP_201_CREATED)
-def create_order(request: OrderCreateRequest):
-    """创建订单"""
+async def create_order(request: OrderCreateRequest, service: ECommerceService = Depends(get_unbound_service)):
+    """创建订单；开启组提交时与同批订单在一个事务中写入"""
     try:
-        service = get_ecommerce_service()
         # 构建订单项
         items = [
             {"product_id": item.product_id, "quantity": item.quantity, "unit_price": item.unit_price}
             for item in request.items
         ]
-        order_id = service.place_order(
-            user_id=request.user_id,
-            items=items,
-            shipping_address=request.shipping_address
-        )
+        order = {"user_id": request.user_id, "items": items, "shipping_address": request.shipping_address}
+        if ORDER_GROUP_COMMIT:
+            order_id = await place_order_grouped(**order)
+            # 订单由队列工作者提交，在此为当前客户端开始读己之写窗口
+            service.db.record_write()
+        else:
+            order_id = await run(service.place_order, **order)
         return {"message": "订单创建成功", "order_id": order_id}
+    except group_commit.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except group_commit.CommitUnknownError as e:
+        # 订单可能已经写入，客户端不应直接重试
+        raise HTTPException(status_code=500, detail=str(e))
+    except InsufficientStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/orders/export", response_class=StreamingResponse)
+async def export_orders(service: ECommerceService = Depends(get_unbound_service)):
+    """流式导出所有订单（NDJSON）"""
+    try:
+        return ndjson_response(service.order_service.iter_orders())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/orders/{order_id}", response_model=OrderResponse)
-def get_order(order_id: int):
-    """根据ID获取订单"""
+async def get_order(order_id: int, request: Request, response: Response):
+    """根据ID获取订单；支持 If-None-Match 条件请求（304 时不借出数据库连接）"""
     try:
-        service = get_ecommerce_service()
-        order = service.order_service.get_order_by_id(order_id)
+        cached = not_modified(request, response, current_etag(None, f"order:{order_id}", "users"))
+        if cached is not None:
+            return cached
+        service = await get_unbound_service(request)
+        order = await run_on_primary(service.order_service.get_order_by_id, order_id)
         if not order:
             raise HTTPException(status_code=404, detail="订单不存在")
         return order
@@ -386,51 +934,58 @@ def get_order(order_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/orders", response_model=List[OrderResponse])
-def get_all_orders():
-    """获取所有订单"""
+async def get_all_orders(response: Response,
+                         limit: int = Query(code.DEFAULT_PAGE_SIZE, ge=1, le=code.MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None,
+                         ids: Optional[str] = Query(None, description="逗号分隔的ID列表，给出时按ID批量获取，忽略分页参数"),
+                         service: ECommerceService = Depends(get_ecommerce_service)):
+    """分页获取订单，下一页游标见 X-Next-Cursor 响应头；给出 ids 时按ID批量获取（一次 IN 查询）"""
     try:
-        service = get_ecommerce_service()
-        orders = service.order_service.get_all_orders()
-        return orders
+        if ids is not None:
+            id_list = parse_ids(ids)
+            return list_result(in_request_order(await run(service.order_service.get_orders_by_ids, id_list), id_list), OrderResponse, response)
+        orders, next_cursor = await run(service.order_service.get_orders_page, limit, cursor, LIST_ROW_FORMAT)
+        set_next_cursor(response, next_cursor)
+        return list_result(orders, OrderResponse, response)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/orders/user/{user_id}", response_model=List[OrderResponse])
-def get_orders_by_user(user_id: int):
+async def get_orders_by_user(user_id: int, response: Response, service: ECommerceService = Depends(get_ecommerce_service)):
     """获取用户的订单"""
     try:
-        service = get_ecommerce_service()
-        orders = service.order_service.get_orders_by_user(user_id)
-        return orders
+        orders = await run(service.order_service.get_orders_by_user, user_id, LIST_ROW_FORMAT)
+        return list_result(orders, OrderResponse, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/orders/user/{user_id}/history", response_model=List[Dict[str, Any]])
-def get_user_order_history(user_id: int):
+async def get_user_order_history(user_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """获取用户的完整订单历史（包含订单项）"""
     try:
-        service = get_ecommerce_service()
-        orders = service.get_user_order_history(user_id)
+        orders = await run(service.get_user_order_history, user_id)
         return orders
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/orders/{order_id}/status", response_model=Dict[str, Any])
-def update_order_status(order_id: int, request: UpdateOrderStatusRequest):
-    """更新订单状态"""
+async def update_order_status(order_id: int, request: UpdateOrderStatusRequest, service: ECommerceService = Depends(get_ecommerce_service)):
+    """更新订单状态；取消订单会释放其库存"""
     try:
-        service = get_ecommerce_service()
-        result = service.order_service.update_order_status(order_id, request.status)
+        result = await run(service.update_order_status, order_id, request.status)
         return {"message": "订单状态更新成功", "affected_rows": result}
+    except InsufficientStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/orders/{order_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_order(order_id: int):
+async def delete_order(order_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """删除订单"""
     try:
-        service = get_ecommerce_service()
-        result = service.order_service.delete_order(order_id)
+        result = await run(service.order_service.delete_order, order_id)
         if result == 0:
             raise HTTPException(status_code=404, detail="订单不存在")
         return None
@@ -444,36 +999,262 @@ def delete_order(order_id: int):
 # ============================================================================
 
 @app.get("/orders/{order_id}/items", response_model=List[OrderItemResponse])
-def get_order_items(order_id: int):
+async def get_order_items(order_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """获取订单的所有商品项"""
     try:
-        service = get_ecommerce_service()
-        items = service.order_item_service.get_order_items(order_id)
+        items = await run(service.order_item_service.get_order_items, order_id)
         return items
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/orders/{order_id}/total", response_model=Dict[str, Any])
-def get_order_total(order_id: int):
+async def get_order_total(order_id: int, service: ECommerceService = Depends(get_ecommerce_service)):
     """获取订单总金额"""
     try:
-        service = get_ecommerce_service()
-        total = service.order_item_service.get_order_total_amount(order_id)
+        total = await run(service.order_item_service.get_order_total_amount, order_id)
         return {"order_id": order_id, "total_amount": total}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/orders/totals", response_model=OrderTotalsResponse)
+async def get_order_totals(request: OrderTotalsRequest, service: ECommerceService = Depends(get_ecommerce_service)):
+    """批量获取订单总金额（一次 IN 查询，ID 过多时分块）；recompute 时先按订单项重新汇总"""
+    try:
+        order_ids = list(dict.fromkeys(request.order_ids))
+        if len(order_ids) > MAX_BATCH_IDS:
+            raise ValueError(f"单次最多获取 {MAX_BATCH_IDS} 个ID")
+        if request.recompute:
+            await run(service.order_item_service.recompute_order_totals, order_ids)
+        totals = await run(service.order_item_service.get_order_totals, order_ids)
+        return {
+            "totals": [{"order_id": i, "total_amount": totals[i]} for i in order_ids if i in totals],
+            "missing": [i for i in order_ids if i not in totals],
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============================================================================
+# 报表API端点
+# ============================================================================
+
+@app.get("/reports/sales", response_model=Dict[str, Any])
+async def sales_report(start: date = Query(..., description="开始日期（含）"),
+                       end: Optional[date] = Query(None, description="结束日期（含），默认今天"),
+                       group_by: str = Query("day", description="逗号分隔的分组维度：day | category | status | cohort"),
+                       status: Optional[str] = Query(None, description="逗号分隔的订单状态，只统计这些状态的订单")):
+    """按天、分类、订单状态与用户群（注册月份）汇总销售额、订单数与销量"""
+    if reports.np is None:
+        raise HTTPException(status_code=501, detail="销售报表需要安装 numpy")
+    end = end or date.today()
+    if (end - start).days >= REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"单次报表最多 {REPORT_MAX_DAYS} 天")
+    dimensions = [dim.strip() for dim in group_by.split(",") if dim.strip()]
+    statuses = [s.strip() for s in status.split(",") if s.strip()] if status is not None else None
+    try:
+        engine = await run_in_threadpool(get_sales_reports)
+        return await run_in_threadpool(engine.sales, start, end, dimensions, statuses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/reports/sales/partitions", response_model=Dict[str, Any])
+async def sales_report_partitions():
+    """销售报表的日分区缓存状态"""
+    if sales_reports is None:
+        return {"enabled": reports.np is not None, "partitions": 0}
+    return dict(sales_reports.stats(), enabled=True)
+
 # ============================================================================
 # 健康检查端点
 # ============================================================================
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """健康检查"""
     return {"status": "healthy", "service": "E-Commerce API"}
 
+@app.get("/health/pool")
+async def pool_health():
+    """连接池状态：利用率与借出等待时间"""
+    try:
+        if DB_MODE == "async":
+            return (await get_async_db_manager()).pool_stats()
+        return (await run_in_threadpool(get_db_manager)).pool_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/health/statements")
+async def statement_cache_health():
+    """预处理语句缓存状态：命中率与缓存语句数"""
+    try:
+        if DB_MODE == "async":
+            return (await get_async_db_manager()).statement_cache_stats()
+        return (await run_in_threadpool(get_db_manager)).statement_cache_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/health/replicas")
+async def replica_health():
+    """只读副本状态：健康、复制延迟与读路由计数"""
+    try:
+        if DB_MODE == "async":
+            return (await get_async_db_manager()).replica_stats()
+        return (await run_in_threadpool(get_db_manager)).replica_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/health/inventory")
+async def inventory_health():
+    """热点商品库存租约状态"""
+    return stock_ledger.stats() if stock_ledger is not None else {"enabled": False}
+
+@app.get("/health/orders")
+async def order_queue_health():
+    """订单组提交队列状态：批次数、平均批大小与拒绝数"""
+    return order_queue.stats() if order_queue is not None else {"enabled": ORDER_GROUP_COMMIT}
+
+@app.on_event("shutdown")
+async def stop_order_queue():
+    """停机时写完已入队的订单"""
+    if order_queue is None:
+        return
+    if DB_MODE == "async":
+        await order_queue.stop()
+    else:
+        await run_in_threadpool(order_queue.stop)
+
+lease_sweeper = None
+
+async def lease_inventory_service():
+    """租约清扫使用的库存服务（事务状态按线程隔离的管理器）"""
+    if DB_MODE == "async":
+        return code.AsyncInventoryService(await get_async_db_manager(), entity_cache, stock_ledger, version_counters)
+    return code.InventoryService(await run_in_threadpool(get_db_manager), entity_cache, stock_ledger, version_counters)
+
+async def sweep_stock_leases(service):
+    """每隔 INVENTORY_LEASE_IDLE 秒（至少 1 秒）清扫一次：续期本进程的租约记录、归还闲置租约、回收失联进程的租约"""
+    while True:
+        await asyncio.sleep(max(1.0, stock_ledger.idle_release))
+        if DB_MODE == "async":
+            await service.sweep_leases()
+        else:
+            await run_in_threadpool(service.sweep_leases)
+
+@app.on_event("startup")
+async def start_lease_sweeper():
+    """开启库存租约时，先回收失联进程（含本实例重启前）遗留的租约，再启动周期清扫"""
+    global lease_sweeper
+    if stock_ledger is None:
+        return
+    service = await lease_inventory_service()
+    if DB_MODE == "async":
+        await service.reconcile_leases()
+    else:
+        await run_in_threadpool(service.reconcile_leases)
+    lease_sweeper = asyncio.get_running_loop().create_task(sweep_stock_leases(service))
+
+@app.on_event("shutdown")
+async def return_stock_leases():
+    """停机时停止清扫，并把未用完的库存租约归还数据库（同时删除本进程的租约记录）"""
+    global lease_sweeper
+    if stock_ledger is None:
+        return
+    if lease_sweeper is not None:
+        lease_sweeper.cancel()
+        lease_sweeper = None
+    if DB_MODE == "async":
+        if async_db_manager is not None:
+            await code.AsyncInventoryService(async_db_manager, entity_cache, stock_ledger, version_counters).return_leases(idle_only=False)
+    elif db_manager is not None:
+        await run_in_threadpool(code.InventoryService(db_manager, entity_cache, stock_ledger, version_counters).return_leases, False)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus 文本格式指标；数据库尚未连接时只输出请求与缓存指标"""
+    parts = [request_metrics.render()]
+    manager = async_db_manager if DB_MODE == "async" else db_manager
+    if manager is not None:
+        parts.append(manager.query_metrics.render())
+        parts.append(metrics.gauges("db_pool", manager.pool_stats()))
+        parts.append(metrics.gauges("db_statement_cache", manager.statement_cache_stats()))
+    parts.append(metrics.gauges("entity_cache", entity_cache.stats()))
+    if order_queue is not None:
+        parts.append(metrics.gauges("order_group_commit", order_queue.stats()))
+    return Response(metrics.render(parts), media_type=metrics.CONTENT_TYPE)
+
+async def current_db_manager():
+    if DB_MODE == "async":
+        return await get_async_db_manager()
+    return await run_in_threadpool(get_db_manager)
+
+@app.get("/debug/queries")
+async def slow_queries(limit: int = Query(20, ge=1, le=1000),
+                       sort: str = Query("total", description="total | max | count"),
+                       recent: int = Query(50, ge=0, le=10000)):
+    """慢查询：按累计耗时（或最大耗时、次数）排序的指纹汇总，附最近的慢查询记录"""
+    if sort not in ("total", "max", "count"):
+        raise HTTPException(status_code=400, detail=f"无效的排序方式: {sort}")
+    manager = await current_db_manager()
+    if manager.slow_queries is None:
+        return {"stats": manager.slow_query_stats(), "top": [], "recent": []}
+    return {
+        "stats": manager.slow_query_stats(),
+        "top": manager.slow_queries.top(limit, sort),
+        "recent": manager.slow_queries.recent(recent),
+    }
+
+@app.post("/debug/queries/dump")
+async def dump_slow_queries():
+    """把慢查询环形缓冲区导出到 SLOW_QUERY_DUMP 文件（NDJSON）"""
+    manager = await current_db_manager()
+    if manager.slow_queries is None:
+        raise HTTPException(status_code=404, detail="慢查询日志未开启")
+    try:
+        entries = await run_in_threadpool(manager.slow_queries.dump, SLOW_QUERY_DUMP)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"path": SLOW_QUERY_DUMP, "entries": entries}
+
+@app.on_event("shutdown")
+async def dump_slow_queries_on_shutdown():
+    """停机时导出慢查询记录"""
+    manager = async_db_manager if DB_MODE == "async" else db_manager
+    if manager is not None and manager.slow_queries is not None and manager.slow_queries.recorded:
+        await run_in_threadpool(manager.slow_queries.dump, SLOW_QUERY_DUMP)
+
+@app.post("/catalog/snapshot", response_model=Dict[str, Any])
+async def publish_catalog_snapshot(service: ECommerceService = Depends(get_unbound_service)):
+    """从数据库导出商品与分类并发布新快照（原子替换 CATALOG_SNAPSHOT 文件），本进程立即切换，其他进程在下次检查时切换"""
+    if catalog_snapshot is None:
+        raise HTTPException(status_code=404, detail="未配置目录快照（CATALOG_SNAPSHOT）")
+    if DB_MODE == "async":
+        raise HTTPException(status_code=501, detail="异步模式下请使用 python snapshot.py build 生成快照")
+    try:
+        result = await run_in_threadpool(snapshot.build_snapshot, service.product_service, service.category_service,
+                                         CATALOG_SNAPSHOT)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    await run_in_threadpool(catalog_snapshot.refresh)
+    return result
+
+@app.get("/health/catalog")
+async def catalog_health():
+    """目录快照状态：当前版本、行数与切换次数"""
+    if catalog_snapshot is None:
+        return {"enabled": False}
+    await run_in_threadpool(catalog_snapshot.refresh)
+    return dict(catalog_snapshot.stats(), enabled=True)
+
+@app.get("/health/cache")
+async def cache_health():
+    """实体缓存状态：命中率、条目数与内存占用，以及条件 GET 的版本计数器"""
+    return dict(entity_cache.stats(), versions=version_counters.stats())
+
 @app.get("/")
-def root():
+async def root():
     """根路径"""
     return {"message": "E-Commerce API", "version": "1.0.0"}
 
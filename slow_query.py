@@ -0,0 +1,189 @@
+"""
+慢查询日志
+记录耗时超过阈值的语句：指纹、参数形态、耗时、行数与发起调用的服务方法；每个指纹首次变慢时
+附带 EXPLAIN 执行计划。按指纹汇总供 /debug/queries 查看最严重的语句，最近的记录保存在环形缓冲区中，可导出为 NDJSON 文件
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import json
+import os
+import sys
+import threading
+import time
+
+from metrics import fingerprint
+
+# 记录中保存的 SQL 原文长度上限（多行 INSERT、长 IN 列表会很长）
+MAX_SQL_CHARS = 2000
+
+# 只对只读查询采集执行计划（EXPLAIN 在另一个连接上重新解析语句，不宜对写语句执行）
+EXPLAINABLE = ("SELECT",)
+
+
+def param_shapes(params) -> List[str]:
+    """参数形态：只保留类型（字符串附长度），相邻同类型合并为 类型×个数，不记录参数值"""
+    if not params:
+        return []
+    shapes = []
+    for value in params:
+        shape = f"str({len(value)})" if isinstance(value, str) else type(value).__name__
+        if shapes and shapes[-1][0] == shape:
+            shapes[-1][1] += 1
+        else:
+            shapes.append([shape, 1])
+    return [shape if count == 1 else f"{shape}×{count}" for shape, count in shapes]
+
+
+def calling_method(depth: int = 2) -> str:
+    """沿调用栈向上找到最近的服务方法（self 的类名以 Service 结尾），找不到时返回最近的非数据库层函数"""
+    frame = sys._getframe(depth)
+    fallback = None
+    while frame is not None:
+        owner = frame.f_locals.get("self")
+        owner_name = type(owner).__name__ if owner is not None else ""
+        if owner_name.endswith("Service"):
+            return f"{owner_name}.{frame.f_code.co_name}"
+        if fallback is None and not owner_name.endswith("DatabaseManager") \
+                and os.path.basename(frame.f_code.co_filename) not in ("code.py", "contextlib.py"):
+            fallback = f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+class _Offender:
+    """同一指纹的慢查询汇总"""
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.failures = 0
+        self.callers = {}
+        self.example = None
+        self.plan = None
+        self.first_seen = time.time()
+        self.last_seen = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+            "failures": self.failures,
+            "callers": dict(sorted(self.callers.items(), key=lambda item: -item[1])),
+            "example": self.example,
+            "plan": self.plan,
+            "first_seen": datetime.fromtimestamp(self.first_seen).isoformat(),
+            "last_seen": datetime.fromtimestamp(self.last_seen).isoformat() if self.last_seen else None,
+        }
+
+
+class SlowQueryLog:
+    """慢查询记录器
+
+    record() 只在耗时达到 threshold_ms 时才计算指纹与调用方，未超阈值的语句几乎没有额外开销。
+    某个指纹首次记录且为 SELECT 时返回 True，由数据库管理器在独立连接上执行 EXPLAIN 后调用 set_plan()。
+    汇总最多保留 max_fingerprints 个指纹，环形缓冲区保留最近 capacity 条记录。
+    """
+
+    def __init__(self, threshold_ms: float = 200.0, capacity: int = 1000, explain: bool = True,
+                 max_fingerprints: int = 1000):
+        self.threshold = threshold_ms / 1000
+        self.capacity = capacity
+        self.explain = explain
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=capacity)
+        self._offenders = {}
+        self.recorded = 0
+
+    def is_slow(self, seconds: float) -> bool:
+        return seconds >= self.threshold
+
+    def record(self, query: str, params, seconds: float, rows: int = 0, failed: bool = False,
+               caller: str = None) -> bool:
+        """记录一条慢查询，返回是否需要为其执行 EXPLAIN"""
+        statement = fingerprint(query)
+        entry = {
+            "time": datetime.now().isoformat(),
+            "statement": statement,
+            "sql": query if len(query) <= MAX_SQL_CHARS else query[:MAX_SQL_CHARS] + "...",
+            "params": param_shapes(params),
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "failed": failed,
+            "caller": caller or calling_method(),
+        }
+        with self._lock:
+            self.recorded += 1
+            self._recent.append(entry)
+            offender = self._offenders.get(statement)
+            first = offender is None
+            if first:
+                if len(self._offenders) >= self.max_fingerprints:
+                    # 淘汰累计耗时最少的指纹
+                    del self._offenders[min(self._offenders, key=lambda s: self._offenders[s].total)]
+                offender = self._offenders[statement] = _Offender(statement)
+                offender.example = entry
+            offender.count += 1
+            offender.total += seconds
+            offender.max = max(offender.max, seconds)
+            offender.rows += rows
+            offender.failures += failed
+            offender.callers[entry["caller"]] = offender.callers.get(entry["caller"], 0) + 1
+            offender.last_seen = time.time()
+        return first and self.explain and not failed and query.lstrip()[:6].upper() in EXPLAINABLE
+
+    def set_plan(self, query: str, plan: Any):
+        with self._lock:
+            offender = self._offenders.get(fingerprint(query))
+            if offender is not None:
+                offender.plan = plan
+
+    def top(self, limit: int = 20, sort: str = "total") -> List[Dict[str, Any]]:
+        """最严重的 limit 个指纹，sort 为 total（累计耗时）| max | count"""
+        key = {"total": lambda o: o.total, "max": lambda o: o.max, "count": lambda o: o.count}[sort]
+        with self._lock:
+            offenders = sorted(self._offenders.values(), key=key, reverse=True)[:limit]
+            return [offender.to_dict() for offender in offenders]
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """环形缓冲区中最近的记录，最新的在前"""
+        with self._lock:
+            entries = list(self._recent)
+        entries.reverse()
+        return entries[:limit] if limit is not None else entries
+
+    def dump(self, path: str) -> int:
+        """把环形缓冲区写入 NDJSON 文件（先写临时文件再替换），返回写入的条数"""
+        entries = self.recent()
+        entries.reverse()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, path)
+        return len(entries)
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._offenders.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "capacity": self.capacity,
+                "buffered": len(self._recent),
+                "fingerprints": len(self._offenders),
+                "recorded": self.recorded,
+                "explain": self.explain,
+            }
@@ -0,0 +1,450 @@
+"""
+只读目录快照
+把商品与分类导出为带版本的二进制文件，由各工作进程以内存映射方式读取（同一文件的页面在进程间共享），
+目录读端点（/products、/products/{id}、/products/category/{id}、/categories）可直接由快照应答，不访问数据库。
+
+文件布局（小端）：
+
+    前缀        magic(8s) 格式版本(I) 目录长度(I)
+    目录        JSON：快照版本、生成时间、行数、各列与字符串堆的 [偏移, 字节数]（相对数据区起点）与数据区 CRC32
+    列          定宽 int64 列，8 字节对齐；空值记为 NULL（int64 最小值）
+    字符串堆    UTF-8 字节，字符串列以 (偏移, 长度) 两列引用，长度 -1 表示 NULL
+
+商品行按 product_id 升序存放，product.id 列即 ID 索引（二分查找）；product.by_listing 与 product.by_category
+为行号排列，分别对应 /products（created_at, product_id 降序）与 /products/category/{id}（product_name, product_id 升序）
+的分页顺序，分页游标与数据库查询的游标格式相同。商品名按码点排序，与 MySQL 排序规则下的顺序可能略有不同。
+
+发布新快照时先写临时文件再 os.replace，读者通过 SnapshotStore 发现文件变化后原子切换到新映射；
+旧映射在没有读者引用后由垃圾回收释放。
+
+    python snapshot.py build --host localhost --database test1 --user root --output catalog.snap
+    python snapshot.py info catalog.snap
+"""
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import argparse
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from code import CategoryService, DatabaseManager, ProductService, decode_cursor, keyset_page
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CATSNAP\x00"
+FORMAT_VERSION = 1
+PREFIX = struct.Struct("<8sII")
+NULL = -(2 ** 63)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+PRODUCT_COLUMNS = ("id", "category_id", "price_cents", "stock_quantity", "created_at", "updated_at",
+                   "name_off", "name_len", "desc_off", "desc_len")
+CATEGORY_COLUMNS = ("id", "parent_id", "created_at", "name_off", "name_len", "desc_off", "desc_len")
+
+
+class SnapshotError(Exception):
+    """快照文件格式错误或已损坏"""
+
+
+def _timestamp(value: Optional[datetime]) -> int:
+    return NULL if value is None else (value - EPOCH) // MICROSECOND
+
+
+def _datetime(value: int) -> Optional[datetime]:
+    return None if value == NULL else EPOCH + value * MICROSECOND
+
+
+def _int(value: Optional[int]) -> int:
+    return NULL if value is None else int(value)
+
+
+def _nullable(value: int) -> Optional[int]:
+    return None if value == NULL else value
+
+
+def _cents(price) -> int:
+    cents = Decimal(str(price)) * 100
+    if cents != cents.to_integral_value():
+        raise ValueError(f"价格超出两位小数: {price}")
+    return int(cents)
+
+
+class _Heap:
+    """字符串堆：相同字符串只存一份"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self._offsets = {}
+
+    def add(self, text: Optional[str]) -> Tuple[int, int]:
+        if text is None:
+            return 0, -1
+        offset = self._offsets.get(text)
+        encoded = text.encode("utf-8")
+        if offset is None:
+            offset = self._offsets[text] = len(self.data)
+            self.data += encoded
+        return offset, len(encoded)
+
+
+def write_snapshot(path: str, categories: Iterable[Dict[str, Any]], products: Iterable[Dict[str, Any]],
+                   version: int = None) -> Dict[str, Any]:
+    """写出快照文件（临时文件 + os.replace 原子发布），返回目录信息
+
+    categories/products 为服务层返回的字典行，version 默认取当前毫秒时间戳（单调递增即可）。
+    """
+    heap = _Heap()
+    category_rows = sorted(categories, key=lambda c: c["category_id"])
+    product_rows = sorted(products, key=lambda p: p["product_id"])
+
+    columns = {f"category.{name}": array.array("q") for name in CATEGORY_COLUMNS}
+    for category in category_rows:
+        name_off, name_len = heap.add(category["category_name"])
+        desc_off, desc_len = heap.add(category.get("description"))
+        for name, value in zip(CATEGORY_COLUMNS, (
+            category["category_id"], _int(category.get("parent_id")), _timestamp(category.get("created_at")),
+            name_off, name_len, desc_off, desc_len,
+        )):
+            columns[f"category.{name}"].append(value)
+    columns["category.by_name"] = array.array("q", sorted(
+        range(len(category_rows)), key=lambda i: (category_rows[i]["category_name"], category_rows[i]["category_id"])))
+
+    columns.update({f"product.{name}": array.array("q") for name in PRODUCT_COLUMNS})
+    for product in product_rows:
+        name_off, name_len = heap.add(product["product_name"])
+        desc_off, desc_len = heap.add(product.get("description"))
+        for name, value in zip(PRODUCT_COLUMNS, (
+            product["product_id"], _int(product.get("category_id")), _cents(product["price"]),
+            product["stock_quantity"], _timestamp(product.get("created_at")), _timestamp(product.get("updated_at")),
+            name_off, name_len, desc_off, desc_len,
+        )):
+            columns[f"product.{name}"].append(value)
+    rows = range(len(product_rows))
+    created = [_timestamp(p.get("created_at")) for p in product_rows]
+    columns["product.by_listing"] = array.array("q", sorted(
+        rows, key=lambda i: (created[i], product_rows[i]["product_id"]), reverse=True))
+    by_category = sorted(
+        (i for i in rows if product_rows[i].get("category_id") is not None),
+        key=lambda i: (product_rows[i]["category_id"], product_rows[i]["product_name"], product_rows[i]["product_id"]),
+    )
+    columns["product.by_category"] = array.array("q", by_category)
+    # 每个分类在 by_category 中的连续区间 (分类ID, 起点, 行数)，按分类ID升序
+    ranges = {name: array.array("q") for name in ("range.category_id", "range.start", "range.count")}
+    for position, row in enumerate(by_category):
+        category_id = product_rows[row]["category_id"]
+        if not ranges["range.category_id"] or ranges["range.category_id"][-1] != category_id:
+            ranges["range.category_id"].append(category_id)
+            ranges["range.start"].append(position)
+            ranges["range.count"].append(0)
+        ranges["range.count"][-1] += 1
+    columns.update(ranges)
+
+    layout, offset = {}, 0
+    for name, values in columns.items():
+        layout[name] = [offset, len(values) * 8]
+        offset += len(values) * 8
+    body = b"".join(values.tobytes() for values in columns.values()) + bytes(heap.data)
+    directory = {
+        "version": version if version is not None else int(time.time() * 1000),
+        "created_at": datetime.now().isoformat(),
+        "products": len(product_rows),
+        "categories": len(category_rows),
+        "columns": layout,
+        "heap": [offset, len(heap.data)],
+        "crc32": zlib.crc32(body),
+    }
+    encoded = json.dumps(directory, ensure_ascii=False).encode("utf-8")
+    # 数据区从 8 字节边界开始，目录中的偏移相对数据区起点
+    padding = -(PREFIX.size + len(encoded)) % 8
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        f.write(b" " * padding)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"目录快照已发布: {path} 版本 {directory['version']}（{len(product_rows)} 个商品，{len(category_rows)} 个分类）")
+    return {key: directory[key] for key in ("version", "created_at", "products", "categories")}
+
+
+def build_snapshot(product_service: ProductService, category_service: CategoryService, path: str,
+                   version: int = None) -> Dict[str, Any]:
+    """从服务层导出商品与分类并发布快照；商品以流式游标读取，应使用未绑定会话的服务"""
+    categories = category_service.get_all_categories()
+    return write_snapshot(path, categories, product_service.iter_products(), version)
+
+
+class CatalogSnapshot:
+    """内存映射的快照读者；所有读取都直接解码映射中的列，不把整份目录载入堆内存"""
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, fmt, directory_len = PREFIX.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise SnapshotError(f"不是目录快照文件: {path}")
+            if fmt != FORMAT_VERSION:
+                raise SnapshotError(f"不支持的快照格式版本: {fmt}")
+            directory = json.loads(self._mmap[PREFIX.size:PREFIX.size + directory_len])
+            data_start = PREFIX.size + directory_len + (-(PREFIX.size + directory_len) % 8)
+            heap_offset, heap_len = directory["heap"]
+            heap_offset += data_start
+            if heap_offset + heap_len != len(self._mmap):
+                raise SnapshotError(f"快照文件长度不符: {path}")
+            if verify and zlib.crc32(self._mmap[data_start:]) != directory["crc32"]:
+                raise SnapshotError(f"快照校验失败: {path}")
+        except (struct.error, ValueError, KeyError) as e:
+            self._mmap.close()
+            raise SnapshotError(f"快照文件已损坏: {path}: {e}") from e
+        except SnapshotError:
+            self._mmap.close()
+            raise
+        self.version = directory["version"]
+        self.created_at = directory["created_at"]
+        self.product_count = directory["products"]
+        self.category_count = directory["categories"]
+        view = memoryview(self._mmap)
+        self._views = [view]
+        self._columns = {}
+        for name, (offset, length) in directory["columns"].items():
+            column = view[data_start + offset:data_start + offset + length].cast("q")
+            self._views.append(column)
+            self._columns[name] = column
+        self._heap = view[heap_offset:heap_offset + heap_len]
+        self._views.append(self._heap)
+        self._p = {name: self._columns[f"product.{name}"] for name in PRODUCT_COLUMNS}
+        self._c = {name: self._columns[f"category.{name}"] for name in CATEGORY_COLUMNS}
+        # 分类数量小，商品行中的 category_name 查找用字典
+        self._category_names = {
+            self._c["id"][row]: self._string(self._c["name_off"][row], self._c["name_len"][row])
+            for row in range(self.category_count)
+        }
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if length < 0:
+            return None
+        return str(self._heap[offset:offset + length], "utf-8")
+
+    @staticmethod
+    def _find(ids, key: int) -> Optional[int]:
+        row = bisect_right(ids, key) - 1
+        return row if row >= 0 and ids[row] == key else None
+
+    def _product(self, row: int) -> Dict[str, Any]:
+        p = self._p
+        category_id = _nullable(p["category_id"][row])
+        return {
+            "product_id": p["id"][row],
+            "product_name": self._string(p["name_off"][row], p["name_len"][row]),
+            "description": self._string(p["desc_off"][row], p["desc_len"][row]),
+            "price": Decimal(p["price_cents"][row]).scaleb(-2),
+            "stock_quantity": p["stock_quantity"][row],
+            "category_id": category_id,
+            "created_at": _datetime(p["created_at"][row]),
+            "updated_at": _datetime(p["updated_at"][row]),
+            "category_name": self._category_names.get(category_id),
+        }
+
+    def _category(self, row: int) -> Dict[str, Any]:
+        c = self._c
+        return {
+            "category_id": c["id"][row],
+            "category_name": self._string(c["name_off"][row], c["name_len"][row]),
+            "parent_id": _nullable(c["parent_id"][row]),
+            "description": self._string(c["desc_off"][row], c["desc_len"][row]),
+            "created_at": _datetime(c["created_at"][row]),
+        }
+
+    def product(self, product_id: int) -> Optional[Dict[str, Any]]:
+        row = self._find(self._p["id"], product_id)
+        return self._product(row) if row is not None else None
+
+    def products_by_ids(self, product_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取，返回 {商品ID: 商品}，快照中不存在的ID不出现在结果中"""
+        ids = self._p["id"]
+        rows = ((product_id, self._find(ids, product_id)) for product_id in product_ids)
+        return {product_id: self._product(row) for product_id, row in rows if row is not None}
+
+    def _page(self, order, start: int, end: int, position: int, limit: int,
+              columns: Tuple[str, ...]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        rows = [self._product(row) for row in order[position:min(position + limit + 1, end)]]
+        return keyset_page(rows, limit, columns)
+
+    def products_page(self, limit: int, cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """与 ProductService.get_products_page 相同的顺序与游标：(created_at, product_id) 降序"""
+        order, p = self._columns["product.by_listing"], self._p
+        position = 0
+        if cursor:
+            created_at, product_id = self._cursor_values(cursor)
+            target = (-_timestamp(created_at), -product_id)
+            position = bisect_right(order, target, key=lambda row: (-p["created_at"][row], -p["id"][row]))
+        return self._page(order, 0, len(order), position, limit, ProductService.PRODUCT_PAGE_KEYS)
+
+    def products_by_category_page(self, category_id: int, limit: int,
+                                  cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """与 ProductService.get_products_by_category_page 相同的顺序与游标：(product_name, product_id) 升序"""
+        range_row = self._find(self._columns["range.category_id"], category_id)
+        if range_row is None:
+            return [], None
+        start = self._columns["range.start"][range_row]
+        end = start + self._columns["range.count"][range_row]
+        order, p = self._columns["product.by_category"], self._p
+        position = start
+        if cursor:
+            name, product_id = self._cursor_values(cursor)
+            position = bisect_right(order, (name, product_id), lo=start, hi=end,
+                                    key=lambda row: (self._string(p["name_off"][row], p["name_len"][row]), p["id"][row]))
+        return self._page(order, start, end, position, limit, ProductService.CATEGORY_PRODUCT_PAGE_KEYS)
+
+    @staticmethod
+    def _cursor_values(cursor: str) -> list:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise ValueError(f"无效的分页游标: {cursor}")
+        return values
+
+    def category(self, category_id: int) -> Optional[Dict[str, Any]]:
+        row = self._find(self._c["id"], category_id)
+        return self._category(row) if row is not None else None
+
+    def categories(self) -> List[Dict[str, Any]]:
+        """所有分类，按 category_name 排序（与 CategoryService.get_all_categories 相同）"""
+        return [self._category(row) for row in self._columns["category.by_name"]]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "version": self.version,
+            "created_at": self.created_at,
+            "products": self.product_count,
+            "categories": self.category_count,
+            "bytes": len(self._mmap),
+        }
+
+    def close(self):
+        """释放映射；仍有其他线程在读时不要调用，交给垃圾回收即可"""
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+
+class SnapshotStore:
+    """当前快照的持有者
+
+    current() 每 check_interval 秒最多检查一次文件（inode、修改时间与大小），发现新文件时加载并原子切换引用；
+    新文件损坏或无法加载时记录警告并继续使用旧快照。文件不存在时返回 None，调用方退回数据库。
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0, verify: bool = True):
+        self.path = path
+        self.check_interval = check_interval
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._file_key = None
+        self._next_check = 0.0
+        self.swaps = 0
+        self.load_failures = 0
+        self.last_error = None
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        """当前快照，不检查文件"""
+        return self._snapshot
+
+    def needs_check(self) -> bool:
+        return time.monotonic() >= self._next_check
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        if self.needs_check():
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> Optional[CatalogSnapshot]:
+        """立即检查文件并在变化时切换，返回当前快照"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return self._snapshot
+            file_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if file_key == self._file_key:
+                return self._snapshot
+            try:
+                snapshot = CatalogSnapshot(self.path, self.verify)
+            except (OSError, SnapshotError) as e:
+                self.load_failures += 1
+                self.last_error = str(e)
+                logger.warning(f"目录快照加载失败，继续使用旧快照: {e}")
+                return self._snapshot
+            self._file_key = file_key
+            previous, self._snapshot = self._snapshot, snapshot
+            self.swaps += 1
+            logger.info(f"目录快照切换: {previous.version if previous else None} -> {snapshot.version}")
+            return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot else None,
+            "created_at": snapshot.created_at if snapshot else None,
+            "products": snapshot.product_count if snapshot else 0,
+            "categories": snapshot.category_count if snapshot else 0,
+            "swaps": self.swaps,
+            "load_failures": self.load_failures,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="只读目录快照")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="从数据库导出并发布快照")
+    build.add_argument("--host", default="localhost")
+    build.add_argument("--port", type=int, default=3306)
+    build.add_argument("--database", default="test1")
+    build.add_argument("--user", default="root")
+    build.add_argument("--password", default="")
+    build.add_argument("--output", default="catalog.snap")
+    build.add_argument("--version", type=int, help="快照版本，默认取当前毫秒时间戳")
+    info = commands.add_parser("info", help="查看快照信息并校验")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        snapshot = CatalogSnapshot(args.path)
+        print(json.dumps(snapshot.info(), ensure_ascii=False, indent=2))
+        return
+
+    db = DatabaseManager(host=args.host, port=args.port, database=args.database,
+                         user=args.user, password=args.password)
+    db.connect()
+    try:
+        result = build_snapshot(ProductService(db), CategoryService(db), args.output, args.version)
+    finally:
+        db.disconnect()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,139 @@
+"""
+实体缓存的行为测试：各写路径提交后失效对应的缓存项（分类按标签连带失效商品），回滚不失效，
+查库与回填之间落地的失效不被旧值覆盖；进程内与共享两种后端各跑一遍
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_cache_invalidation.py
+"""
+
+import pytest
+
+import local_db
+from cache import LRUCache, LocalStore, SharedStoreCache
+from code import DatabaseManager, ECommerceService, read_through
+
+ITEM_PRICE = 10
+
+
+@pytest.fixture(params=["memory", "shared"])
+def cache(request):
+    return LRUCache() if request.param == "memory" else SharedStoreCache(LocalStore())
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = local_db.LocalDatabase(str(tmp_path / "cache.sqlite3"))
+    database.seed(users=3, categories=2, products=0, orders=0)
+    manager = DatabaseManager(connector=database.connect, pool_size=2, slow_query_ms=None)
+    manager.connect()
+    yield manager
+    manager.disconnect()
+
+
+@pytest.fixture
+def service(db, cache):
+    return ECommerceService(db, cache)
+
+
+@pytest.fixture
+def products(service):
+    """分类 1 下两个商品、分类 2 下一个商品，均已读入缓存"""
+    ids = [service.product_service.create_product(f"商品 {i}", ITEM_PRICE, category_id, stock_quantity=10)
+           for i, category_id in enumerate([1, 1, 2])]
+    for product_id in ids:
+        service.product_service.get_product_by_id(product_id)
+    return ids
+
+
+def test_user_writes_invalidate(service, cache):
+    users = service.user_service
+    users.get_user_by_id(1)
+    users.update_user(1, full_name="新名字")
+    assert cache.get("user:1") is None
+    assert users.get_user_by_id(1)['full_name'] == "新名字"
+
+    users.change_password(1, "y" * 60)
+    assert cache.get("user:1") is None
+    users.get_user_by_id(1)
+
+    users.delete_user(1)
+    assert cache.get("user:1") is None
+    assert users.get_user_by_id(1) is None
+
+
+def test_cached_user_has_no_password(service, cache):
+    service.user_service.get_user_by_id(2)
+    service.user_service.get_users_by_ids([3])
+    assert 'password' not in cache.get("user:2")
+    assert 'password' not in cache.get("user:3")
+
+
+@pytest.mark.parametrize("write", [
+    lambda products, product_id: products.update_product(product_id, product_name="改名"),
+    lambda products, product_id: products.update_stock(product_id, 3),
+    lambda products, product_id: products.adjust_stock(product_id, -2),
+    lambda products, product_id: products.delete_product(product_id),
+])
+def test_product_writes_invalidate(service, cache, products, write):
+    write(service.product_service, products[0])
+    assert cache.get(f"product:{products[0]}") is None
+    assert cache.get(f"product:{products[1]}") is not None
+    row = service.product_service.get_product_by_id(products[0])
+    fresh = service.db.fetch_one("SELECT * FROM products WHERE product_id = %s", (products[0],))
+    assert (row and row['stock_quantity']) == (fresh and fresh['stock_quantity'])
+
+
+def test_category_writes_invalidate_tagged_products(service, cache, products):
+    categories = service.category_service
+    categories.get_category_by_id(1)
+    categories.update_category(1, category_name="新分类名")
+    assert cache.get("category:1") is None
+    assert cache.get(f"product:{products[0]}") is None
+    assert cache.get(f"product:{products[1]}") is None
+    assert cache.get(f"product:{products[2]}") is not None
+    assert service.product_service.get_product_by_id(products[0])['category_name'] == "新分类名"
+
+    categories.delete_category(2)
+    assert cache.get(f"product:{products[2]}") is None
+
+
+def test_order_writes_invalidate_reserved_products(service, cache, products):
+    items = [{"product_id": products[0], "quantity": 2, "unit_price": ITEM_PRICE}]
+    order_id = service.place_order(1, items, "地址")
+    assert cache.get(f"product:{products[0]}") is None
+    assert cache.get(f"product:{products[1]}") is not None
+    assert service.product_service.get_product_by_id(products[0])['stock_quantity'] == 8
+
+    service.update_order_status(order_id, 'cancelled')
+    assert cache.get(f"product:{products[0]}") is None
+    assert service.product_service.get_product_by_id(products[0])['stock_quantity'] == 10
+
+
+def test_invalidation_waits_for_commit(service, cache, products):
+    with service.db.transaction():
+        service.product_service.update_stock(products[0], 1)
+        assert cache.get(f"product:{products[0]}")['stock_quantity'] == 10
+    assert cache.get(f"product:{products[0]}") is None
+
+
+def test_rollback_keeps_cache(service, cache, products):
+    with pytest.raises(ValueError):
+        with service.db.transaction():
+            service.product_service.update_stock(products[0], 1)
+            raise ValueError("rolled back")
+    assert cache.get(f"product:{products[0]}")['stock_quantity'] == 10
+    assert service.product_service.get_product_by_id(products[0])['stock_quantity'] == 10
+
+
+def test_fill_racing_an_invalidation_is_dropped(service, cache, products):
+    product_id = products[0]
+    cache.delete(f"product:{product_id}")
+
+    def load():
+        row = service.product_service._fetch_product_by_id(product_id)
+        # 查库之后、回填之前另一请求提交了写入
+        service.product_service.update_stock(product_id, 1)
+        return row
+
+    stale = read_through(cache, f"product:{product_id}", load)
+    assert stale['stock_quantity'] == 10
+    assert cache.get(f"product:{product_id}") is None
+    assert service.product_service.get_product_by_id(product_id)['stock_quantity'] == 1
@@ -0,0 +1,119 @@
+"""
+分类树索引的行为测试：经 CategoryService 新增、改名、移动、删除分类后，增量维护的子树与面包屑
+与整表重载的结果一致；拒绝把分类移动到自身或其子分类下
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_category_tree.py
+"""
+
+import pytest
+
+import local_db
+from category_tree import CategoryTreeIndex
+from code import CategoryService, DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = local_db.LocalDatabase(str(tmp_path / "tree.sqlite3"))
+    manager = DatabaseManager(connector=database.connect, pool_size=2, slow_query_ms=None)
+    manager.connect()
+    yield manager
+    manager.disconnect()
+
+
+@pytest.fixture
+def categories(db):
+    return CategoryService(db)
+
+
+@pytest.fixture
+def ids(categories):
+    ids = {}
+    # 数码 ─ 手机 ─ 智能手机；数码 ─ 电脑；服装
+    for name, parent in [("数码", None), ("手机", "数码"), ("智能手机", "手机"), ("电脑", "数码"), ("服装", None)]:
+        ids[name] = categories.create_category(name, ids.get(parent))
+    # 先加载，其后的写入走增量维护
+    categories.get_category_tree()
+    return ids
+
+
+def shape(nodes):
+    return [(node['category_id'], node['category_name'], shape(node['children'])) for node in nodes]
+
+
+def assert_matches_reload(service, ids):
+    """增量维护的索引与由数据库整表重载的索引一致"""
+    fresh = CategoryTreeIndex()
+    fresh.load(service.get_all_categories())
+    assert shape(service.get_category_tree()) == shape(fresh.tree())
+    for category_id in ids.values():
+        if fresh.get(category_id) is None:
+            continue
+        assert service.get_descendant_ids(category_id) == fresh.descendant_ids(category_id)
+        assert ([row['category_id'] for row in service.get_category_breadcrumbs(category_id)]
+                == [row['category_id'] for row in fresh.ancestors(category_id)])
+
+
+def test_create_extends_subtree(categories, ids):
+    ids["功能机"] = categories.create_category("功能机", ids["手机"])
+    assert categories.get_descendant_ids(ids["数码"]) == [
+        ids["数码"], ids["手机"], ids["功能机"], ids["智能手机"], ids["电脑"]]
+    assert [row['category_name'] for row in categories.get_category_breadcrumbs(ids["功能机"])] == [
+        "数码", "手机", "功能机"]
+    assert_matches_reload(categories, ids)
+
+
+def test_rename_reorders_siblings(categories, ids):
+    categories.update_category(ids["电脑"], category_name="一体机")
+    assert [node['category_id'] for node in categories.get_category_tree(ids["数码"])[0]['children']] == [
+        ids["电脑"], ids["手机"]]
+    assert categories.get_category_breadcrumbs(ids["电脑"])[-1]['category_name'] == "一体机"
+    assert_matches_reload(categories, ids)
+
+
+def test_move_carries_subtree(categories, ids):
+    categories.update_category(ids["手机"], parent_id=ids["服装"])
+    assert categories.get_descendant_ids(ids["数码"]) == [ids["数码"], ids["电脑"]]
+    assert categories.get_descendant_ids(ids["服装"]) == [ids["服装"], ids["手机"], ids["智能手机"]]
+    assert [row['category_id'] for row in categories.get_category_breadcrumbs(ids["智能手机"])] == [
+        ids["服装"], ids["手机"], ids["智能手机"]]
+    assert_matches_reload(categories, ids)
+
+    categories.update_category(ids["手机"], parent_id=None)
+    assert categories.get_category_breadcrumbs(ids["智能手机"])[0]['category_id'] == ids["手机"]
+    assert_matches_reload(categories, ids)
+
+
+@pytest.mark.parametrize("target", ["数码", "手机", "智能手机"])
+def test_move_into_own_subtree_is_rejected(categories, ids, target):
+    with pytest.raises(ValueError):
+        categories.update_category(ids["数码"], parent_id=ids[target])
+    assert categories.get_category_by_id(ids["数码"])['parent_id'] is None
+    assert_matches_reload(categories, ids)
+
+
+def test_delete_leaf(categories, ids):
+    categories.delete_category(ids["智能手机"])
+    assert categories.get_descendant_ids(ids["数码"]) == [ids["数码"], ids["手机"], ids["电脑"]]
+    assert categories.get_descendant_ids(ids["智能手机"]) == []
+    assert categories.get_category_breadcrumbs(ids["智能手机"]) == []
+    assert_matches_reload(categories, ids)
+
+
+def test_delete_inner_node_lifts_children_to_root(categories, ids):
+    categories.delete_category(ids["手机"])
+    # 与外键 ON DELETE SET NULL 一致：子分类成为一级分类，其子树保持不变
+    assert [node['category_id'] for node in categories.get_category_tree()] == [
+        ids["数码"], ids["智能手机"], ids["服装"]]
+    assert categories.get_descendant_ids(ids["数码"]) == [ids["数码"], ids["电脑"]]
+    assert [row['category_id'] for row in categories.get_category_breadcrumbs(ids["智能手机"])] == [
+        ids["智能手机"]]
+
+
+def test_rolled_back_write_leaves_index_unchanged(categories, ids):
+    with pytest.raises(RuntimeError):
+        with categories.db.transaction():
+            categories.update_category(ids["手机"], parent_id=ids["服装"])
+            categories.create_category("童装", ids["服装"])
+            raise RuntimeError("rolled back")
+    assert categories.get_descendant_ids(ids["服装"]) == [ids["服装"]]
+    assert_matches_reload(categories, ids)
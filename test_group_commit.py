@@ -0,0 +1,137 @@
+"""
+订单组提交的行为测试：同一批中单个订单失败只回滚该订单（保存点），其余订单照常提交；
+批事务整体失效时逐单重试且每单只提交一次；COMMIT 本身失败时不重试；队列满时拒绝
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_group_commit.py
+"""
+
+from mysql.connector import errors
+import pytest
+
+import local_db
+from code import DatabaseManager, ECommerceService
+from group_commit import CommitUnknownError, GroupCommitQueue, QueueFullError
+from inventory import InsufficientStockError, StockLedger
+
+STOCK = 10
+
+
+class FlakyConnection(local_db.LocalConnection):
+    """可按需让下一条订单插入死锁、让下一次 COMMIT 在提交后报连接断开的连接"""
+
+    deadlock_next_order = False
+    lose_next_commit = False
+
+    def cursor(self, dictionary: bool = False, prepared: bool = False, buffered=None):
+        cursor = super().cursor(dictionary)
+        execute = cursor.execute
+
+        def flaky(query, params=()):
+            if "INSERT INTO orders" in query and FlakyConnection.deadlock_next_order:
+                FlakyConnection.deadlock_next_order = False
+                raise errors.DatabaseError(msg="Deadlock found when trying to get lock", errno=1213)
+            return execute(query, params)
+
+        cursor.execute = flaky
+        return cursor
+
+    def commit(self):
+        super().commit()
+        if FlakyConnection.lose_next_commit:
+            FlakyConnection.lose_next_commit = False
+            raise errors.OperationalError(msg="Lost connection to MySQL server during query", errno=2013)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "batch.sqlite3")
+    local_db.LocalDatabase(path).seed(users=3, categories=1, products=2, orders=0)
+    manager = DatabaseManager(connector=lambda **_: FlakyConnection(path, 5.0),
+                              pool_size=2, slow_query_ms=None)
+    manager.connect()
+    manager.execute_query("UPDATE products SET stock_quantity = %s", (STOCK,))
+    yield manager
+    FlakyConnection.deadlock_next_order = False
+    FlakyConnection.lose_next_commit = False
+    manager.disconnect()
+
+
+def order(db, product_id, quantity):
+    price = db.fetch_one("SELECT price FROM products WHERE product_id = %s", (product_id,))['price']
+    return {"user_id": 1, "items": [{"product_id": product_id, "quantity": quantity, "unit_price": price}],
+            "shipping_address": "地址"}
+
+
+def run_batch(service, orders):
+    """先入队再启动工作线程，所有订单落在同一批中"""
+    queue = GroupCommitQueue(service, max_batch=len(orders), max_wait_ms=50)
+    futures = [queue.submit(**o) for o in orders]
+    queue.start()
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result(timeout=10))
+        except Exception as e:
+            outcomes.append(e)
+    queue.stop()
+    return queue, outcomes
+
+
+def count(db, table):
+    return db.fetch_one(f"SELECT COUNT(*) AS n FROM {table}")['n']
+
+
+def stock(db, product_id):
+    return db.fetch_one("SELECT stock_quantity FROM products WHERE product_id = %s", (product_id,))['stock_quantity']
+
+
+@pytest.mark.parametrize("use_ledger", [False, True], ids=["direct", "leased"])
+def test_failed_order_does_not_affect_its_batch(db, use_ledger):
+    ledger = StockLedger(lease_size=4, hot_threshold=0, hot_products=[1]) if use_ledger else None
+    service = ECommerceService(db, stock_ledger=ledger)
+    service.inventory_service.reconcile_leases()
+    orders = [order(db, 1, 3), order(db, 2, 2), order(db, 1, STOCK), order(db, 2, 1)]
+    queue, outcomes = run_batch(service, orders)
+
+    assert queue.stats()['batches'] == 1
+    assert isinstance(outcomes[2], InsufficientStockError)
+    placed = [outcome for i, outcome in enumerate(outcomes) if i != 2]
+    assert all(isinstance(order_id, int) for order_id in placed)
+    assert sorted(row['order_id'] for row in db.fetch_all("SELECT order_id FROM orders")) == sorted(placed)
+    assert count(db, "order_items") == 3
+    # 失败订单已预留的件数随其保存点退回
+    service.inventory_service.return_leases(idle_only=False)
+    assert (stock(db, 1), stock(db, 2)) == (STOCK - 3, STOCK - 3)
+
+
+def test_aborted_batch_is_retried_order_by_order(db):
+    service = ECommerceService(db)
+    orders = [order(db, 1, 1), order(db, 2, 1), order(db, 1, 1)]
+    FlakyConnection.deadlock_next_order = True
+    queue, outcomes = run_batch(service, orders)
+
+    # 死锁使整个批事务失效，不能只回滚该单的保存点：整批回滚后逐单重试
+    assert queue.stats()['fallbacks'] == 1
+    assert all(isinstance(order_id, int) for order_id in outcomes)
+    assert count(db, "orders") == 3
+    assert (stock(db, 1), stock(db, 2)) == (STOCK - 2, STOCK - 1)
+
+
+def test_failed_commit_is_not_retried(db):
+    service = ECommerceService(db)
+    orders = [order(db, 1, 1), order(db, 2, 1)]
+    FlakyConnection.lose_next_commit = True
+    queue, outcomes = run_batch(service, orders)
+
+    assert all(isinstance(outcome, CommitUnknownError) for outcome in outcomes)
+    assert queue.stats()['fallbacks'] == 0
+    # 本例中 COMMIT 实际已生效，重试会重复下单
+    assert count(db, "orders") == 2
+
+
+def test_full_queue_rejects(db):
+    queue = GroupCommitQueue(ECommerceService(db), max_queue=2)
+    queue.submit(**order(db, 1, 1))
+    queue.submit(**order(db, 1, 1))
+    with pytest.raises(QueueFullError):
+        queue.submit(**order(db, 1, 1))
+    assert queue.stats()['rejected'] == 1
@@ -0,0 +1,152 @@
+"""
+库存预留的行为测试：多线程并发下单不超卖（直接扣减与进程内租约两种路径），失败的订单不占用库存，
+stock_leases 表与租约余量一致，失联进程遗留的租约被回收、件数加回库存
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_inventory.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import local_db
+from code import DatabaseManager, ECommerceService
+from inventory import InsufficientStockError, StockLedger
+
+STOCK = 30
+PRODUCT = 1
+OTHER = 2
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = local_db.LocalDatabase(str(tmp_path / "stock.sqlite3"), busy_timeout=5)
+    database.seed(users=3, categories=1, products=2, orders=0)
+    manager = DatabaseManager(connector=database.connect, pool_size=4, slow_query_ms=None)
+    manager.connect()
+    manager.execute_query("UPDATE products SET stock_quantity = %s", (STOCK,))
+    yield manager
+    manager.disconnect()
+
+
+def make_ledger(**kwargs):
+    return StockLedger(**{"lease_size": 7, "hot_threshold": 0, "idle_release": 60,
+                          "hot_products": [PRODUCT], **kwargs})
+
+
+def make_service(db, ledger=None):
+    service = ECommerceService(db, stock_ledger=ledger)
+    if ledger is not None:
+        service.inventory_service.reconcile_leases()
+    return service
+
+
+def line(db, product_id, quantity):
+    price = db.fetch_one("SELECT price FROM products WHERE product_id = %s", (product_id,))['price']
+    return {"product_id": product_id, "quantity": quantity, "unit_price": price}
+
+
+def stock(db, product_id=PRODUCT):
+    return db.fetch_one("SELECT stock_quantity FROM products WHERE product_id = %s", (product_id,))['stock_quantity']
+
+
+def leased(db, product_id=PRODUCT):
+    return sum(row['units'] for row in db.fetch_all(
+        "SELECT units FROM stock_leases WHERE product_id = %s", (product_id,)))
+
+
+def ordered(db, product_id=PRODUCT):
+    row = db.fetch_one("SELECT COALESCE(SUM(quantity), 0) AS total FROM order_items WHERE product_id = %s",
+                       (product_id,))
+    return row['total']
+
+
+@pytest.mark.parametrize("use_ledger", [False, True], ids=["direct", "leased"])
+def test_concurrent_orders_never_oversell(db, use_ledger):
+    ledger = make_ledger() if use_ledger else None
+    service = make_service(db, ledger)
+    item = line(db, PRODUCT, 2)
+    sold, errors = [], []
+
+    def buyer():
+        for _ in range(10):
+            try:
+                service.place_order(1, [dict(item)], "地址")
+                sold.append(2)
+            except InsufficientStockError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=buyer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # 4 个线程共要买 80 件，只有 30 件：恰好卖完，不多卖
+    assert sum(sold) == ordered(db) == STOCK
+    assert stock(db) >= 0
+    assert stock(db) + leased(db) + sum(sold) == STOCK
+    if ledger is not None:
+        assert leased(db) == ledger.available(PRODUCT)
+
+
+def test_failed_order_keeps_stock(db):
+    ledger = make_ledger()
+    service = make_service(db, ledger)
+    service.place_order(1, [line(db, PRODUCT, 2)], "地址")
+    before = (stock(db), ledger.available(PRODUCT), leased(db), stock(db, OTHER))
+    with pytest.raises(InsufficientStockError) as excinfo:
+        service.place_order(1, [line(db, PRODUCT, 3), line(db, OTHER, STOCK + 1)], "地址")
+    assert excinfo.value.shortages == {OTHER: (STOCK + 1, STOCK)}
+    assert (stock(db), ledger.available(PRODUCT), leased(db), stock(db, OTHER)) == before
+
+
+def test_returned_leases_restore_stock(db):
+    ledger = make_ledger()
+    service = make_service(db, ledger)
+    for _ in range(4):
+        service.place_order(1, [line(db, PRODUCT, 2)], "地址")
+    assert leased(db) == ledger.available(PRODUCT) > 0
+
+    service.inventory_service.return_leases(idle_only=False)
+    assert ledger.available(PRODUCT) == leased(db) == 0
+    assert stock(db) == STOCK - 8
+
+
+def test_cancel_releases_leased_stock(db):
+    ledger = make_ledger()
+    service = make_service(db, ledger)
+    order_id = service.place_order(1, [line(db, PRODUCT, 5)], "地址")
+    service.update_order_status(order_id, 'cancelled')
+    service.inventory_service.return_leases(idle_only=False)
+    assert stock(db) == STOCK
+    assert leased(db) == 0
+
+
+def test_stale_leases_of_a_lost_process_are_reclaimed(db):
+    crashed = make_ledger(stale_after=1)
+    service = make_service(db, crashed)
+    for _ in range(3):
+        service.place_order(1, [line(db, PRODUCT, 2)], "地址")
+    left_over = crashed.available(PRODUCT)
+    assert left_over > 0
+
+    # 续期时间按秒记录，等待超过 stale_after 一整秒
+    time.sleep(2.1)
+    # 重启后的进程启动时回收
+    restarted = ECommerceService(db, stock_ledger=make_ledger(stale_after=1))
+    reclaimed = restarted.inventory_service.reconcile_leases()
+    assert reclaimed == left_over
+    assert leased(db) == 0
+    assert stock(db) == STOCK - 6
+
+
+def test_live_leases_are_not_reclaimed(db):
+    owner = make_ledger()
+    make_service(db, owner).place_order(1, [line(db, PRODUCT, 2)], "地址")
+    other = make_service(db, make_ledger())
+    assert other.inventory_service.reclaim_stale_leases() == 0
+    assert leased(db) == owner.available(PRODUCT) > 0
@@ -0,0 +1,109 @@
+"""
+键集分页的行为测试：游标编解码往返、排序键相同时按主键断开、翻页期间插入新行不重复不遗漏
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_pagination.py
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import local_db
+from code import DatabaseManager, ECommerceService, decode_cursor, encode_cursor, keyset_condition
+from rows import to_dicts
+
+SIGNUP = datetime(2024, 3, 1, 12, 0, 0)
+INSERT_USER = "INSERT INTO users (username, email, password, created_at) VALUES (%s, %s, 'x', %s)"
+INSERT_PRODUCT = "INSERT INTO products (product_name, price, stock_quantity, category_id) VALUES (%s, 1, 1, %s)"
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = local_db.LocalDatabase(str(tmp_path / "pages.sqlite3"))
+    manager = DatabaseManager(connector=database.connect, pool_size=2, slow_query_ms=None)
+    manager.connect()
+    yield manager
+    manager.disconnect()
+
+
+@pytest.fixture
+def service(db):
+    return ECommerceService(db)
+
+
+def add_user(db, name, created_at):
+    return db.execute_insert(INSERT_USER, (name, f"{name}@example.com", created_at))
+
+
+def walk(fetch_page, limit):
+    """逐页取完，返回 (全部行, 页数)"""
+    rows, pages, cursor = [], 0, None
+    while True:
+        page, cursor = fetch_page(limit, cursor)
+        rows.extend(to_dicts(page))
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+
+def test_cursor_round_trip():
+    values = (datetime(2024, 5, 6, 7, 8, 9, 123456), date(2024, 5, 6), Decimal("19.90"), 42, "商品 7", None)
+    cursor = encode_cursor(values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == list(values)
+
+
+@pytest.mark.parametrize("cursor", ["!!!", encode_cursor((1, 2))[:-3] + "$", "eyJhIjoxfQ"])
+def test_malformed_cursor_is_rejected(service, cursor):
+    with pytest.raises(ValueError):
+        service.user_service.get_users_page(10, cursor)
+
+
+def test_cursor_with_wrong_arity_is_rejected():
+    with pytest.raises(ValueError):
+        keyset_condition(("created_at", "user_id"), encode_cursor((SIGNUP,)), descending=True)
+
+
+@pytest.mark.parametrize("row_format", ["dict", "tuple", "slots"])
+def test_equal_sort_keys_are_broken_by_id(db, service, row_format):
+    # 7 个用户注册时间相同，页边界落在相同时间的行中间
+    ids = [add_user(db, f"tie{i}", SIGNUP) for i in range(7)]
+    ids += [add_user(db, f"early{i}", SIGNUP - timedelta(days=i + 1)) for i in range(3)]
+    rows, pages = walk(lambda limit, cursor: service.user_service.get_users_page(limit, cursor, row_format), 3)
+    expected = sorted(ids[:7], reverse=True) + ids[7:]
+    assert [row['user_id'] for row in rows] == expected
+    assert pages == 4
+
+
+def test_last_full_page_has_no_cursor(db, service):
+    for i in range(4):
+        add_user(db, f"u{i}", SIGNUP + timedelta(minutes=i))
+    page, cursor = service.user_service.get_users_page(4)
+    assert len(page) == 4 and cursor is None
+
+
+def test_rows_inserted_while_paging_do_not_shift_pages(db, service):
+    ids = [add_user(db, f"u{i}", SIGNUP + timedelta(minutes=i)) for i in range(6)]
+    seen, cursor = [], None
+    while True:
+        page, cursor = service.user_service.get_users_page(2, cursor)
+        seen.extend(row['user_id'] for row in page)
+        if len(seen) == 2:
+            # 第一页之后插入更新的行与排序键相同的行：已翻过的位置不受影响
+            add_user(db, "newest", SIGNUP + timedelta(days=1))
+            add_user(db, "tied", SIGNUP + timedelta(minutes=4))
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen))
+    assert seen[:2] == [ids[5], ids[4]]
+    assert set(ids) <= set(seen)
+
+
+def test_category_pages_order_by_name_then_id(db, service):
+    category_id = db.execute_insert("INSERT INTO categories (category_name) VALUES ('c')")
+    other = db.execute_insert("INSERT INTO categories (category_name) VALUES ('other')")
+    ids = [db.execute_insert(INSERT_PRODUCT, (name, category_id)) for name in ["b", "a", "b", "a", "b"]]
+    db.execute_insert(INSERT_PRODUCT, ("a", other))
+    rows, _ = walk(lambda limit, cursor: service.product_service.get_products_by_category_page(
+        category_id, limit, cursor), 2)
+    assert [row['product_id'] for row in rows] == [ids[1], ids[3], ids[0], ids[2], ids[4]]
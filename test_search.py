@@ -0,0 +1,154 @@
+"""
+商品检索的行为测试：经 ProductService 新增、修改、删除商品以及大量更新触发压缩后，增量维护的倒排索引
+与由数据库整表重建的索引排序、得分、命中总数一致；按偏移翻页不重复不遗漏
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_search.py
+"""
+
+import pytest
+
+import local_db
+from code import DatabaseManager, ProductService
+from search import ProductSearchIndex, tokenize
+
+CATALOGUE = [
+    ("华为智能手机", "麒麟芯片 5G 智能手机"),
+    ("小米智能手机", "高通芯片，长续航"),
+    ("苹果 iPhone 15", "A16 芯片 智能手机"),
+    ("联想笔记本电脑", "轻薄办公，长续航"),
+    ("机械键盘", "青轴，适配笔记本电脑"),
+    ("蓝牙耳机", "降噪，支持手机与电脑"),
+    ("手机壳", None),
+]
+QUERIES = ["智能手机", "芯片", "电脑", "长续航", "iphone", "手机 电脑", "不存在"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = local_db.LocalDatabase(str(tmp_path / "search.sqlite3"))
+    manager = DatabaseManager(connector=database.connect, pool_size=2, slow_query_ms=None)
+    manager.connect()
+    yield manager
+    manager.disconnect()
+
+
+@pytest.fixture
+def products(db):
+    service = ProductService(db, search_index=ProductSearchIndex())
+    for name, description in CATALOGUE:
+        service.create_product(name, 10, None, description)
+    # 先加载，其后的写入走增量维护
+    service.search_products_ranked("手机")
+    return service
+
+
+def assert_matches_rebuild(service, queries=QUERIES):
+    fresh = ProductSearchIndex()
+    fresh.load(service.db.fetch_all(service.SEARCH_INDEX_QUERY))
+    assert len(service.search_index) == len(fresh)
+    for query in queries:
+        hits, total = service.search_index.search(query, limit=100)
+        expected, expected_total = fresh.search(query, limit=100)
+        assert total == expected_total
+        assert [product_id for product_id, _ in hits] == [product_id for product_id, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
+
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert tokenize("华为智能手机 iPhone15") == ["华为", "为智", "智能", "能手", "手机", "iphone15"]
+    assert tokenize("壳") == ["壳"]
+    assert tokenize(None) == []
+
+
+def test_ranking_prefers_name_matches(products):
+    rows, total = products.search_products_ranked("智能")
+    # 名称命中按 name_weight 加权，排在仅描述命中的商品之前
+    assert [row['product_name'] for row in rows][:2] == ["华为智能手机", "小米智能手机"]
+    assert total == 3
+
+
+def test_create_is_searchable(products):
+    product_id = products.create_product("荣耀智能手机", 10, None, "麒麟芯片")
+    rows, total = products.search_products_ranked("荣耀")
+    assert [row['product_id'] for row in rows] == [product_id]
+    assert total == 1
+    assert_matches_rebuild(products)
+
+
+@pytest.mark.parametrize("fields", [
+    {"product_name": "折叠屏手机"},
+    {"description": "全新芯片，超长续航"},
+    {"product_name": "平板电脑", "description": None},
+    {"price": 20},
+])
+def test_update_reindexes_changed_fields(products, fields):
+    products.update_product(1, **fields)
+    assert_matches_rebuild(products, QUERIES + ["折叠屏", "平板", "全新"])
+
+
+def test_update_keeps_untouched_field(products):
+    products.update_product(1, product_name="旗舰机")
+    hits, _ = products.search_index.search("麒麟")
+    assert [product_id for product_id, _ in hits] == [1]
+    assert products.search_index.search("华为") == ([], 0)
+
+
+def test_delete_drops_hits_and_document_frequency(products):
+    products.delete_product(1)
+    products.delete_product(2)
+    hits, total = products.search_index.search("智能")
+    assert [product_id for product_id, _ in hits] == [3]
+    assert total == 1
+    assert_matches_rebuild(products)
+
+
+def test_offset_pages_cover_all_hits_once(products):
+    for i in range(23):
+        products.create_product(f"手机配件 {i}", 10, None, "手机" * (i % 4 + 1))
+    products.delete_product(7)
+    full, total = products.search_index.search("手机", limit=100)
+    assert total == len(full)
+    seen = []
+    for offset in range(0, total, 5):
+        page, page_total = products.search_index.search("手机", limit=5, offset=offset)
+        assert page_total == total
+        seen.extend(page)
+    assert seen == full
+    assert [product_id for product_id, _ in full] == sorted(
+        (product_id for product_id, _ in full), key=lambda pid: (-dict(full)[pid], pid))
+
+
+def test_ranked_pages_follow_index_order(products):
+    pages = [products.search_products_ranked("手机", limit=2, offset=offset) for offset in (0, 2, 4)]
+    hits, total = products.search_index.search("手机", limit=100)
+    assert [row['product_id'] for rows, _ in pages for row in rows] == [product_id for product_id, _ in hits]
+    assert {page_total for _, page_total in pages} == {total}
+
+
+def test_compaction_preserves_results(db):
+    index = ProductSearchIndex()
+    service = ProductService(db, search_index=index)
+    for name, description in CATALOGUE:
+        service.create_product(name, 10, None, description)
+    service.search_products_ranked("手机")
+    # 反复更新留下大量失效文档号，超过阈值后压缩重建
+    for i in range(1200):
+        index.update(1 + i % 3, description=f"第 {i} 版 芯片")
+    assert index._dead < 1024
+    fresh = ProductSearchIndex()
+    fresh.load({'product_id': product_id, 'product_name': name,
+                'description': f"第 {1197 + (product_id - 1)} 版 芯片" if product_id <= 3 else description}
+               for product_id, (name, description) in enumerate(CATALOGUE, start=1))
+    for query in QUERIES + ["第 1198 版"]:
+        hits, total = index.search(query, limit=100)
+        expected, expected_total = fresh.search(query, limit=100)
+        assert total == expected_total
+        assert [product_id for product_id, _ in hits] == [product_id for product_id, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
+
+
+def test_without_index_falls_back_to_like(db):
+    service = ProductService(db)
+    service.create_product("蓝牙耳机", 10, None, "降噪")
+    rows, total = service.search_products_ranked("耳机")
+    assert [row['product_name'] for row in rows] == ["蓝牙耳机"]
+    assert total is None
@@ -0,0 +1,160 @@
+"""
+事务作用域的行为测试：嵌套作用域（保存点）回滚、提交失败、提交/回滚回调的执行时机与顺序
+以本地数据库替身（local_db.py）运行，不需要 MySQL：python -m pytest -q test_transactions.py
+"""
+
+from mysql.connector import errors
+import pytest
+
+import local_db
+from code import DatabaseManager, TransactionAbortedError
+
+INSERT_CATEGORY = "INSERT INTO categories (category_name) VALUES (%s)"
+
+
+class FlakyConnection(local_db.LocalConnection):
+    """可按需让 COMMIT、ROLLBACK TO SAVEPOINT 失败的连接，并记录执行过的语句"""
+
+    fail_commit = False
+    fail_rollback_to = False
+
+    def __init__(self, path: str, busy_timeout: float, statements: list):
+        super().__init__(path, busy_timeout)
+        self.statements = statements
+
+    def cursor(self, dictionary: bool = False, prepared: bool = False, buffered=None):
+        cursor = super().cursor(dictionary)
+        execute = cursor.execute
+
+        def traced(query, params=()):
+            self.statements.append(query)
+            if query.startswith("ROLLBACK TO") and FlakyConnection.fail_rollback_to:
+                raise errors.ProgrammingError(msg="SAVEPOINT does not exist", errno=1305)
+            return execute(query, params)
+
+        cursor.execute = traced
+        return cursor
+
+    def commit(self):
+        if FlakyConnection.fail_commit:
+            raise errors.OperationalError(msg="Lost connection to MySQL server during query", errno=2013)
+        super().commit()
+
+
+@pytest.fixture
+def statements():
+    return []
+
+
+@pytest.fixture
+def db(tmp_path, statements):
+    path = str(tmp_path / "tx.sqlite3")
+    local_db.LocalDatabase(path)
+    manager = DatabaseManager(connector=lambda **_: FlakyConnection(path, 5.0, statements),
+                              pool_size=2, max_overflow=0, slow_query_ms=None)
+    manager.connect()
+    yield manager
+    FlakyConnection.fail_commit = False
+    FlakyConnection.fail_rollback_to = False
+    manager.disconnect()
+
+
+def category_names(db):
+    return [row['category_name'] for row in db.fetch_all("SELECT category_name FROM categories ORDER BY category_id")]
+
+
+def test_nested_rollback_keeps_outer_work(db):
+    events = []
+    with db.transaction():
+        db.execute_insert(INSERT_CATEGORY, ("outer",), on_commit=lambda _: events.append("outer committed"))
+        with pytest.raises(ValueError):
+            with db.transaction():
+                db.execute_insert(INSERT_CATEGORY, ("inner",), on_commit=lambda _: events.append("inner committed"))
+                db.after_rollback(lambda: events.append("inner rolled back"))
+                raise ValueError("inner failed")
+        assert events == ["inner rolled back"]
+    assert category_names(db) == ["outer"]
+    assert events == ["inner rolled back", "outer committed"]
+
+
+def test_outer_rollback_discards_released_savepoints(db):
+    events = []
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.after_rollback(lambda: events.append("outer"))
+            with db.transaction():
+                db.execute_insert(INSERT_CATEGORY, ("inner",), on_commit=lambda _: events.append("committed"))
+                db.after_rollback(lambda: events.append("inner"))
+            raise ValueError("outer failed")
+    assert category_names(db) == []
+    assert events == ["inner", "outer"]
+
+
+def test_callback_order(db):
+    events = []
+    with db.transaction():
+        db.after_commit(lambda: events.append("commit 1"))
+        db.after_commit(lambda: events.append("commit 2"))
+        db.after_rollback(lambda: events.append("rollback 1"))
+        assert events == []
+    assert events == ["commit 1", "commit 2"]
+
+    events.clear()
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.after_commit(lambda: events.append("commit"))
+            db.after_rollback(lambda: events.append("rollback 1"))
+            db.after_rollback(lambda: events.append("rollback 2"))
+            raise ValueError("failed")
+    assert events == ["rollback 2", "rollback 1"]
+
+
+def test_failing_callback_does_not_affect_commit(db):
+    events = []
+    with db.transaction():
+        db.execute_insert(INSERT_CATEGORY, ("kept",))
+        db.after_commit(lambda: 1 / 0)
+        db.after_commit(lambda: events.append("after failure"))
+    assert category_names(db) == ["kept"]
+    assert events == ["after failure"]
+
+
+def test_commit_failure_runs_rollback_callbacks(db):
+    events = []
+    FlakyConnection.fail_commit = True
+    with pytest.raises(errors.OperationalError) as raised:
+        with db.transaction():
+            db.execute_insert(INSERT_CATEGORY, ("lost",))
+            db.after_commit(lambda: events.append("commit"))
+            db.after_rollback(lambda: events.append("rollback"))
+    assert raised.value.errno == 2013
+    assert events == ["rollback"]
+    FlakyConnection.fail_commit = False
+    assert category_names(db) == []
+    assert not db.in_transaction
+
+
+def test_deadlock_in_savepoint_skips_rollback_to(db, statements):
+    events = []
+    with pytest.raises(errors.DatabaseError) as raised:
+        with db.transaction():
+            db.after_rollback(lambda: events.append("outer"))
+            with db.transaction():
+                db.after_rollback(lambda: events.append("inner"))
+                raise errors.DatabaseError(msg="Deadlock found when trying to get lock", errno=1213)
+    assert raised.value.errno == 1213
+    assert not any(query.startswith("ROLLBACK TO") for query in statements)
+    assert events == ["inner", "outer"]
+
+
+def test_failed_rollback_to_savepoint_aborts_transaction(db):
+    FlakyConnection.fail_rollback_to = True
+    with pytest.raises(TransactionAbortedError):
+        with db.transaction():
+            db.execute_insert(INSERT_CATEGORY, ("outer",))
+            with pytest.raises(TransactionAbortedError) as raised:
+                with db.transaction():
+                    raise ValueError("inner failed")
+            assert isinstance(raised.value.__cause__, ValueError)
+    FlakyConnection.fail_rollback_to = False
+    assert category_names(db) == []
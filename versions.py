@@ -0,0 +1,101 @@
+"""
+数据版本计数器
+code.py 中的写方法在事务提交后递增受影响的表级或实体级计数器，server.py 由计数器拼出 ETag，
+条件 GET（If-None-Match）命中时直接返回 304，不查询数据库也不序列化响应体。
+
+计数器键：
+    categories      分类表任一写入
+    products        商品表任一写入（含库存调整与下单预留/归还）
+    users           用户名或姓名变更、删除用户（订单行中带有 username/full_name）
+    order:<id>      单个订单的状态变更与删除
+"""
+
+from typing import Dict, Iterable, Optional
+import os
+import threading
+
+
+class VersionCounters:
+    """版本计数器接口"""
+
+    def bump(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def get(self, keys: Iterable[str]) -> Optional[list]:
+        """返回 [纪元, 各键版本...]；不提供版本时返回 None"""
+        raise NotImplementedError
+
+    def etag(self, *keys: str) -> Optional[str]:
+        """由各键当前版本拼出弱 ETag；纪元在进程重启（本地计数器）或共享存储清空后变化，旧 ETag 随之失效"""
+        values = self.get(keys)
+        if values is None:
+            return None
+        return 'W/"' + "-".join(str(v) for v in values) + '"'
+
+    def stats(self) -> Dict[str, object]:
+        return {}
+
+
+class NullVersions(VersionCounters):
+    """不记录版本，未配置时使用（不生成 ETag）"""
+
+    def bump(self, *keys: str) -> None:
+        pass
+
+    def get(self, keys: Iterable[str]) -> Optional[list]:
+        return None
+
+
+NULL_VERSIONS = NullVersions()
+
+
+def _new_epoch() -> str:
+    return os.urandom(4).hex()
+
+
+class LocalVersions(VersionCounters):
+    """进程内计数器；多进程部署时各进程看不到彼此的写入，应改用 SharedVersions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.epoch = _new_epoch()
+        self.bumps = 0
+
+    def bump(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._counters[key] = self._counters.get(key, 0) + 1
+            self.bumps += len(keys)
+
+    def get(self, keys: Iterable[str]) -> list:
+        counters = self._counters
+        return [self.epoch] + [counters.get(key, 0) for key in keys]
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "local", "keys": len(self._counters), "bumps": self.bumps}
+
+
+class SharedVersions(VersionCounters):
+    """跨进程共享的计数器，后端为 Redis 兼容客户端（或 LocalStore 本地替身）：
+    递增用 INCR，读取用一次 MGET 连同纪元键取回"""
+
+    def __init__(self, client, prefix: str = "ecommerce:ver:"):
+        self.client = client
+        self.prefix = prefix
+        self.epoch_key = prefix + "epoch"
+
+    def bump(self, *keys: str) -> None:
+        for key in keys:
+            self.client.incr(self.prefix + key)
+
+    def get(self, keys: Iterable[str]) -> list:
+        values = self.client.mget([self.epoch_key] + [self.prefix + key for key in keys])
+        if values[0] is None:
+            # 共享存储被清空（或首次使用）时计数器从零开始，换一个纪元避免与旧 ETag 相同
+            self.client.set(self.epoch_key, _new_epoch(), nx=True)
+            values[0] = self.client.get(self.epoch_key)
+        return [v.decode() if isinstance(v, bytes) else (v if v is not None else 0) for v in values]
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "shared"}